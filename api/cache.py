@@ -0,0 +1,131 @@
+import time
+import asyncio
+import hashlib
+
+
+class HashingReader:
+    """
+    File-like wrapper that hashes everything read through it, so an upload
+    can be content-addressed in the same pass that streams it to R2.
+    Deliberately not seekable: boto3 then reads it strictly front to back.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed index of finished upscales, stored in R2 next to the outputs.
+
+    A cache key covers the input content plus every setting that changes the output
+    (target width/height, quality). Entries live at {prefix}/{cache_key}.json and point
+    at an existing output object. Identical requests that arrive while the first one
+    is still running are coalesced onto it instead of starting another RunPod job.
+
+    Eviction drops entries (and their outputs) older than max_age, then the least
+    recently hit ones until the cached outputs fit in max_bytes.
+    All R2 calls are blocking; run lookup/store/evict in a worker thread.
+    """
+
+    def __init__(self, storage_manager, max_bytes, max_age, prefix="cache", evict_interval=600):
+        self.storage_manager = storage_manager
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.prefix = prefix
+        self.evict_interval = evict_interval
+        self._last_evict = 0
+        # cache_key -> future resolving to the output key (or None if the job failed)
+        self._inflight = {}
+
+    @staticmethod
+    def make_key(content_id, target_width, target_height, quality):
+        return hashlib.sha256(f"{content_id}:{target_width}x{target_height}:{quality}".encode()).hexdigest()
+
+    def _entry_key(self, cache_key):
+        return f"{self.prefix}/{cache_key}.json"
+
+    def lookup(self, cache_key):
+        """
+        Output key for a cached result, or None.
+        """
+        entry = self.storage_manager.get_json(self._entry_key(cache_key))
+        if not entry:
+            return None
+
+        now = time.time()
+        if now - entry.get("created_at", 0) > self.max_age:
+            return None
+        if not self.storage_manager.head_object(entry["output_key"]):
+            # Output was deleted behind our back; the entry is stale
+            return None
+
+        entry["last_hit_at"] = now
+        self.storage_manager.put_json(self._entry_key(cache_key), entry)
+        return entry["output_key"]
+
+    def store(self, cache_key, output_key):
+        info = self.storage_manager.head_object(output_key)
+        if not info:
+            return
+        now = time.time()
+        self.storage_manager.put_json(self._entry_key(cache_key), {
+            "output_key": output_key,
+            "size": info["size"],
+            "created_at": now,
+            "last_hit_at": now,
+        })
+        if now - self._last_evict > self.evict_interval:
+            self._last_evict = now
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for obj in self.storage_manager.list_objects(f"{self.prefix}/"):
+            entry = self.storage_manager.get_json(obj["key"])
+            if entry:
+                entries.append((obj["key"], entry))
+
+        now = time.time()
+        expired = [(key, entry) for key, entry in entries if now - entry.get("created_at", 0) > self.max_age]
+        live = [(key, entry) for key, entry in entries if now - entry.get("created_at", 0) <= self.max_age]
+
+        # Least recently hit first
+        live.sort(key=lambda item: item[1].get("last_hit_at", 0))
+        total = sum(entry.get("size", 0) for _, entry in live)
+        over_budget = []
+        while live and total > self.max_bytes:
+            key, entry = live.pop(0)
+            total -= entry.get("size", 0)
+            over_budget.append((key, entry))
+
+        evicted = expired + over_budget
+        if evicted:
+            keys = [key for key, _ in evicted] + [entry["output_key"] for _, entry in evicted]
+            self.storage_manager.delete_objects(keys)
+            print(f"Result cache: evicted {len(evicted)} entries, {total / 1024 ** 3:.2f} GB cached")
+
+    # --- Request coalescing (in-process) ---
+
+    def inflight(self, cache_key):
+        """
+        Future for an identical job that is already running, or None.
+        """
+        return self._inflight.get(cache_key)
+
+    def begin(self, cache_key):
+        self._inflight[cache_key] = asyncio.get_running_loop().create_future()
+
+    def finish(self, cache_key, output_key):
+        future = self._inflight.pop(cache_key, None)
+        if future and not future.done():
+            future.set_result(output_key)
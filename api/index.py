@@ -1,14 +1,22 @@
 import os
+import re
+import json
+import math
 import time
 import asyncio
 import base64
-import httpx
-import uvicorn
-import aiofiles
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+import hmac
+import hashlib
+import uuid
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,13 +24,78 @@ load_dotenv()
 # Try-except block to handle different import contexts (local vs vercel)
 try:
     from .storage import StorageManager
+    from .jobs import JobManager, TERMINAL_STATUSES
+    from .job_store import JobStore
+    from .runpod_client import RunPodClient, RunPodError, EndpointPool, StatusPoller, RUNPOD_API_BASE
+    from .cache import HashingReader, ResultCache
+    from .segments import FFmpegError, ffmpeg_available, probe_duration, split_at_keyframes, concat_segments, extract_clip
+    from .metrics import registry
+    from .scheduler import JobScheduler, AdmissionError, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 except ImportError:
     from storage import StorageManager
+    from jobs import JobManager, TERMINAL_STATUSES
+    from job_store import JobStore
+    from runpod_client import RunPodClient, RunPodError, EndpointPool, StatusPoller, RUNPOD_API_BASE
+    from cache import HashingReader, ResultCache
+    from segments import FFmpegError, ffmpeg_available, probe_duration, split_at_keyframes, concat_segments, extract_clip
+    from metrics import registry
+    from scheduler import JobScheduler, AdmissionError, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+
+# Durable job table, so a restart resumes in-flight jobs instead of orphaning them. Off unless
+# JOB_DB_PATH names a file. One API process owns a file at a time (a restart resumes that
+# process's jobs); other workers pointed at the same file run without a store, so give each
+# worker its own path where that matters.
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "")
+JOB_DB_RETENTION = int(os.getenv("JOB_DB_RETENTION_DAYS", "7")) * 24 * 3600
+
+
+def open_job_store(path):
+    if not path:
+        return None
+    try:
+        return JobStore(path)
+    except Exception as e:
+        print(f"Warning: could not open job store at {path} ({e}); jobs will not survive a restart.")
+        return None
+
 
 storage_manager = StorageManager()
+job_manager = JobManager(store=open_job_store(JOB_DB_PATH))
+
 
+@asynccontextmanager
+async def lifespan(app):
+    if job_manager.store:
+        removed = job_manager.store.delete_finished_before(time.time() - JOB_DB_RETENTION, TERMINAL_STATUSES)
+        if removed:
+            print(f"Job store: removed {removed} finished jobs past retention")
+        task = asyncio.create_task(recover_jobs())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    yield
+    # The RunPod clients and poller start lazily on first use; release them on shutdown
+    await status_poller.stop()
+    await endpoint_pool.close()
+    if job_manager.store:
+        job_manager.store.close()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.middleware("http")
+async def reject_when_saturated(request: Request, call_next):
+    # Turn uploads away before Starlette spools the body when the job queue is already full.
+    # Registered before CORS so the 429 still carries CORS headers.
+    if request.method == "POST" and request.url.path == "/api/upscale":
+        try:
+            scheduler.check(client_id_for(request))
+        except AdmissionError as e:
+            JOBS_REJECTED.inc()
+            return JSONResponse(
+                status_code=429, content={"detail": str(e)}, headers={"Retry-After": str(e.retry_after)}
+            )
+    return await call_next(request)
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,163 +105,1500 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Vercel handles static files from /public automatically. No need to mount.
-# But for local dev we might miss it. However, the priority is Vercel fix.
+# Vercel handles static files from /public automatically; the mount at the end of this
+# file is for local dev only.
 
 RUNPOD_API_KEY = os.getenv("RUNPOD_API_KEY")
 RUNPOD_ENDPOINT_ID = "hgn3kb2km6tnxi"
-RUNPOD_URL = f"https://api.runpod.ai/v2/{RUNPOD_ENDPOINT_ID}/run"
-RUNPOD_STATUS_URL = f"https://api.runpod.ai/v2/{RUNPOD_ENDPOINT_ID}/status"
+# Override to point at a local stand-in (see bench/fake_runpod.py)
+RUNPOD_API_BASE_URL = os.getenv("RUNPOD_API_BASE", RUNPOD_API_BASE)
 
-HEADERS = {
-    "Authorization": f"Bearer {RUNPOD_API_KEY}",
-    "Content-Type": "application/json"
-}
+# Comma-separated endpoint ids, e.g. one per GPU type; each job goes to the one expected to start it
+# soonest. Unset or blank (e.g. "" or ","), the default endpoint is used.
+RUNPOD_ENDPOINT_IDS = [
+    endpoint_id.strip()
+    for endpoint_id in os.getenv("RUNPOD_ENDPOINT_IDS", "").split(",")
+    if endpoint_id.strip()
+] or [RUNPOD_ENDPOINT_ID]
+# With several endpoints, a job still IN_QUEUE after this long is also submitted to the
+# next-best endpoint; the first copy to start wins and the other is cancelled
+RUNPOD_HEDGE_AFTER = float(os.getenv("RUNPOD_HEDGE_AFTER", "45"))
 
-# 10 minute timeout for RunPod in case of slow queue
-TIMEOUT_SETTINGS = httpx.Timeout(600.0, connect=60.0)
+# One pooled client per endpoint and one status poller shared by every in-flight job
+endpoint_pool = EndpointPool([
+    RunPodClient(RUNPOD_API_KEY, endpoint_id, base_url=RUNPOD_API_BASE_URL)
+    for endpoint_id in RUNPOD_ENDPOINT_IDS
+])
+status_poller = StatusPoller(endpoint_pool.endpoints[0].client)
 
-@app.post("/api/upscale")
-async def upscale_video(
-    file: UploadFile = File(...),
+# Webhook mode: RunPod calls us back when a job finishes, polling becomes a slow safety net.
+# Needs the public URL of this API and a secret used to sign the callback URLs.
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+RUNPOD_WEBHOOK_SECRET = os.getenv("RUNPOD_WEBHOOK_SECRET", "")
+WEBHOOK_ENABLED = bool(PUBLIC_BASE_URL and RUNPOD_WEBHOOK_SECRET)
+WEBHOOK_SAFETY_POLL_INTERVAL = 30.0
+
+# Idle SSE connections get a comment line this often
+SSE_KEEPALIVE_SECONDS = 15
+
+# Browser multipart uploads (S3 limits: parts >= 5 MB except the last, at most 10,000 parts)
+UPLOADS_PREFIX = "uploads"
+MIN_PART_SIZE = 8 * 1024 * 1024
+MAX_PARTS = 10000
+MAX_PART_URLS_PER_REQUEST = 1000
+
+DEFAULT_QUALITY = "balanced"
+
+# Finished outputs are reused for identical (input, resolution, quality) requests
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_GB", "50")) * 1024 ** 3
+RESULT_CACHE_MAX_AGE = int(os.getenv("RESULT_CACHE_MAX_AGE_DAYS", "30")) * 24 * 3600
+result_cache = ResultCache(storage_manager, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_AGE)
+
+# Long videos are split at keyframes and upscaled as parallel RunPod jobs (needs ffmpeg on this host)
+SEGMENTING_ENABLED = ffmpeg_available() and os.getenv("SEGMENT_LONG_VIDEOS", "true").lower() == "true"
+SEGMENT_MIN_DURATION = float(os.getenv("SEGMENT_MIN_DURATION", "300"))
+SEGMENT_SECONDS = float(os.getenv("SEGMENT_SECONDS", "60"))
+SEGMENT_MAX_COUNT = 20
+SEGMENT_MAX_ATTEMPTS = 3
+
+# Preview jobs: the first seconds of the input are upscaled first, as a high-priority job of their
+# own, so quality can be checked before the full run (which can wait for the user to confirm it)
+PREVIEW_ENABLED = ffmpeg_available()
+PREVIEWS_PREFIX = "previews"
+PREVIEW_SECONDS = float(os.getenv("PREVIEW_SECONDS", "5"))
+PREVIEW_MAX_SECONDS = 30
+PREVIEW_MAX_FRAMES = 900
+# A full job still unconfirmed after this long is cancelled
+CONFIRMATION_TIMEOUT = int(os.getenv("PREVIEW_CONFIRMATION_TIMEOUT_MINUTES", "60")) * 60
+# job_id -> future resolved with the user's decision (True: run the full job)
+pending_confirmations = {}
+
+# HLS preview: the handler upscales in chunks and publishes each as an fMP4 segment of a growing
+# playlist, so the frontend can start playing within seconds instead of waiting for the full MP4.
+# Opt-in: chunking runs process_video once per chunk plus a concat, and a chunked output cannot be
+# uploaded while it is encoded (the handler's STREAM_IO), so previews trade throughput for latency.
+HLS_PREVIEW_ENABLED = os.getenv("HLS_PREVIEW", "false").lower() == "true"
+HLS_PREFIX = "hls"
+HLS_PLAYLIST_NAME = "playlist.m3u8"
+HLS_SEGMENT_SECONDS = float(os.getenv("HLS_SEGMENT_SECONDS", "10"))
+HLS_MAX_SEGMENTS = 100
+# Names the handler gives segments in its playlist; only these are signed for playback
+HLS_SEGMENT_NAME = re.compile(r"(init_\d{4}\.mp4|seg_\d{4}\.m4s)")
+# Previews only matter until the MP4 is ready; older ones are swept at most once per interval
+HLS_PREVIEW_MAX_AGE = int(os.getenv("HLS_PREVIEW_MAX_AGE_HOURS", "24")) * 3600
+HLS_SWEEP_INTERVAL = 3600
+hls_swept_at = 0.0
+
+# Admission control: caps on jobs running at RunPod (overall and per client) and a bounded wait
+# queue; beyond that the API answers 429 with Retry-After instead of piling up uploads.
+MAX_INFLIGHT_JOBS = int(os.getenv("MAX_INFLIGHT_JOBS", "10"))
+MAX_INFLIGHT_JOBS_PER_CLIENT = int(os.getenv("MAX_INFLIGHT_JOBS_PER_CLIENT", "3"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "50"))
+MAX_QUEUED_JOBS_PER_CLIENT = int(os.getenv("MAX_QUEUED_JOBS_PER_CLIENT", "10"))
+scheduler = JobScheduler(
+    MAX_INFLIGHT_JOBS, MAX_INFLIGHT_JOBS_PER_CLIENT, MAX_QUEUED_JOBS, MAX_QUEUED_JOBS_PER_CLIENT
+)
+# Reverse proxies in front of the API that append the address they saw to X-Forwarded-For.
+# Clients choose everything left of those hops, so only the hop added by the outermost trusted
+# proxy identifies them. Vercel's edge is one; 0 uses the peer address and ignores the header.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1" if os.getenv("VERCEL") else "0"))
+
+# Priority classes: short clips, small files and <=720p run first; 4K and huge inputs last
+HIGH_PRIORITY_MAX_HEIGHT = 720
+HIGH_PRIORITY_MAX_BYTES = 50 * 1024 * 1024
+HIGH_PRIORITY_MAX_DURATION = 60
+LOW_PRIORITY_MIN_HEIGHT = 2160
+LOW_PRIORITY_MIN_BYTES = 2 * 1024 ** 3
+
+# Batches: items start at most BATCH_CONCURRENCY at a time (each still goes through the scheduler)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", str(MAX_QUEUED_JOBS_PER_CLIENT)))
+MAX_ACTIVE_BATCHES = int(os.getenv("MAX_ACTIVE_BATCHES", "20"))
+# Longest pause before a batch item asks the scheduler again after being turned away
+BATCH_ADMISSION_RETRY_MAX = 5
+
+# --- Metrics (exposed at /api/metrics) ---
+JOBS_IN_FLIGHT = registry.gauge("upscale_jobs_in_flight", "Upscale jobs accepted and not yet finished")
+JOBS_TOTAL = registry.counter("upscale_jobs_total", "Finished upscale jobs by outcome", ["outcome"])
+STAGE_SECONDS = registry.histogram("upscale_stage_seconds", "Time spent in each pipeline stage", ["stage"])
+HANDLER_STAGE_SECONDS = registry.histogram(
+    "upscale_handler_stage_seconds", "Stage timings reported by the RunPod handler", ["stage"]
+)
+BYTES_TOTAL = registry.counter("upscale_bytes_total", "Video bytes moved through R2", ["direction"])
+JOB_STORE_SIZE = registry.gauge("upscale_jobs_tracked", "Jobs held in the job registry")
+POLLER_TRACKED = registry.gauge("runpod_poller_tracked_requests", "RunPod requests the status poller is tracking")
+RUNPOD_HEDGES = registry.counter("runpod_hedges_total", "Jobs re-submitted to a second endpoint by outcome", ["outcome"])
+ENDPOINT_EXPECTED_WAIT = registry.gauge(
+    "runpod_endpoint_expected_wait_seconds", "Expected queue wait per RunPod endpoint", ["endpoint"]
+)
+JOBS_REJECTED = registry.counter("upscale_jobs_rejected_total", "Job submissions turned away with 429")
+SCHEDULER_RUNNING = registry.gauge("scheduler_jobs_running", "Job slots held at RunPod (weighted)")
+SCHEDULER_QUEUED = registry.gauge("scheduler_jobs_queued", "Admitted jobs waiting for a slot")
+URL_CACHE_ENTRIES = registry.gauge("presigned_url_cache_entries", "Presigned URLs held for reuse")
+
+# Input/output URLs must stay valid while the job waits in the RunPod queue
+JOB_URL_EXPIRATION = 6 * 3600
+
+# Handler output goes to R2 as a multipart upload: 64 MB parts, up to 12.5 GB per video
+OUTPUT_PART_SIZE = 64 * 1024 * 1024
+OUTPUT_MAX_PARTS = 200
+
+# Strong references to running job tasks so they are not garbage collected
+background_tasks = set()
+
+
+class JobRequest(BaseModel):
+    key: str
+    filename: Optional[str] = None
     target_resolution: str = "1920x1080"
-):
-    print(f"Received file: {file.filename} | Target: {target_resolution}")
-    
+    quality: str = DEFAULT_QUALITY
+    # Upscale a short excerpt first; with confirm, the full job waits for /api/jobs/{id}/confirm
+    preview: bool = False
+    preview_seconds: Optional[float] = None
+    preview_frames: Optional[int] = None
+    confirm: bool = False
+
+
+class BatchItemRequest(BaseModel):
+    key: str
+    filename: Optional[str] = None
+    # Fall back to the batch-level settings
+    target_resolution: Optional[str] = None
+    quality: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItemRequest]
+    target_resolution: str = "1920x1080"
+    quality: str = DEFAULT_QUALITY
+    concurrency: Optional[int] = None
+
+
+class MultipartCreateRequest(BaseModel):
+    filename: str
+    size: int = Field(gt=0)
+    content_type: Optional[str] = None
+
+
+class MultipartUploadRef(BaseModel):
+    key: str
+    upload_id: str
+
+
+class MultipartPartUrlsRequest(MultipartUploadRef):
+    part_numbers: List[int]
+
+
+class CompletedPart(BaseModel):
+    part_number: int
+    etag: str
+
+
+class MultipartCompleteRequest(MultipartUploadRef):
+    parts: List[CompletedPart]
+
+
+def prepare_output_targets(output_object_key):
+    """
+    Presigned destinations for the handler's output: a multipart upload it can fill
+    with parallel part PUTs, plus a single PUT URL for handlers that predate it.
+    Blocking (talks to R2); run it in a worker thread.
+    Returns (targets for the RunPod input, multipart upload id or None).
+    """
+    # We tell RunPod: "When you are done, PUT the file to this URL"
+    presigned_upload_url = storage_manager.generate_presigned_upload_url(
+        output_object_key, expiration=JOB_URL_EXPIRATION
+    )
+    if not presigned_upload_url:
+        print("Warning: Could not generate R2 Upload URL. RunPod logic might fail if relying on it.")
+        # We continue, but RunPod might fallback to base64 if handler handles it.
+        return {"output_upload_url": None}, None
+
+    targets = {"output_upload_url": presigned_upload_url} # This is the key for updated_handler.py
+
+    upload_id = storage_manager.create_multipart_upload(output_object_key, "video/mp4")
+    if not upload_id:
+        return targets, None
+
+    # The output size is unknown up front, so presign enough parts for the largest output we accept
+    part_numbers = range(1, OUTPUT_MAX_PARTS + 1)
+    part_urls = storage_manager.generate_presigned_part_urls(
+        output_object_key, upload_id, part_numbers, expiration=JOB_URL_EXPIRATION
+    )
+    if not part_urls:
+        storage_manager.abort_multipart_upload(output_object_key, upload_id)
+        return targets, None
+
+    targets["output_multipart"] = {
+        "part_size": OUTPUT_PART_SIZE,
+        "part_urls": [part_urls[n] for n in part_numbers],
+    }
+    return targets, upload_id
+
+
+def hls_key(job_id, name):
+    return f"{HLS_PREFIX}/{job_id}/{name}"
+
+
+def prepare_hls_targets(job_id):
+    """
+    Presigned PUT URLs for the handler's HLS preview: the playlist, and an init and media
+    segment per chunk. Blocking; run it in a worker thread. None when previews are off.
+    """
+    if not HLS_PREVIEW_ENABLED or not storage_manager.configured:
+        return None
+
+    def sign(name):
+        return storage_manager.generate_presigned_upload_url(hls_key(job_id, name), expiration=JOB_URL_EXPIRATION)
+
+    playlist_url = sign(HLS_PLAYLIST_NAME)
+    if not playlist_url:
+        return None
+    return {
+        "segment_seconds": HLS_SEGMENT_SECONDS,
+        "playlist_url": playlist_url,
+        "init_urls": [sign(f"init_{i:04d}.mp4") for i in range(HLS_MAX_SEGMENTS)],
+        "segment_urls": [sign(f"seg_{i:04d}.m4s") for i in range(HLS_MAX_SEGMENTS)],
+    }
+
+
+def hls_progress(status_data):
+    """
+    Job fields for the preview segments the handler has reported as progress (empty if none).
+    """
+    output_data = status_data.get("output")
+    if isinstance(output_data, dict) and output_data.get("hls_segments"):
+        return {"hls_segments": output_data["hls_segments"]}
+    return {}
+
+
+def sign_hls_playlist(job_id, playlist):
+    """
+    Point the segment names in a stored playlist at signed download URLs.
+    """
+    def sign(name):
+        if not HLS_SEGMENT_NAME.fullmatch(name):
+            return name
+        return storage_manager.generate_presigned_download_url(hls_key(job_id, name))
+
+    lines = []
+    for line in playlist.splitlines():
+        if line.startswith("#EXT-X-MAP:"):
+            line = re.sub(r'URI="([^"]+)"', lambda match: f'URI="{sign(match.group(1))}"', line)
+        elif line and not line.startswith("#"):
+            line = sign(line)
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def delete_hls_preview(job_id):
+    keys = [obj["key"] for obj in storage_manager.list_objects(f"{HLS_PREFIX}/{job_id}/")]
+    storage_manager.delete_objects(keys)
+
+
+def expire_hls_previews():
+    """
+    Delete preview objects older than HLS_PREVIEW_MAX_AGE, at most once per HLS_SWEEP_INTERVAL.
+    Blocking; run it in a worker thread.
+    """
+    global hls_swept_at
+    now = time.time()
+    if now - hls_swept_at < HLS_SWEEP_INTERVAL:
+        return
+    hls_swept_at = now
+    stale = [
+        obj["key"]
+        for obj in storage_manager.list_objects(f"{HLS_PREFIX}/")
+        if now - obj["last_modified"] > HLS_PREVIEW_MAX_AGE
+    ]
+    if stale:
+        storage_manager.delete_objects(stale)
+        print(f"HLS previews: removed {len(stale)} expired objects")
+
+
+def finish_output_upload(output_data, output_object_key, upload_id):
+    """
+    Complete the output multipart upload from the part ETags the handler reported.
+    Blocking; run it in a worker thread.
+    """
+    parts = output_data.get("output_parts") if isinstance(output_data, dict) else None
+    if not parts:
+        # Handler used the single PUT URL (or returned Base64); the multipart upload is unused
+        storage_manager.abort_multipart_upload(output_object_key, upload_id)
+        return
+    if not storage_manager.complete_multipart_upload(output_object_key, upload_id, parts):
+        raise RuntimeError("Could not assemble the upscaled video in R2")
+    print(f"Output assembled from {len(parts)} parts: {output_object_key}")
+
+
+def webhook_token(job_id):
+    return hmac.new(RUNPOD_WEBHOOK_SECRET.encode(), job_id.encode(), hashlib.sha256).hexdigest()
+
+
+def webhook_url(job_id):
+    return f"{PUBLIC_BASE_URL}/api/runpod/webhook/{job_id}?token={webhook_token(job_id)}"
+
+
+def build_job_result(status_data, output_object_key, presigned_upload_url):
+    """
+    Turn a COMPLETED RunPod status payload into the URL the frontend should play.
+    """
+    # Smart Logic:
+    # If we sent an output_upload_url, RunPod should have used it.
+    # RunPod response `output` might be a message like "Output uploaded..." 
+    # OR if the user didn't update the handler yet, it might doubtless contain the base64.
+    output_data = status_data.get("output", {})
+
+    # Generate a VIEW URL (Download URL) from R2
+    if presigned_upload_url:
+        # Assuming success upload
+        view_url = storage_manager.generate_presigned_download_url(output_object_key)
+        if view_url:
+            print(f"Generated R2 View URL: {view_url[:50]}...")
+            return {"url": view_url, "type": "r2_url"}
+
+    # Fallback: Handle Base64 if Handler didn't use R2
+    bg_video_str = None
+    if isinstance(output_data, dict):
+        bg_video_str = output_data.get("video") or output_data.get("output_video")
+    elif isinstance(output_data, str):
+        bg_video_str = output_data
+
+    if bg_video_str and len(str(bg_video_str)) > 100:
+        return {"url": f"data:video/mp4;base64,{bg_video_str}", "type": "data_uri"}
+
+    return {"output": output_data, "type": "raw"}
+
+
+async def claim_cached_output(job_id, cache_key):
+    """
+    Output key of an identical finished (or in-flight) job, or None if this job has to run.
+    When None is returned this job is registered as the one the others wait on.
+    """
+    while True:
+        leader = result_cache.inflight(cache_key)
+        if leader is None:
+            break
+        print(f"[{job_id}] Identical job already running, waiting for its result")
+        output_key = await asyncio.shield(leader)
+        if output_key:
+            return output_key
+        # The other job failed; loop so only one of the waiters retries it
+
+    result_cache.begin(cache_key)
+    output_key = await run_in_threadpool(result_cache.lookup, cache_key)
+    if output_key:
+        result_cache.finish(cache_key, output_key)
+    return output_key
+
+
+def record_runpod_timings(status_data):
+    """
+    Queue wait and execution time as reported by RunPod, plus the handler's own stage breakdown.
+    """
+    if status_data.get("delayTime"):
+        STAGE_SECONDS.labels(stage="runpod_queue").observe(status_data["delayTime"] / 1000)
+    if status_data.get("executionTime"):
+        STAGE_SECONDS.labels(stage="runpod_execution").observe(status_data["executionTime"] / 1000)
+
+    output_data = status_data.get("output")
+    metadata = output_data.get("metadata") if isinstance(output_data, dict) else None
+    if not isinstance(metadata, dict):
+        return
+    for stage, seconds in (metadata.get("timings") or {}).items():
+        HANDLER_STAGE_SECONDS.labels(stage=stage).observe(seconds)
+    if metadata.get("output_size"):
+        BYTES_TOTAL.labels(direction="output").inc(metadata["output_size"])
+
+
+class RunPodAttempt:
+    """
+    One submission of a job to one endpoint, with its own output upload target.
+    """
+
+    def __init__(self, tag, endpoint, request_id, status, upload_id, presigned_upload_url):
+        self.tag = tag
+        self.endpoint = endpoint
+        self.request_id = request_id
+        self.status = status
+        self.upload_id = upload_id
+        self.presigned_upload_url = presigned_upload_url
+        self.submitted_at = time.monotonic()
+        # Set once the attempt leaves IN_QUEUE (or stops being tracked)
+        self.started = asyncio.Event()
+        self.waiter = None
+
+    @property
+    def succeeded(self):
+        return (
+            self.waiter.done()
+            and not self.waiter.cancelled()
+            and self.waiter.exception() is None
+            and self.waiter.result().get("status") == "COMPLETED"
+        )
+
+
+async def submit_attempt(tag, job_input, output_object_key, exclude=()):
+    """
+    Submit a job to the best-ranked endpoint, failing over down the ranking if submission fails.
+    """
+    with STAGE_SECONDS.labels(stage="output_prepare").time():
+        targets, upload_id = await run_in_threadpool(prepare_output_targets, output_object_key)
+    payload = {"input": {**job_input, **targets}}
+    if WEBHOOK_ENABLED:
+        payload["webhook"] = webhook_url(tag)
+
     try:
-        # Parse resolution
-        try:
-            w, h = target_resolution.split("x")
-            target_width = int(w)
-            target_height = int(h)
-        except:
-            target_width, target_height = 1920, 1080
-
-        # 1. Read and Encode Video (Keep Base64 input for simplicty of RunPod Handler V1, 
-        # but optimally we should upload Input to R2 too. For now let's keep input as Base64 to not break too much)
+        error = RunPodError("No RunPod endpoint available")
+        for endpoint in await endpoint_pool.ranked(exclude=exclude):
+            print(f"[{tag}] Sending request to RunPod endpoint {endpoint.id}...")
+            try:
+                with STAGE_SECONDS.labels(stage="runpod_submit").time():
+                    data = await endpoint.client.submit(payload)
+            except RunPodError as e:
+                print(f"[{tag}] Submission to {endpoint.id} failed: {e}")
+                endpoint.record_failure()
+                error = e
+                continue
+            endpoint.record_submit()
+            attempt = RunPodAttempt(
+                tag, endpoint, data.get("id"), data.get("status", "IN_QUEUE"),
+                upload_id, targets["output_upload_url"],
+            )
+            upload_id = None
+            print(f"[{tag}] RunPod Request ID: {attempt.request_id}")
+            return attempt
+        raise error
+    finally:
+        if upload_id:
+            await run_in_threadpool(storage_manager.abort_multipart_upload, output_object_key, upload_id)
+
+
+async def discard_attempt(attempt, output_object_key):
+    """
+    Stop tracking an attempt, cancel it at RunPod if it has not finished and drop its upload.
+    """
+    if not attempt.waiter.done():
+        attempt.waiter.cancel()
+        # Nobody is waiting for this result any more; stop paying for it
         try:
-            content = await file.read()
-            if not content:
-                raise HTTPException(status_code=400, detail="Empty file")
-                
-            video_base64 = base64.b64encode(content).decode('utf-8')
-            print(f"Video encoded to base64. Size: {len(video_base64) / 1024 / 1024:.2f} MB")
-            
+            await attempt.endpoint.client.cancel(attempt.request_id)
         except Exception as e:
-            print(f"Error reading/encoding file: {e}")
-            raise HTTPException(status_code=500, detail="Failed to process video file")
+            print(f"[{attempt.tag}] Could not cancel RunPod job: {e}")
+        await asyncio.gather(attempt.waiter, return_exceptions=True)
+    if attempt.upload_id:
+        await run_in_threadpool(storage_manager.abort_multipart_upload, output_object_key, attempt.upload_id)
+        attempt.upload_id = None
 
-        # 2. Prepare R2 Upload for OUTPUT
-        # We tell RunPod: "When you are done, PUT the file to this URL"
-        output_filename = f"upscaled_{int(time.time())}_{file.filename}"
-        output_object_key = f"outputs/{output_filename}"
-        
-        # Generate Presigned Upload URL for RunPod to use
-        presigned_upload_url = storage_manager.generate_presigned_upload_url(output_object_key)
-        if not presigned_upload_url:
-            print("Warning: Could not generate R2 Upload URL. RunPod logic might fail if relying on it.")
-            # We continue, but RunPod might fallback to base64 if handler handles it.
-
-        # 3. Send to RunPod
-        payload = {
-            "input": {
-                "video": video_base64,
-                "target_width": target_width,
-                "target_height": target_height,
-                "output_upload_url": presigned_upload_url # This is the key for updated_handler.py
+
+async def first_to_start(attempts, timeout=None):
+    """
+    The first of attempts to leave IN_QUEUE, or None if none did within timeout.
+    """
+    signals = {asyncio.ensure_future(attempt.started.wait()): attempt for attempt in attempts}
+    try:
+        done, _ = await asyncio.wait(signals, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for signal in signals:
+            signal.cancel()
+    return signals[done.pop()] if done else None
+
+
+async def still_queued(attempt):
+    """
+    Fresh check before hedging: the poller may not have looked at the attempt for a while.
+    """
+    try:
+        status_data = await attempt.endpoint.client.status(attempt.request_id)
+    except RunPodError:
+        return True
+    return status_data.get("status") == "IN_QUEUE"
+
+
+async def execute_on_runpod(tag, job_input, output_object_key, on_submitted=None, on_status=None):
+    """
+    Run one RunPod job whose output should land at output_object_key.
+    tag names the job in logs and webhook URLs. Returns (status_data, presigned_upload_url)
+    of the COMPLETED job; raises RuntimeError (or RunPodError) otherwise.
+    on_submitted(attempt) is called with the RunPodAttempt the job is waiting on.
+
+    With several endpoints, a job still IN_QUEUE after RUNPOD_HEDGE_AFTER seconds is hedged:
+    a second copy goes to the next-best endpoint, the first copy to start is kept and the
+    other is cancelled. Each copy writes to its own multipart upload, so they never mix parts.
+    """
+    attempts = []
+
+    def track(attempt):
+        def log_status(status, status_data):
+            attempt.status = status
+            print(f"[{attempt.tag}] Polling Status: {status}")
+            if status != "IN_QUEUE":
+                attempt.started.set()
+            if on_status and (len(attempts) == 1 or status != "IN_QUEUE"):
+                on_status(status, status_data)
+
+        # The shared poller (or the webhook) wakes us up once RunPod reports a final status
+        attempt.waiter = asyncio.create_task(status_poller.wait(
+            attempt.request_id,
+            on_status=log_status,
+            poll_interval=WEBHOOK_SAFETY_POLL_INTERVAL if WEBHOOK_ENABLED else None,
+            client=attempt.endpoint.client,
+            # Preview segments are reported as progress, which the webhook never delivers
+            follow_progress="output_hls" in job_input,
+        ))
+        attempt.waiter.add_done_callback(lambda _: attempt.started.set())
+        attempts.append(attempt)
+
+    try:
+        attempt = await submit_attempt(tag, job_input, output_object_key)
+        if on_submitted:
+            on_submitted(attempt)
+        track(attempt)
+
+        if (
+            len(endpoint_pool) > 1
+            and not await first_to_start(attempts, RUNPOD_HEDGE_AFTER)
+            and await still_queued(attempt)
+        ):
+            try:
+                hedge = await submit_attempt(
+                    f"{tag}-hedge", job_input, output_object_key, exclude={attempt.endpoint}
+                )
+            except Exception as e:
+                # Best effort: the original copy is still queued
+                print(f"[{tag}] Could not hedge: {e}")
+            else:
+                print(f"[{tag}] Still queued after {RUNPOD_HEDGE_AFTER:.0f}s, hedged to {hedge.endpoint.id}")
+                track(hedge)
+
+            while len(attempts) > 1:
+                first = await first_to_start(attempts)
+                if first.waiter.done() and not first.succeeded:
+                    # Ended without running (failed/cancelled in the queue): the other copy may still make it
+                    await discard_attempt(first, output_object_key)
+                    attempts.remove(first)
+                    continue
+                for other in attempts:
+                    if other is not first:
+                        if other.status == "IN_QUEUE":
+                            # It never got a worker: that is at least this much queue wait to remember
+                            other.endpoint.record_queue_wait(time.monotonic() - other.submitted_at)
+                        await discard_attempt(other, output_object_key)
+                RUNPOD_HEDGES.labels(outcome="hedge_won" if first.tag != tag else "original_won").inc()
+                if first.tag != tag and on_submitted:
+                    on_submitted(first)
+                attempts[:] = [first]
+
+        attempt = attempts[0]
+        status_data = await attempt.waiter
+        status = status_data.get("status")
+        record_runpod_timings(status_data)
+        attempt.endpoint.record_result(status_data)
+
+        output_data = status_data.get("output")
+        if status == "COMPLETED" and isinstance(output_data, dict) and output_data.get("status") == "error":
+            # The handler caught its own exception and reported it as a normal result
+            status, status_data = "FAILED", {"error": output_data.get("message")}
+
+        if status != "COMPLETED":
+            error_msg = status_data.get("error", f"RunPod job ended with status {status}")
+            print(f"[{attempt.tag}] RunPod Task Failed: {error_msg}")
+            raise RuntimeError(f"RunPod Processing Failed: {error_msg}")
+
+        if attempt.upload_id:
+            with STAGE_SECONDS.labels(stage="output_finalize").time():
+                await run_in_threadpool(finish_output_upload, output_data, output_object_key, attempt.upload_id)
+            attempt.upload_id = None
+        return status_data, attempt.presigned_upload_url
+
+    finally:
+        # Cancels whatever is still queued/running (e.g. this job was cancelled) and aborts unused uploads
+        for attempt in attempts:
+            await discard_attempt(attempt, output_object_key)
+
+
+async def run_segmented_job(job_id, job_input, output_object_key, duration):
+    """
+    Upscale a long video as parallel RunPod jobs: split it at keyframes, run one job per
+    segment (retrying failed ones), then join the outputs in order without re-encoding.
+    """
+    workdir = tempfile.mkdtemp(prefix=f"segments_{job_id}_")
+    segment_prefix = f"segments/{job_id}"
+    segment_keys = []
+    try:
+        segment_seconds = max(SEGMENT_SECONDS, duration / SEGMENT_MAX_COUNT)
+        with STAGE_SECONDS.labels(stage="segment_split").time():
+            paths = await split_at_keyframes(job_input["video"], workdir, segment_seconds)
+        print(f"[{job_id}] Split {duration:.0f}s video into {len(paths)} segments")
+
+        input_keys = [f"{segment_prefix}/in_{i:04d}.mp4" for i in range(len(paths))]
+        output_keys = [f"{segment_prefix}/out_{i:04d}.mp4" for i in range(len(paths))]
+        segment_keys = input_keys + output_keys
+        uploaded = await asyncio.gather(*(
+            run_in_threadpool(upload_local_file, path, key) for path, key in zip(paths, input_keys)
+        ))
+        if not all(uploaded):
+            raise RuntimeError("Could not upload video segments to R2")
+
+        done = 0
+        job_manager.update(job_id, status="IN_QUEUE", segments_total=len(paths), segments_done=0)
+
+        def on_status(status, status_data):
+            if status == "IN_PROGRESS" and job_manager.get(job_id).status == "IN_QUEUE":
+                job_manager.update(job_id, status="IN_PROGRESS")
+
+        async def run_segment(index):
+            nonlocal done
+            segment_input = {
+                **job_input,
+                "video": storage_manager.generate_presigned_download_url(
+                    input_keys[index], expiration=JOB_URL_EXPIRATION
+                ),
             }
+            for attempt in range(1, SEGMENT_MAX_ATTEMPTS + 1):
+                try:
+                    await execute_on_runpod(
+                        f"{job_id}-s{index}", segment_input, output_keys[index], on_status=on_status
+                    )
+                    break
+                except Exception as e:
+                    if attempt == SEGMENT_MAX_ATTEMPTS:
+                        raise RuntimeError(f"Segment {index} failed after {attempt} attempts: {e}")
+                    print(f"[{job_id}] Segment {index} failed ({e}), retrying ({attempt}/{SEGMENT_MAX_ATTEMPTS})")
+            done += 1
+            job_manager.update(job_id, segments_done=done)
+
+        tasks = [asyncio.create_task(run_segment(i)) for i in range(len(paths))]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        # Reassemble in segment order
+        join_timer = time.perf_counter()
+        upscaled_paths = [os.path.join(workdir, f"out_{i:04d}.mp4") for i in range(len(paths))]
+        downloaded = await asyncio.gather(*(
+            run_in_threadpool(storage_manager.download_file, key, path)
+            for key, path in zip(output_keys, upscaled_paths)
+        ))
+        if not all(downloaded):
+            raise RuntimeError("Could not download upscaled segments from R2")
+        final_path = await concat_segments(upscaled_paths, os.path.join(workdir, "output.mp4"))
+        if not await run_in_threadpool(upload_local_file, final_path, output_object_key):
+            raise RuntimeError("Could not upload the joined video to R2")
+        STAGE_SECONDS.labels(stage="segment_join").observe(time.perf_counter() - join_timer)
+
+        print(f"[{job_id}] Joined {len(paths)} segments into {output_object_key}")
+        return {"url": storage_manager.generate_presigned_download_url(output_object_key), "type": "r2_url"}
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if segment_keys:
+            await run_in_threadpool(storage_manager.delete_objects, segment_keys)
+
+
+async def plan_job(job_id, job_input, input_size=None):
+    """
+    (priority class, duration) of a job from one probe of its input; duration is None unless
+    the input is long enough to be worth splitting into segments.
+    """
+    duration = None
+    if ffmpeg_available() and job_input["video"].startswith("http"):
+        try:
+            duration = await probe_duration(job_input["video"])
+        except FFmpegError as e:
+            print(f"[{job_id}] Could not probe input, processing it whole: {e}")
+    priority = job_priority(job_input["target_height"], input_size, duration)
+    if SEGMENTING_ENABLED and duration and duration >= SEGMENT_MIN_DURATION:
+        return priority, duration
+    return priority, None
+
+
+async def wait_for_confirmation(job_id):
+    """
+    Wait for the user to confirm (True) or cancel (False) a job; False after CONFIRMATION_TIMEOUT.
+    """
+    future = pending_confirmations[job_id] = asyncio.get_running_loop().create_future()
+    try:
+        return await asyncio.wait_for(future, CONFIRMATION_TIMEOUT)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        pending_confirmations.pop(job_id, None)
+
+
+async def run_upscale_job(
+    job_id, job_input, output_object_key, ticket, input_size=None, cache_key=None,
+    priority=None, await_confirmation=False,
+):
+    """
+    Run an upscale job to completion (cache hit, single RunPod job, or parallel segments).
+    RunPod work waits for a scheduler slot; cache hits and coalesced jobs never take one.
+    priority overrides the class job_priority() would pick. With await_confirmation the job
+    first waits (without holding its admission) until the user confirms it after a preview.
+    Runs in the background; progress is published through job_manager.
+    """
+    cached_output_key = None
+    outcome = "failed"
+    started = time.perf_counter()
+    JOBS_IN_FLIGHT.inc()
+    try:
+        if await_confirmation:
+            scheduler.release(ticket)
+            if not await wait_for_confirmation(job_id):
+                print(f"[{job_id}] Not confirmed after the preview, dropping the full job")
+                job_manager.update(job_id, status="CANCELLED", error="Not confirmed after the preview")
+                outcome = "cancelled"
+                return
+            ticket = await admit_with_backoff(ticket.client_id)
+            job_manager.update(job_id, status="QUEUED")
+
+        if cache_key:
+            cached_output_key = await claim_cached_output(job_id, cache_key)
+            if cached_output_key:
+                print(f"[{job_id}] Result cache hit: {cached_output_key}")
+                job_manager.update(
+                    job_id,
+                    status="COMPLETED",
+                    output_key=cached_output_key,
+                    url=storage_manager.generate_presigned_download_url(cached_output_key),
+                    result_type="r2_url",
+                    cached=True,
+                )
+                outcome = "cached"
+                return
+
+        planned_priority, duration = await plan_job(job_id, job_input, input_size)
+        if priority is None:
+            priority = planned_priority
+        # A segmented video runs one RunPod job per segment, so it weighs as many slots
+        weight = math.ceil(duration / max(SEGMENT_SECONDS, duration / SEGMENT_MAX_COUNT)) if duration else 1
+
+        async with scheduler.slot(ticket, priority=priority, weight=weight):
+            if duration:
+                result = await run_segmented_job(job_id, job_input, output_object_key, duration)
+            else:
+                hls_targets = await run_in_threadpool(prepare_hls_targets, job_id)
+                if hls_targets:
+                    job_input = {**job_input, "output_hls": hls_targets}
+
+                def on_submitted(attempt):
+                    job_manager.update(
+                        job_id,
+                        status=attempt.status,
+                        request_id=attempt.request_id,
+                        endpoint_id=attempt.endpoint.id,
+                        output_upload_id=attempt.upload_id,
+                        submitted_at=time.time(),
+                    )
+
+                def on_status(status, status_data):
+                    if status in ["IN_PROGRESS", "IN_QUEUE"]:
+                        job_manager.update(job_id, status=status, **hls_progress(status_data))
+
+                status_data, presigned_upload_url = await execute_on_runpod(
+                    job_id, job_input, output_object_key, on_submitted=on_submitted, on_status=on_status
+                )
+                result = build_job_result(status_data, output_object_key, presigned_upload_url)
+
+        job_manager.update(
+            job_id,
+            status="COMPLETED",
+            url=result.get("url"),
+            result_type=result["type"],
+            output=result.get("output"),
+        )
+        outcome = "completed"
+
+        if cache_key and result["type"] == "r2_url":
+            await run_in_threadpool(result_cache.store, cache_key, output_object_key)
+            result_cache.finish(cache_key, output_object_key)
+        if "output_hls" in job_input:
+            await run_in_threadpool(expire_hls_previews)
+
+    except Exception as e:
+        print(f"[{job_id}] Job failed: {e}")
+        job_manager.update(job_id, status="FAILED", error=str(e))
+        if "output_hls" in job_input:
+            await run_in_threadpool(delete_hls_preview, job_id)
+
+    finally:
+        if cache_key and not cached_output_key:
+            # Wake any identical jobs waiting on this one (no-op if already finished above)
+            result_cache.finish(cache_key, None)
+        scheduler.release(ticket)
+        JOBS_IN_FLIGHT.dec()
+        JOBS_TOTAL.labels(outcome=outcome).inc()
+        STAGE_SECONDS.labels(stage="total").observe(time.perf_counter() - started)
+
+
+async def resume_runpod_job(job):
+    """
+    Wait for a RunPod job submitted before a restart and finish it like execute_on_runpod would.
+    """
+    endpoint = next((e for e in endpoint_pool.endpoints if e.id == job.endpoint_id), endpoint_pool.endpoints[0])
+    print(f"[{job.id}] Resuming RunPod request {job.request_id} on {endpoint.id}")
+    JOBS_IN_FLIGHT.inc()
+    outcome = "failed"
+    try:
+        def on_status(status, status_data):
+            if status in ["IN_PROGRESS", "IN_QUEUE"]:
+                job_manager.update(job.id, status=status, **hls_progress(status_data))
+
+        status_data = await status_poller.wait(
+            job.request_id,
+            on_status=on_status,
+            poll_interval=WEBHOOK_SAFETY_POLL_INTERVAL if WEBHOOK_ENABLED else None,
+            client=endpoint.client,
+            # The job's input is not stored; it carried preview targets if previews are on
+            follow_progress=HLS_PREVIEW_ENABLED,
+        )
+        status = status_data.get("status")
+        output_data = status_data.get("output")
+        if status == "COMPLETED" and isinstance(output_data, dict) and output_data.get("status") == "error":
+            status, status_data = "FAILED", {"error": output_data.get("message")}
+        if status != "COMPLETED":
+            raise RuntimeError(f"RunPod Processing Failed: {status_data.get('error', status)}")
+
+        # The output may already have been assembled just before the restart
+        if job.output_upload_id and not await run_in_threadpool(storage_manager.head_object, job.output_key):
+            await run_in_threadpool(finish_output_upload, output_data, job.output_key, job.output_upload_id)
+        # The job was submitted with R2 output targets, so a missing Base64 body means it went to R2
+        result = build_job_result(status_data, job.output_key, presigned_upload_url=storage_manager.configured)
+        job_manager.update(
+            job.id,
+            status="COMPLETED",
+            url=result.get("url"),
+            result_type=result["type"],
+            output=result.get("output"),
+        )
+        outcome = "completed"
+        if job.cache_key and result["type"] == "r2_url":
+            await run_in_threadpool(result_cache.store, job.cache_key, job.output_key)
+
+    except Exception as e:
+        print(f"[{job.id}] Resumed job failed: {e}")
+        job_manager.update(job.id, status="FAILED", error=str(e))
+        if job.output_upload_id:
+            await run_in_threadpool(storage_manager.abort_multipart_upload, job.output_key, job.output_upload_id)
+
+    finally:
+        JOBS_IN_FLIGHT.dec()
+        JOBS_TOTAL.labels(outcome=outcome).inc()
+
+
+async def resubmit_job(job):
+    """
+    Start a job that never reached RunPod (or was split into segments) again from its R2 input.
+    """
+    print(f"[{job.id}] Resubmitting job interrupted by a restart")
+    awaiting_confirmation = job.status == "AWAITING_CONFIRMATION"
+    job_manager.update(
+        job.id,
+        status=job.status if awaiting_confirmation else "QUEUED",
+        request_id=None,
+        segments_total=None,
+        segments_done=None,
+    )
+    job_input = {
+        "video": storage_manager.generate_presigned_download_url(job.input_key, expiration=JOB_URL_EXPIRATION),
+        "target_width": job.target_width,
+        "target_height": job.target_height,
+        "quality": job.quality or DEFAULT_QUALITY,
+    }
+    ticket = await admit_with_backoff("recovery")
+    await run_upscale_job(
+        job.id, job_input, job.output_key, ticket, cache_key=job.cache_key,
+        priority=PRIORITY_HIGH if job.input_key.startswith(f"{PREVIEWS_PREFIX}/") else None,
+        await_confirmation=awaiting_confirmation,
+    )
+
+
+async def recover_jobs():
+    """
+    Pick up the jobs a previous process left unfinished: keep waiting on those RunPod already
+    has, resubmit those that never got there, and fail those with nothing to resume from.
+    """
+    jobs = job_manager.load_unfinished()
+    if not jobs:
+        return
+    print(f"Recovering {len(jobs)} unfinished jobs")
+
+    tasks = []
+    for job in jobs:
+        if job.request_id and not job.segments_total:
+            tasks.append(resume_runpod_job(job))
+        elif job.input_key and storage_manager.configured:
+            tasks.append(resubmit_job(job))
+        else:
+            job_manager.update(job.id, status="FAILED", error="Interrupted by a server restart")
+    await asyncio.gather(*tasks)
+
+
+def upload_local_file(path, object_name):
+    with open(path, "rb") as f:
+        return storage_manager.upload_fileobj(f, object_name, "video/mp4")
+
+
+def unique_prefix():
+    # Timestamp keeps keys sortable; the random suffix keeps same-second uploads apart
+    return f"{int(time.time())}_{uuid.uuid4().hex[:8]}"
+
+
+def parse_resolution(target_resolution):
+    try:
+        w, h = target_resolution.split("x")
+        return int(w), int(h)
+    except:
+        return 1920, 1080
+
+
+def client_id_for(request):
+    """
+    Who a request counts against for per-client limits: the X-Forwarded-For hop added by the
+    outermost of TRUSTED_PROXY_HOPS proxies, else the peer address. Hops further left are
+    whatever the client sent, so they never pick the client.
+    """
+    forwarded = request.headers.get("x-forwarded-for")
+    if TRUSTED_PROXY_HOPS and forwarded:
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        if hops:
+            return hops[-min(TRUSTED_PROXY_HOPS, len(hops))]
+    return request.client.host if request.client else "unknown"
+
+
+def admit_job(request):
+    """
+    Reserve a scheduler place for the caller, or answer 429 with a Retry-After hint.
+    """
+    try:
+        return scheduler.admit(client_id_for(request))
+    except AdmissionError as e:
+        JOBS_REJECTED.inc()
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def job_priority(target_height, input_size=None, duration=None):
+    if target_height >= LOW_PRIORITY_MIN_HEIGHT or (input_size or 0) >= LOW_PRIORITY_MIN_BYTES:
+        return PRIORITY_LOW
+    if (
+        target_height <= HIGH_PRIORITY_MAX_HEIGHT
+        or (input_size and input_size <= HIGH_PRIORITY_MAX_BYTES)
+        or (duration and duration <= HIGH_PRIORITY_MAX_DURATION)
+    ):
+        return PRIORITY_HIGH
+    return PRIORITY_NORMAL
+
+
+async def admit_with_backoff(client_id):
+    """
+    Scheduler admission for work that should wait its turn rather than fail with 429.
+    """
+    while True:
+        try:
+            return scheduler.admit(client_id)
+        except AdmissionError as e:
+            await asyncio.sleep(min(e.retry_after, BATCH_ADMISSION_RETRY_MAX))
+
+
+async def run_batch_item(batch_id, index, client_id):
+    """
+    Submit one batch item as a regular job and mirror the job's progress into the item.
+    """
+    item = job_manager.get_batch(batch_id).items[index]
+    try:
+        if not item["key"].startswith(f"{UPLOADS_PREFIX}/"):
+            raise ValueError("Only uploaded objects can be upscaled")
+        info = await run_in_threadpool(storage_manager.head_object, item["key"])
+        if not info:
+            raise ValueError("Uploaded object not found")
+        video_source = storage_manager.generate_presigned_download_url(item["key"], expiration=JOB_URL_EXPIRATION)
+        if not video_source:
+            raise RuntimeError("Could not generate input URL")
+
+        target_width, target_height = parse_resolution(item["target_resolution"])
+        ticket = await admit_with_backoff(client_id)
+        job_id = start_upscale_job(
+            item["filename"], target_width, target_height, item["quality"], video_source, ticket,
+            input_size=info["size"], content_id=f"etag:{info['etag']}", input_key=item["key"],
+        )["job_id"]
+        BYTES_TOTAL.labels(direction="input").inc(info["size"])
+
+        queue = job_manager.subscribe(job_id)
+        try:
+            snapshot = job_manager.get(job_id).to_dict()
+            job_manager.update_batch_item(batch_id, index, job_id=job_id, status=snapshot["status"])
+            while snapshot["status"] not in TERMINAL_STATUSES:
+                snapshot = await queue.get()
+                job_manager.update_batch_item(batch_id, index, status=snapshot["status"])
+        finally:
+            job_manager.unsubscribe(job_id, queue)
+
+        job = job_manager.get(job_id)
+        job_manager.update_batch_item(
+            batch_id, index,
+            status=job.status,
+            output_key=job.output_key if job.status == "COMPLETED" else None,
+            cached=job.cached,
+            error=job.error,
+        )
+    except Exception as e:
+        print(f"[batch {batch_id}] Item {index} failed: {e}")
+        job_manager.update_batch_item(batch_id, index, status="FAILED", error=str(e))
+
+
+async def run_batch(batch_id, client_id, concurrency):
+    """
+    Work through a batch with a fixed number of workers, each taking the next pending item.
+    """
+    batch = job_manager.get_batch(batch_id)
+    indexes = iter(range(len(batch.items)))
+
+    async def worker():
+        for index in indexes:
+            await run_batch_item(batch_id, index, client_id)
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(batch.items)))))
+    print(f"[batch {batch_id}] Finished: {batch.counts()}")
+
+
+def start_upscale_job(
+    filename, target_width, target_height, quality, video_source, ticket,
+    input_size=None, content_id=None, input_key=None, preview_job_id=None, await_confirmation=False,
+):
+    """
+    Create a job for an input RunPod can fetch (URL or Base64) and track it in the background.
+    ticket is the caller's scheduler admission (see admit_job); the job releases it when done.
+    content_id identifies the input bytes (e.g. their SHA-256) and enables the result cache.
+    input_key (the input's R2 object) lets crash recovery resubmit the job.
+    preview_job_id links the job's preview (see start_preview_job); with await_confirmation the
+    job only runs once confirmed through /api/jobs/{job_id}/confirm.
+    Must be called from the event loop. Returns the body sent back to the client.
+    """
+    output_filename = f"upscaled_{unique_prefix()}_{filename}"
+    output_object_key = f"outputs/{output_filename}"
+
+    job_input = {
+        "video": video_source,
+        "target_width": target_width,
+        "target_height": target_height,
+        "quality": quality,
+    }
+
+    cache_key = None
+    if content_id and storage_manager.configured:
+        cache_key = ResultCache.make_key(content_id, target_width, target_height, quality)
+
+    job = job_manager.create(
+        filename, target_width, target_height,
+        status="AWAITING_CONFIRMATION" if await_confirmation else "QUEUED",
+        quality=quality, input_key=input_key, output_key=output_object_key, cache_key=cache_key,
+        preview_job_id=preview_job_id,
+    )
+
+    task = asyncio.create_task(run_upscale_job(
+        job.id, job_input, output_object_key, ticket, input_size=input_size, cache_key=cache_key,
+        await_confirmation=await_confirmation,
+    ))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+    print(f"Created job {job.id}")
+    body = {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events",
+        "preview": None,
+    }
+    if preview_job_id:
+        body["preview"] = {
+            "job_id": preview_job_id,
+            "status_url": f"/api/jobs/{preview_job_id}",
+            "events_url": f"/api/jobs/{preview_job_id}/events",
         }
-        
-        async with httpx.AsyncClient(timeout=TIMEOUT_SETTINGS) as client:
+    if await_confirmation:
+        body["confirm_url"] = f"/api/jobs/{job.id}/confirm"
+        body["cancel_url"] = f"/api/jobs/{job.id}/cancel"
+    return body
+
+
+async def run_preview_job(job_id, video_source, ticket, seconds=None, frames=None):
+    """
+    Cut the start of the input, put it in R2 and upscale it ahead of ordinary jobs.
+    """
+    job = job_manager.get(job_id)
+    workdir = tempfile.mkdtemp(prefix=f"preview_{job_id}_")
+    clip_key = f"{PREVIEWS_PREFIX}/{unique_prefix()}_{job.filename}"
+    try:
+        with STAGE_SECONDS.labels(stage="preview_clip").time():
+            clip_path = await extract_clip(video_source, os.path.join(workdir, "clip.mp4"), seconds, frames)
+            if not await run_in_threadpool(upload_local_file, clip_path, clip_key):
+                raise RuntimeError("Could not upload the preview clip to R2")
+    except Exception as e:
+        print(f"[{job_id}] Preview failed: {e}")
+        scheduler.release(ticket)
+        job_manager.update(job_id, status="FAILED", error=f"Could not cut a preview: {e}")
+        return
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    job_manager.update(job_id, input_key=clip_key)
+    job_input = {
+        "video": storage_manager.generate_presigned_download_url(clip_key, expiration=JOB_URL_EXPIRATION),
+        "target_width": job.target_width,
+        "target_height": job.target_height,
+        "quality": job.quality,
+    }
+    await run_upscale_job(
+        job_id, job_input, job.output_key, ticket, cache_key=job.cache_key, priority=PRIORITY_HIGH
+    )
+
+
+def start_preview_job(
+    filename, target_width, target_height, quality, video_source, client_id,
+    content_id=None, seconds=None, frames=None,
+):
+    """
+    Queue a preview of the input's first seconds (or frames of video) as a job of its own.
+    Returns its id, or None when previews are unavailable (no ffmpeg or R2, Base64 input)
+    or the scheduler has no room for another job.
+    Must be called from the event loop.
+    """
+    if not PREVIEW_ENABLED or not storage_manager.configured or not video_source.startswith("http"):
+        return None
+    try:
+        ticket = scheduler.admit(client_id)
+    except AdmissionError as e:
+        print(f"No room for a preview of {filename}: {e}")
+        return None
+
+    frames = min(frames, PREVIEW_MAX_FRAMES) if frames else None
+    seconds = None if frames else min(seconds or PREVIEW_SECONDS, PREVIEW_MAX_SECONDS)
+    cache_key = None
+    if content_id:
+        excerpt = f"frames={frames}" if frames else f"seconds={seconds}"
+        cache_key = ResultCache.make_key(f"{content_id}#preview:{excerpt}", target_width, target_height, quality)
+
+    job = job_manager.create(
+        f"preview_{filename}", target_width, target_height,
+        quality=quality, output_key=f"outputs/upscaled_{unique_prefix()}_preview_{filename}", cache_key=cache_key,
+    )
+    task = asyncio.create_task(run_preview_job(job.id, video_source, ticket, seconds, frames))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    print(f"Created preview job {job.id}")
+    return job.id
+
+
+def resolve_confirmation(job_id, confirmed):
+    """
+    Hand the user's decision to a job waiting in wait_for_confirmation.
+    """
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    future = pending_confirmations.get(job_id)
+    if not future or future.done():
+        raise HTTPException(status_code=409, detail="Job is not waiting for confirmation")
+    future.set_result(confirmed)
+    return {"job_id": job_id, "confirmed": confirmed}
+
+
+@app.post("/api/upscale", status_code=202)
+async def upscale_video(
+    request: Request,
+    file: UploadFile = File(...),
+    target_resolution: str = "1920x1080",
+    quality: str = DEFAULT_QUALITY,
+    preview: bool = False,
+    preview_seconds: Optional[float] = None,
+    preview_frames: Optional[int] = None,
+    confirm: bool = False,
+):
+    """
+    Accept a video and queue it for upscaling.
+    Returns a job id immediately; follow it via /api/jobs/{job_id} or its event stream.
+    With preview, the first preview_seconds (or preview_frames) are upscaled first as a
+    separate job; with confirm as well, the full job waits for /api/jobs/{job_id}/confirm.
+    Answers 429 with Retry-After when the job queue is full.
+    """
+    print(f"Received file: {file.filename} | Target: {target_resolution}")
+    ticket = admit_job(request)
+    
+    try:
+        target_width, target_height = parse_resolution(target_resolution)
+
+        # 1. Stream the input to R2 and hand RunPod a URL to it.
+        # Starlette spools the multipart body to a temp file, and upload_fileobj
+        # reads it back in fixed-size chunks, so memory stays flat whatever the video size.
+        file.file.seek(0, os.SEEK_END)
+        file_size = file.file.tell()
+        file.file.seek(0)
+        if not file_size:
+            raise HTTPException(status_code=400, detail="Empty file")
+
+        video_source = None
+        content_id = None
+        input_object_key = f"{UPLOADS_PREFIX}/{unique_prefix()}_{file.filename}"
+        # Hash in the same pass as the upload so the result cache costs no extra read
+        reader = HashingReader(file.file)
+        with STAGE_SECONDS.labels(stage="input_upload").time():
+            uploaded = await run_in_threadpool(
+                storage_manager.upload_fileobj, reader, input_object_key, file.content_type
+            )
+        if uploaded:
+            BYTES_TOTAL.labels(direction="input").inc(file_size)
+            content_id = f"sha256:{reader.hexdigest()}"
+            video_source = storage_manager.generate_presigned_download_url(
+                input_object_key, expiration=JOB_URL_EXPIRATION
+            )
+            print(f"Input streamed to R2: {input_object_key} ({file_size / 1024 / 1024:.2f} MB)")
+
+        if not video_source:
+            # Fallback when R2 is not configured: inline Base64 (only sensible for small files)
             try:
-                print("Sending request to RunPod...")
-                response = await client.post(RUNPOD_URL, headers=HEADERS, json=payload)
-                
-                if response.status_code != 200:
-                    print(f"RunPod Error Status: {response.status_code}")
-                    # Check for 401 specifically
-                    if response.status_code == 401:
-                        raise HTTPException(status_code=401, detail="RunPod Authentication Failed. Check API Key.")
-                    
-                    raise HTTPException(status_code=502, detail=f"RunPod Error ({response.status_code}): {response.text[:200]}")
-                
-                try:
-                    data = response.json()
-                except ValueError:
-                     raise HTTPException(status_code=502, detail=f"RunPod returned invalid JSON: {response.text[:200]}")
-
-                request_id = data.get("id")
-                print(f"RunPod Request ID: {request_id}")
-                
-            except httpx.RequestError as e:
-                print(f"RunPod Connection Error: {e}")
-                raise HTTPException(status_code=502, detail=f"RunPod Connection Error: {str(e)}")
-
-            # 4. Poll for Status
-            status = "IN_PROGRESS"
-            
-            while status in ["IN_PROGRESS", "IN_QUEUE"]:
-                await asyncio.sleep(2)  # Non-blocking sleep
-                try:
-                    status_resp = await client.get(f"{RUNPOD_STATUS_URL}/{request_id}", headers=HEADERS)
-                    status_resp.raise_for_status()
-                    status_data = status_resp.json()
-                    status = status_data.get("status")
-                    print(f"Polling Status: {status}")
-                    
-                    if status == "COMPLETED":
-                        # Smart Logic:
-                        # If we sent an output_upload_url, RunPod should have used it.
-                        # RunPod response `output` might be a message like "Output uploaded..." 
-                        # OR if the user didn't update the handler yet, it might doubtless contain the base64.
-                        
-                        output_data = status_data.get("output", {})
-                        
-                        # Check if R2 integration worked
-                        # If we generated a URL, and status is success, we trust it or check metadata
-                        
-                        # Generate a VIEW URL (Download URL) from R2
-                        if presigned_upload_url:
-                            # Assuming success upload
-                            view_url = storage_manager.generate_presigned_download_url(output_object_key)
-                            if view_url:
-                                print(f"Generated R2 View URL: {view_url[:50]}...")
-                                return JSONResponse({"url": view_url, "type": "r2_url"})
-                        
-                        # Fallback: Handle Base64 if Handler didn't use R2
-                        bg_video_str = None
-                        if isinstance(output_data, dict):
-                            bg_video_str = output_data.get("video") or output_data.get("output_video")
-                        elif isinstance(output_data, str):
-                            bg_video_str = output_data
-
-                        if bg_video_str and len(str(bg_video_str)) > 100:
-                             final_data_uri = f"data:video/mp4;base64,{bg_video_str}"
-                             return JSONResponse({"url": final_data_uri, "type": "data_uri"})
-                        
-                        # If we are here, we expected R2 upload but maybe verified details are missing?
-                        # If view_url was generated, we returned it above.
-                        
-                        return JSONResponse({"output": output_data, "type": "raw"})
-
-                    elif status == "FAILED":
-                        error_msg = status_data.get("error", "Unknown error")
-                        print(f"RunPod Task Failed: {error_msg}")
-                        raise HTTPException(status_code=502, detail=f"RunPod Processing Failed: {error_msg}")
-                        
-                except httpx.RequestError as e:
-                    print(f"Polling Error: {e}")
-                    # Retry logic could be added here
-                    raise HTTPException(status_code=502, detail="Error polling RunPod status")
-        
-        return HTTPException(status_code=500, detail="Unknown error flow")
+                await file.seek(0)
+                content = await file.read()
+                video_source = base64.b64encode(content).decode('utf-8')
+                print(f"Video encoded to base64. Size: {len(video_source) / 1024 / 1024:.2f} MB")
+            except Exception as e:
+                print(f"Error reading/encoding file: {e}")
+                raise HTTPException(status_code=500, detail="Failed to process video file")
 
+        preview_job_id = None
+        if preview:
+            preview_job_id = start_preview_job(
+                file.filename, target_width, target_height, quality, video_source, ticket.client_id,
+                content_id=content_id, seconds=preview_seconds, frames=preview_frames,
+            )
+        return start_upscale_job(
+            file.filename, target_width, target_height, quality, video_source, ticket,
+            input_size=file_size, content_id=content_id, input_key=input_object_key if content_id else None,
+            preview_job_id=preview_job_id, await_confirmation=confirm and preview_job_id is not None,
+        )
+
+    except HTTPException:
+        scheduler.release(ticket)
+        raise
     except Exception as server_error:
+        scheduler.release(ticket)
         import traceback
         trace = traceback.format_exc()
         print(f"INTERNAL SERVER ERROR: {trace}")
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(server_error)}")
 
+
+@app.post("/api/jobs", status_code=202)
+async def create_job_from_upload(request: JobRequest, http_request: Request):
+    """
+    Queue an upscale for a video already uploaded to R2 (see /api/uploads/multipart).
+    Answers 429 with Retry-After when the job queue is full.
+    """
+    if not request.key.startswith(f"{UPLOADS_PREFIX}/"):
+        raise HTTPException(status_code=400, detail="Only uploaded objects can be upscaled")
+
+    # The API never sees these bytes, so the object's ETag stands in for a content hash
+    info = await run_in_threadpool(storage_manager.head_object, request.key)
+    if not info:
+        raise HTTPException(status_code=404, detail="Uploaded object not found")
+
+    video_source = storage_manager.generate_presigned_download_url(request.key, expiration=JOB_URL_EXPIRATION)
+    if not video_source:
+        raise HTTPException(status_code=500, detail="Could not generate input URL")
+
+    target_width, target_height = parse_resolution(request.target_resolution)
+    filename = request.filename or request.key.rsplit("/", 1)[-1]
+    print(f"Received upload key: {request.key} | Target: {request.target_resolution}")
+    ticket = admit_job(http_request)
+    content_id = f"etag:{info['etag']}"
+    preview_job_id = None
+    if request.preview:
+        preview_job_id = start_preview_job(
+            filename, target_width, target_height, request.quality, video_source, ticket.client_id,
+            content_id=content_id, seconds=request.preview_seconds, frames=request.preview_frames,
+        )
+    job = start_upscale_job(
+        filename, target_width, target_height, request.quality, video_source, ticket,
+        input_size=info["size"], content_id=content_id, input_key=request.key,
+        preview_job_id=preview_job_id, await_confirmation=request.confirm and preview_job_id is not None,
+    )
+    # Browser uploads go straight to R2; count the stored object (not the size declared when the
+    # upload started), so aborted and abandoned uploads are left out
+    BYTES_TOTAL.labels(direction="input").inc(info["size"])
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    Current state of an upscale job.
+    """
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Server-Sent Events stream of job updates. Closes once the job finishes.
+    """
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        queue = job_manager.subscribe(job_id)
+        try:
+            snapshot = job.to_dict()
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            while snapshot["status"] not in TERMINAL_STATUSES:
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(snapshot)}\n\n"
+        finally:
+            job_manager.unsubscribe(job_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/api/jobs/{job_id}/confirm")
+async def confirm_job(job_id: str):
+    """
+    Run the full upscale of a job that was waiting for its preview to be approved.
+    """
+    return resolve_confirmation(job_id, True)
+
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """
+    Drop a job that was waiting for its preview to be approved.
+    """
+    return resolve_confirmation(job_id, False)
+
+
+@app.get("/api/jobs/{job_id}/playlist.m3u8")
+def get_job_playlist(job_id: str):
+    """
+    HLS playlist of the job's preview. It grows while the job runs (an EVENT playlist,
+    so players keep reloading it); segment URLs are signed on read.
+    """
+    job = job_manager.get(job_id)
+    if not job or not job.hls_segments:
+        raise HTTPException(status_code=404, detail="No preview for this job")
+
+    playlist = storage_manager.get_text(hls_key(job_id, HLS_PLAYLIST_NAME))
+    if playlist is None:
+        raise HTTPException(status_code=404, detail="Preview no longer available")
+    return PlainTextResponse(
+        sign_hls_playlist(job_id, playlist),
+        media_type="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.post("/api/batches", status_code=202)
+async def create_batch(request: BatchRequest, http_request: Request):
+    """
+    Queue upscales for many uploaded videos (see /api/uploads/multipart) in one call.
+    Items run concurrently up to a cap; follow the batch via /api/batches/{batch_id}.
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="A batch needs at least one item")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch can have at most {BATCH_MAX_ITEMS} items")
+
+    active = sum(1 for batch in job_manager.batches.values() if not batch.finished)
+    if active >= MAX_ACTIVE_BATCHES:
+        JOBS_REJECTED.inc()
+        raise HTTPException(
+            status_code=429,
+            detail="Too many batches running, try again later",
+            headers={"Retry-After": str(scheduler.retry_after())},
+        )
+
+    items = [
+        {
+            "key": item.key,
+            "filename": item.filename or item.key.rsplit("/", 1)[-1],
+            "target_resolution": item.target_resolution or request.target_resolution,
+            "quality": item.quality or request.quality,
+            "job_id": None,
+            "status": "PENDING",
+            "output_key": None,
+            "cached": False,
+            "error": None,
+        }
+        for item in request.items
+    ]
+    batch = job_manager.create_batch(items)
+    concurrency = max(1, min(request.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+
+    task = asyncio.create_task(run_batch(batch.id, client_id_for(http_request), concurrency))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+    print(f"Created batch {batch.id} with {len(items)} items")
+    return {
+        "batch_id": batch.id,
+        "status": batch.status,
+        "total": len(items),
+        "status_url": f"/api/batches/{batch.id}",
+    }
+
+
+@app.get("/api/batches/{batch_id}")
+def get_batch(batch_id: str, offset: int = 0, limit: Optional[int] = None):
+    """
+    Aggregate and per-item state of a batch. Completed items carry a fresh download URL.
+    Use offset/limit to page through large batches.
+    """
+    batch = job_manager.get_batch(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    result = batch.to_dict(offset=max(offset, 0), limit=limit)
+    for item in result["items"]:
+        # Signed on read: URLs minted when an early item finished would expire before a long batch does
+        item["url"] = storage_manager.generate_presigned_download_url(item["output_key"]) if item["output_key"] else None
+    return result
+
+
+@app.post("/api/runpod/webhook/{job_id}")
+async def runpod_webhook(job_id: str, token: str, request: Request):
+    """
+    Completion callback from RunPod. The token in the URL proves we issued it for this job.
+    """
+    if not WEBHOOK_ENABLED or not hmac.compare_digest(token, webhook_token(job_id)):
+        raise HTTPException(status_code=403, detail="Invalid webhook token")
+
+    try:
+        status_data = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+
+    request_id = status_data.get("id")
+    job = job_manager.get(job_id)
+    if job and job.request_id and job.request_id != request_id:
+        raise HTTPException(status_code=400, detail="Request id does not match job")
+
+    print(f"[{job_id}] Webhook received: {status_data.get('status')}")
+    status_poller.resolve(request_id, status_data)
+    return {"received": True}
+
+
 @app.get("/api/upload-url")
 def get_upload_url(filename: str, content_type: str = "video/mp4"):
     """
@@ -216,6 +1626,77 @@ def get_download_url(file_key: str):
     return {"url": url}
 
 
+# --- Direct-to-R2 multipart uploads ---
+# The browser creates an upload, asks for part URLs, PUTs the parts straight to R2
+# in parallel, then completes it here. Parts already stored can be listed to resume.
+
+@app.post("/api/uploads/multipart")
+def create_multipart_upload(request: MultipartCreateRequest):
+    object_name = f"{UPLOADS_PREFIX}/{unique_prefix()}_{request.filename}"
+    upload_id = storage_manager.create_multipart_upload(object_name, request.content_type)
+    if not upload_id:
+        raise HTTPException(status_code=500, detail="Could not start multipart upload")
+
+    # S3 allows at most 10,000 parts, so very large files get bigger parts
+    part_size = max(MIN_PART_SIZE, -(-request.size // MAX_PARTS))
+    return {
+        "key": object_name,
+        "upload_id": upload_id,
+        "part_size": part_size,
+        "part_count": max(1, -(-request.size // part_size)),
+    }
+
+
+@app.post("/api/uploads/multipart/part-urls")
+def get_multipart_part_urls(request: MultipartPartUrlsRequest):
+    if len(request.part_numbers) > MAX_PART_URLS_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PART_URLS_PER_REQUEST} parts per request")
+    if any(n < 1 or n > MAX_PARTS for n in request.part_numbers):
+        raise HTTPException(status_code=400, detail="Invalid part number")
+
+    urls = storage_manager.generate_presigned_part_urls(request.key, request.upload_id, request.part_numbers)
+    if urls is None:
+        raise HTTPException(status_code=500, detail="Could not generate part URLs")
+    return {"urls": urls}
+
+
+@app.get("/api/uploads/multipart/parts")
+def list_multipart_parts(key: str, upload_id: str):
+    parts = storage_manager.list_parts(key, upload_id)
+    if parts is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"parts": [{"part_number": p["PartNumber"], "etag": p["ETag"], "size": p["Size"]} for p in parts]}
+
+
+@app.post("/api/uploads/multipart/complete")
+def complete_multipart_upload(request: MultipartCompleteRequest):
+    parts = [{"PartNumber": p.part_number, "ETag": p.etag} for p in request.parts]
+    if not storage_manager.complete_multipart_upload(request.key, request.upload_id, parts):
+        raise HTTPException(status_code=500, detail="Could not complete multipart upload")
+    return {"key": request.key}
+
+
+@app.post("/api/uploads/multipart/abort")
+def abort_multipart_upload(request: MultipartUploadRef):
+    if not storage_manager.abort_multipart_upload(request.key, request.upload_id):
+        raise HTTPException(status_code=500, detail="Could not abort multipart upload")
+    return {"aborted": True}
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Prometheus text exposition of job, stage timing and RunPod traffic metrics.
+    """
+    JOB_STORE_SIZE.set(len(job_manager.jobs))
+    POLLER_TRACKED.set(len(status_poller.tracked))
+    for endpoint in endpoint_pool.endpoints:
+        ENDPOINT_EXPECTED_WAIT.labels(endpoint=endpoint.id).set(endpoint.expected_wait())
+    SCHEDULER_RUNNING.set(scheduler.in_flight)
+    SCHEDULER_QUEUED.set(scheduler.queued)
+    URL_CACHE_ENTRIES.set(len(storage_manager.url_cache))
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/api/debug-env")
 def debug_env():
     """Debug endpoint to check if environment variables are loaded correctly"""
@@ -232,15 +1713,19 @@ def debug_env():
 
 # Mount static files for local development (must be last to avoid overriding API routes)
 # This allows running 'python api/index.py' and accessing the frontend at http://localhost:8000
-current_dir = os.path.dirname(os.path.abspath(__file__))
-# Assumes api/index.py is in 'api/' and 'public/' is a sibling
-public_dir = os.path.join(os.path.dirname(current_dir), "public")
+# Vercel serves /public itself (and sets VERCEL), so the mount is skipped there
+if not os.getenv("VERCEL"):
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    # Assumes api/index.py is in 'api/' and 'public/' is a sibling
+    public_dir = os.path.join(os.path.dirname(current_dir), "public")
 
-if os.path.exists(public_dir):
-    print(f"Mounting public directory: {public_dir}")
-    app.mount("/", StaticFiles(directory=public_dir, html=True), name="static")
-else:
-    print(f"Warning: Public directory not found at {public_dir}. Frontend will not be served.")
+    if os.path.exists(public_dir):
+        from fastapi.staticfiles import StaticFiles
+        print(f"Mounting public directory: {public_dir}")
+        app.mount("/", StaticFiles(directory=public_dir, html=True), name="static")
+    else:
+        print(f"Warning: Public directory not found at {public_dir}. Frontend will not be served.")
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
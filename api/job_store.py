@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, one process per store is up to the deployment
+    fcntl = None
+
+# Job attributes persisted as columns (Job.output, inline Base64 results, is deliberately not stored)
+COLUMNS = (
+    "id", "status", "filename", "target_width", "target_height", "quality",
+    "request_id", "endpoint_id", "input_key", "output_key", "output_upload_id", "cache_key",
+    "url", "result_type", "error", "cached", "segments_total", "segments_done",
+    "hls_segments", "preview_job_id",
+    "created_at", "submitted_at", "started_at", "finished_at", "updated_at",
+)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    {", ".join(COLUMNS[1:])}
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at);
+"""
+
+
+class JobStore:
+    """
+    SQLite table mirroring every job, so a restarted API can pick up the jobs it left behind.
+
+    Writes are single-row upserts in WAL mode without a per-commit fsync: cheap enough to
+    run inline on the event loop. Losing the last few writes on power loss is acceptable;
+    a process crash or redeploy loses nothing.
+
+    The connection is shared by the event loop and the threadpool running sync routes, so
+    every statement runs under a lock. One process owns the file at a time (an exclusive
+    lock on path + ".lock"): a second API worker opening it gets a RuntimeError instead of
+    resuming the owner's jobs as its own.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock_file = self._acquire_owner_lock(path + ".lock")
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self._add_missing_columns()
+
+    @staticmethod
+    def _acquire_owner_lock(lock_path):
+        lock_file = open(lock_path, "a")
+        if fcntl is None:
+            return lock_file
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError("in use by another process")
+        # Released by close(), or by the OS if the process dies
+        return lock_file
+
+    def _add_missing_columns(self):
+        # Tables created by an older version lack columns added since
+        existing = {row["name"] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        for column in COLUMNS:
+            if column not in existing:
+                self.db.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+
+    def save(self, job):
+        values = [getattr(job, column) for column in COLUMNS]
+        with self._lock:
+            self.db.execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})",
+                values,
+            )
+
+    def load(self, job_id):
+        with self._lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def load_unfinished(self, terminal_statuses):
+        placeholders = ", ".join("?" for _ in terminal_statuses)
+        with self._lock:
+            rows = self.db.execute(
+                f"SELECT * FROM jobs WHERE status NOT IN ({placeholders}) ORDER BY created_at",
+                tuple(terminal_statuses),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete_finished_before(self, cutoff, terminal_statuses):
+        placeholders = ", ".join("?" for _ in terminal_statuses)
+        with self._lock:
+            cursor = self.db.execute(
+                f"DELETE FROM jobs WHERE created_at < ? AND status IN ({placeholders})",
+                (cutoff, *terminal_statuses),
+            )
+            return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+        self._lock_file.close()
@@ -0,0 +1,244 @@
+import time
+import uuid
+import asyncio
+
+# Job lifecycle as seen by the frontend:
+# QUEUED -> IN_QUEUE -> IN_PROGRESS -> COMPLETED / FAILED
+# A job started with a preview may first sit in AWAITING_CONFIRMATION (then QUEUED, or CANCELLED)
+TERMINAL_STATUSES = {"COMPLETED", "FAILED", "CANCELLED"}
+
+
+class Job:
+    def __init__(self, job_id, filename, target_width, target_height):
+        self.id = job_id
+        self.filename = filename
+        self.target_width = target_width
+        self.target_height = target_height
+        self.quality = None
+        self.status = "QUEUED"
+        self.request_id = None
+        # What crash recovery needs to resume or resubmit the job
+        self.endpoint_id = None
+        self.input_key = None
+        self.output_upload_id = None
+        self.cache_key = None
+        self.output_key = None
+        self.url = None
+        self.result_type = None
+        self.output = None
+        self.error = None
+        self.cached = False
+        # Set when a long video is processed as parallel segments
+        self.segments_total = None
+        self.segments_done = None
+        # HLS preview segments the handler has published so far
+        self.hls_segments = None
+        # Short excerpt of the same input, upscaled first as a job of its own
+        self.preview_job_id = None
+        # Stage timestamps
+        self.created_at = time.time()
+        self.submitted_at = None
+        self.started_at = None
+        self.finished_at = None
+        self.updated_at = self.created_at
+
+    @classmethod
+    def from_row(cls, row):
+        job = cls(row["id"], row["filename"], row["target_width"], row["target_height"])
+        for name, value in row.items():
+            setattr(job, name, value)
+        job.cached = bool(job.cached)
+        return job
+
+    @property
+    def finished(self):
+        return self.status in TERMINAL_STATUSES
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "target_resolution": f"{self.target_width}x{self.target_height}",
+            "request_id": self.request_id,
+            "url": self.url,
+            "type": self.result_type,
+            "output": self.output,
+            "error": self.error,
+            "cached": self.cached,
+            "segments_total": self.segments_total,
+            "segments_done": self.segments_done,
+            "hls_segments": self.hls_segments,
+            "playlist_url": f"/api/jobs/{self.id}/playlist.m3u8" if self.hls_segments else None,
+            "preview_job_id": self.preview_job_id,
+            "created_at": self.created_at,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class Batch:
+    """
+    Jobs submitted together. Each item keeps its own copy of its job's outcome,
+    so a finished batch stays complete after its jobs have been pruned.
+    """
+
+    def __init__(self, batch_id, items):
+        self.id = batch_id
+        # Dicts with key, filename, target_resolution, quality, job_id, status, output_key, cached, error
+        self.items = items
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+
+    @property
+    def finished(self):
+        return all(item["status"] in TERMINAL_STATUSES for item in self.items)
+
+    def counts(self):
+        counts = {}
+        for item in self.items:
+            counts[item["status"]] = counts.get(item["status"], 0) + 1
+        return counts
+
+    @property
+    def status(self):
+        if not self.finished:
+            return "RUNNING"
+        completed = self.counts().get("COMPLETED", 0)
+        if completed == len(self.items):
+            return "COMPLETED"
+        return "PARTIAL" if completed else "FAILED"
+
+    def to_dict(self, offset=0, limit=None):
+        end = None if limit is None else offset + limit
+        return {
+            "batch_id": self.id,
+            "status": self.status,
+            "total": len(self.items),
+            "counts": self.counts(),
+            "offset": offset,
+            "items": [
+                {"index": index, **item}
+                for index, item in enumerate(self.items[offset:end], start=offset)
+            ],
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class JobManager:
+    """
+    In-memory registry of upscale jobs (and the batches grouping them).
+
+    Each job can have any number of subscribers (SSE connections); every
+    update pushes a snapshot of the job to their queues. With a JobStore,
+    every change is also written through, and jobs no longer in memory
+    (pruned, or from before a restart) are loaded back on demand.
+    """
+
+    def __init__(self, max_finished_jobs=1000, max_finished_batches=100, store=None):
+        self.jobs = {}
+        self.store = store
+        self.batches = {}
+        self.max_finished_jobs = max_finished_jobs
+        self.max_finished_batches = max_finished_batches
+        self._subscribers = {}
+
+    def create(self, filename, target_width, target_height, **fields):
+        job = Job(uuid.uuid4().hex, filename, target_width, target_height)
+        for name, value in fields.items():
+            setattr(job, name, value)
+        self.jobs[job.id] = job
+        if self.store:
+            self.store.save(job)
+        self._prune()
+        return job
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None and self.store:
+            row = self.store.load(job_id)
+            if row:
+                job = self.jobs[job_id] = Job.from_row(row)
+        return job
+
+    def load_unfinished(self):
+        """
+        Jobs a previous process left unfinished, now tracked in memory again.
+        """
+        jobs = []
+        for row in self.store.load_unfinished(TERMINAL_STATUSES) if self.store else ():
+            job = self.jobs[row["id"]] = Job.from_row(row)
+            jobs.append(job)
+        return jobs
+
+    def update(self, job_id, **fields):
+        job = self.get(job_id)
+        if not job:
+            return None
+
+        for name, value in fields.items():
+            setattr(job, name, value)
+        job.updated_at = time.time()
+        if job.status == "IN_PROGRESS" and job.started_at is None:
+            job.started_at = job.updated_at
+        if job.finished and job.finished_at is None:
+            job.finished_at = job.updated_at
+        if self.store:
+            self.store.save(job)
+
+        snapshot = job.to_dict()
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait(snapshot)
+        return job
+
+    def subscribe(self, job_id):
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id, queue):
+        queues = self._subscribers.get(job_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[job_id]
+
+    def create_batch(self, items):
+        batch = Batch(uuid.uuid4().hex, items)
+        self.batches[batch.id] = batch
+        self._prune_batches()
+        return batch
+
+    def get_batch(self, batch_id):
+        return self.batches.get(batch_id)
+
+    def update_batch_item(self, batch_id, index, **fields):
+        batch = self.batches.get(batch_id)
+        if not batch:
+            return None
+        batch.items[index].update(fields)
+        batch.updated_at = time.time()
+        return batch
+
+    def _prune_batches(self):
+        finished = [batch for batch in self.batches.values() if batch.finished]
+        excess = len(finished) - self.max_finished_batches
+        if excess <= 0:
+            return
+        finished.sort(key=lambda batch: batch.updated_at)
+        for batch in finished[:excess]:
+            del self.batches[batch.id]
+
+    def _prune(self):
+        # Keep memory bounded: forget the oldest finished jobs first
+        finished = [job for job in self.jobs.values() if job.finished]
+        excess = len(finished) - self.max_finished_jobs
+        if excess <= 0:
+            return
+        finished.sort(key=lambda job: job.updated_at)
+        for job in finished[:excess]:
+            del self.jobs[job.id]
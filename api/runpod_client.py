@@ -0,0 +1,432 @@
+import time
+import asyncio
+
+try:
+    from .metrics import registry
+except ImportError:
+    from metrics import registry
+
+RUNPOD_API_BASE = "https://api.runpod.ai/v2"
+
+# Statuses after which RunPod will not change the job any more
+RUNPOD_FINAL_STATUSES = {"COMPLETED", "FAILED", "CANCELLED", "TIMED_OUT"}
+
+# Every call is a small JSON request now that inputs travel through R2
+REQUEST_TIMEOUT = 60.0
+CONNECT_TIMEOUT = 10.0
+
+RUNPOD_REQUESTS = registry.counter(
+    "runpod_requests_total", "Requests sent to the RunPod API", ["operation", "outcome"]
+)
+
+# One pool shared by every job: keep-alive connections skip the TLS handshake
+MAX_CONNECTIONS = 50
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 60.0
+
+# Endpoint ranking (see EndpointPool)
+HEALTH_TIMEOUT = 5.0
+HEALTH_TTL = 10.0
+# Assumed per-job execution time until an endpoint has finished one
+DEFAULT_EXECUTION_TIME = 60.0
+# Extra wait assumed when an endpoint has no worker up and has to scale from zero
+COLD_START_SECONDS = 30.0
+# Consecutive submit failures that take an endpoint out of rotation, and for how long
+ENDPOINT_MAX_FAILURES = 3
+ENDPOINT_COOLDOWN = 60.0
+
+
+class RunPodError(Exception):
+    pass
+
+
+class RunPodClient:
+    """
+    Shared, pooled HTTP client for one RunPod serverless endpoint.
+    The underlying httpx client is created on first use and reused by every job; httpx
+    itself is only imported then, keeping it out of the API's cold start.
+    """
+
+    def __init__(self, api_key, endpoint_id, base_url=RUNPOD_API_BASE):
+        self.api_key = api_key
+        self.endpoint_id = endpoint_id
+        self.endpoint_url = f"{base_url.rstrip('/')}/{endpoint_id}"
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                ),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(self, method, path, **kwargs):
+        import httpx
+        operation = path.strip("/").split("/")[0]
+        try:
+            response = await self.client.request(method, f"{self.endpoint_url}{path}", **kwargs)
+        except httpx.RequestError as e:
+            RUNPOD_REQUESTS.labels(operation=operation, outcome="connection_error").inc()
+            raise RunPodError(f"RunPod Connection Error: {str(e)}")
+
+        RUNPOD_REQUESTS.labels(operation=operation, outcome=str(response.status_code)).inc()
+        if response.status_code != 200:
+            print(f"RunPod Error Status: {response.status_code}")
+            if response.status_code == 401:
+                raise RunPodError("RunPod Authentication Failed. Check API Key.")
+            raise RunPodError(f"RunPod Error ({response.status_code}): {response.text[:200]}")
+
+        try:
+            return response.json()
+        except ValueError:
+            raise RunPodError(f"RunPod returned invalid JSON: {response.text[:200]}")
+
+    async def submit(self, payload):
+        return await self._request("POST", "/run", json=payload)
+
+    async def status(self, request_id):
+        return await self._request("GET", f"/status/{request_id}")
+
+    async def cancel(self, request_id):
+        return await self._request("POST", f"/cancel/{request_id}")
+
+    async def health(self):
+        return await self._request("GET", "/health", timeout=HEALTH_TIMEOUT)
+
+
+class Endpoint:
+    """
+    Live load and observed latency of one RunPod endpoint, used to rank it for dispatch.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.id = client.endpoint_id
+        # From /health; in_queue stays None until the first successful check
+        self.in_queue = None
+        self.idle_workers = 0
+        self.running_workers = 0
+        self.health_checked_at = 0.0
+        # Jobs we submitted since the last health check (not yet counted in in_queue)
+        self.submitted_since_health = 0
+        # Exponential moving averages of RunPod's delayTime / executionTime, in seconds
+        self.avg_queue_wait = None
+        self.avg_execution_time = None
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+    @property
+    def available(self):
+        return time.monotonic() >= self.cooldown_until
+
+    def expected_wait(self):
+        """
+        Seconds a new job is expected to sit IN_QUEUE here: the backlog estimate from live
+        /health stats, but never less than the queue wait recent jobs actually saw.
+        """
+        observed = self.avg_queue_wait or 0.0
+        if self.in_queue is None:
+            return observed
+
+        queued = self.in_queue + self.submitted_since_health
+        execution_time = self.avg_execution_time or DEFAULT_EXECUTION_TIME
+        workers = self.idle_workers + self.running_workers
+        if self.idle_workers > queued:
+            backlog = 0.0
+        elif not workers:
+            backlog = COLD_START_SECONDS + queued * execution_time
+        else:
+            backlog = (queued + 1) / workers * execution_time
+        return max(backlog, observed)
+
+    def apply_health(self, data):
+        jobs = data.get("jobs") or {}
+        workers = data.get("workers") or {}
+        self.in_queue = jobs.get("inQueue", 0)
+        self.idle_workers = workers.get("idle", 0)
+        self.running_workers = workers.get("running", 0)
+        self.submitted_since_health = 0
+        self.health_checked_at = time.monotonic()
+
+    def record_submit(self):
+        self.submitted_since_health += 1
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= ENDPOINT_MAX_FAILURES:
+            self.cooldown_until = time.monotonic() + ENDPOINT_COOLDOWN
+            self.failures = 0
+
+    def record_queue_wait(self, seconds):
+        self.avg_queue_wait = _ema(self.avg_queue_wait, seconds)
+
+    def record_result(self, status_data):
+        if status_data.get("delayTime") is not None:
+            self.record_queue_wait(status_data["delayTime"] / 1000)
+        if status_data.get("executionTime"):
+            self.avg_execution_time = _ema(self.avg_execution_time, status_data["executionTime"] / 1000)
+
+
+def _ema(average, value, weight=0.2):
+    return value if average is None else (1 - weight) * average + weight * value
+
+
+class EndpointPool:
+    """
+    A set of RunPod endpoints (e.g. one per GPU type) that can all run the handler.
+
+    ranked() orders them by expected queue wait, from /health stats refreshed at most every
+    health_ttl seconds (all stale endpoints in one concurrent round, shared by concurrent
+    callers) plus what this process has submitted since. Endpoints that keep rejecting
+    submissions sit out a cooldown. A single endpoint is never health-checked.
+    """
+
+    def __init__(self, clients, health_ttl=HEALTH_TTL):
+        self.endpoints = [Endpoint(client) for client in clients]
+        self.health_ttl = health_ttl
+        self._refresh_task = None
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    async def ranked(self, exclude=()):
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+        if len(candidates) <= 1:
+            return candidates
+
+        await self.refresh()
+        # Cooling-down endpoints go last rather than disappearing: better than no endpoint at all
+        return sorted(candidates, key=lambda endpoint: (not endpoint.available, endpoint.expected_wait()))
+
+    async def refresh(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            now = time.monotonic()
+            stale = [e for e in self.endpoints if now - e.health_checked_at > self.health_ttl]
+            if not stale:
+                return
+            self._refresh_task = asyncio.create_task(self._check(stale))
+        # Shielded: one caller being cancelled must not abort the round for the others
+        await asyncio.shield(self._refresh_task)
+
+    async def _check(self, endpoints):
+        results = await asyncio.gather(*(e.client.health() for e in endpoints), return_exceptions=True)
+        for endpoint, result in zip(endpoints, results):
+            if isinstance(result, Exception):
+                print(f"RunPod health check failed for {endpoint.id}: {result}")
+                # Forget live stats we can no longer vouch for; retry after the TTL
+                endpoint.in_queue = None
+                endpoint.health_checked_at = time.monotonic()
+            else:
+                endpoint.apply_health(result)
+
+    async def close(self):
+        for endpoint in self.endpoints:
+            await endpoint.client.close()
+
+
+class TrackedRequest:
+    def __init__(self, request_id, future, on_status, client):
+        self.request_id = request_id
+        self.future = future
+        self.on_status = on_status
+        self.client = client
+        self.status = "IN_QUEUE"
+        # Last progress payload the handler reported (RunPod shows it as "output" while IN_PROGRESS)
+        self.progress = None
+        self.queue_polls = 0
+        self.started_at = None
+        self.errors = 0
+        self.poll_interval = None
+        # Poll adaptively once IN_PROGRESS even with poll_interval set (see StatusPoller.wait)
+        self.follow_progress = False
+        self.next_poll = time.monotonic()
+
+
+class StatusPoller:
+    """
+    A single background loop that polls every in-flight RunPod request.
+
+    Instead of one fixed 2-second loop per job, each request is polled on its own
+    adaptive schedule: slowly backing off while it sits IN_QUEUE, and faster as an
+    IN_PROGRESS job approaches the typical execution time seen for finished jobs.
+    Coroutines waiting in wait() are woken when their request reaches a final status.
+    """
+
+    def __init__(self, runpod_client, min_interval=1.0, max_interval=15.0, max_concurrent_polls=20, max_errors=5):
+        self.runpod_client = runpod_client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_errors = max_errors
+        self.tracked = {}
+        # Final statuses pushed by webhook before anyone started waiting for them
+        self._early_results = {}
+        # Exponential moving average of RunPod's executionTime, in seconds
+        self.avg_execution_time = None
+        self._semaphore = asyncio.Semaphore(max_concurrent_polls)
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def wait(self, request_id, on_status=None, poll_interval=None, client=None, follow_progress=False):
+        """
+        Wait until RunPod reports a final status for request_id and return that status payload.
+        on_status(status, status_data) is called on every status change along the way, and
+        whenever the handler reports new progress while IN_PROGRESS.
+        poll_interval fixes the polling period, e.g. a slow safety net when a webhook is expected.
+        follow_progress keeps polling an IN_PROGRESS request on the adaptive schedule anyway, for
+        progress that only polling sees (webhooks only report the final status).
+        client is the RunPodClient of the endpoint the request was submitted to (default: the poller's).
+        """
+        if request_id in self._early_results:
+            return self._early_results.pop(request_id)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = TrackedRequest(request_id, future, on_status, client or self.runpod_client)
+        entry.poll_interval = poll_interval
+        entry.follow_progress = follow_progress
+        if poll_interval:
+            entry.next_poll = time.monotonic() + poll_interval
+        self.tracked[request_id] = entry
+        self.start()
+        self._wakeup.set()
+        try:
+            return await future
+        finally:
+            self.tracked.pop(request_id, None)
+
+    def resolve(self, request_id, status_data):
+        """
+        Deliver a status pushed to us (RunPod webhook) instead of waiting for the next poll.
+        Returns True if it finished a tracked request.
+        """
+        status = status_data.get("status")
+        if status not in RUNPOD_FINAL_STATUSES:
+            return False
+
+        entry = self.tracked.get(request_id)
+        if entry is None:
+            # The webhook beat wait(); keep a bounded number of these around
+            if len(self._early_results) >= 1000:
+                self._early_results.pop(next(iter(self._early_results)))
+            self._early_results[request_id] = status_data
+            return False
+
+        self._handle_status(entry, status_data)
+        return True
+
+    def _next_interval(self, entry):
+        if entry.poll_interval and not (entry.follow_progress and entry.status == "IN_PROGRESS"):
+            return entry.poll_interval
+
+        if entry.status == "IN_QUEUE":
+            # Nothing happens until a worker picks the job up; back off 2s, 3s, 4.5s, ...
+            return min(self.max_interval, 2.0 * 1.5 ** entry.queue_polls)
+
+        if self.avg_execution_time is None or entry.started_at is None:
+            return 3.0
+
+        remaining = self.avg_execution_time - (time.monotonic() - entry.started_at)
+        if remaining > 0:
+            # Poll at half the expected remaining time, so we tighten up near the finish
+            return min(self.max_interval, max(self.min_interval, remaining / 2))
+        # Overdue: start fast, then relax the longer the job overruns
+        return min(self.max_interval, self.min_interval + (-remaining) / 10)
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            due = [entry for entry in self.tracked.values() if entry.next_poll <= now]
+            if due:
+                await asyncio.gather(*(self._poll(entry) for entry in due))
+
+            next_poll = min((entry.next_poll for entry in self.tracked.values()), default=None)
+            timeout = None if next_poll is None else max(0.0, next_poll - time.monotonic())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, entry):
+        async with self._semaphore:
+            try:
+                status_data = await entry.client.status(entry.request_id)
+            except Exception as e:
+                entry.errors += 1
+                print(f"Polling Error ({entry.request_id}): {e}")
+                if entry.errors >= self.max_errors:
+                    self._resolve(entry, exception=RunPodError("Error polling RunPod status"))
+                else:
+                    entry.next_poll = time.monotonic() + min(self.max_interval, 2.0 ** entry.errors)
+                return
+
+        entry.errors = 0
+        self._handle_status(entry, status_data)
+
+    def _handle_status(self, entry, status_data):
+        status = status_data.get("status")
+        progress = status_data.get("output") if status == "IN_PROGRESS" else None
+        if status != entry.status or progress != entry.progress:
+            if status == "IN_PROGRESS" and entry.status != status:
+                entry.started_at = time.monotonic()
+            entry.status = status
+            entry.progress = progress
+            if entry.on_status:
+                try:
+                    entry.on_status(status, status_data)
+                except Exception as e:
+                    print(f"Status callback error ({entry.request_id}): {e}")
+
+        if status in RUNPOD_FINAL_STATUSES:
+            if status == "COMPLETED" and status_data.get("executionTime"):
+                self._record_execution_time(status_data["executionTime"] / 1000)
+            self._resolve(entry, result=status_data)
+            return
+
+        if status == "IN_QUEUE":
+            entry.queue_polls += 1
+        entry.next_poll = time.monotonic() + self._next_interval(entry)
+
+    def _record_execution_time(self, seconds):
+        if self.avg_execution_time is None:
+            self.avg_execution_time = seconds
+        else:
+            self.avg_execution_time = 0.8 * self.avg_execution_time + 0.2 * seconds
+
+    def _resolve(self, entry, result=None, exception=None):
+        self.tracked.pop(entry.request_id, None)
+        if entry.future.done():
+            return
+        if exception is not None:
+            entry.future.set_exception(exception)
+        else:
+            entry.future.set_result(result)
@@ -0,0 +1,155 @@
+import math
+import time
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+
+# Lower runs first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class AdmissionError(Exception):
+    """
+    The scheduler cannot take another job right now; retry_after is a hint in seconds.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    def __init__(self, seq, client_id):
+        self.seq = seq
+        self.client_id = client_id
+        self.priority = PRIORITY_NORMAL
+        self.weight = 1
+        self.state = "queued"  # queued -> running -> released
+        self.admitted_at = time.time()
+        self.started_at = None
+        self.future = None
+
+
+class JobScheduler:
+    """
+    Admission control in front of RunPod submission.
+
+    admit() reserves a place for a new job, or raises AdmissionError once the wait queue
+    (or the client's share of it) is full, so the API can answer 429 before doing any work.
+    slot() then waits until the job may run: at most max_in_flight running jobs overall
+    (a job can weigh more than one, e.g. a video split into parallel segments) and at
+    most max_per_client per client. Waiting jobs start in priority order, FIFO within a
+    priority; jobs from a client at its cap are skipped, not blocking others behind them.
+    """
+
+    def __init__(self, max_in_flight, max_per_client, max_queued, max_queued_per_client, default_job_seconds=60):
+        self.max_in_flight = max_in_flight
+        self.max_per_client = max_per_client
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client
+        # EMA of how long a job holds its slot, for Retry-After
+        self.avg_job_seconds = default_job_seconds
+        self.in_flight = 0
+        self.queued = 0
+        self._running_by_client = {}
+        self._queued_by_client = {}
+        self._waiting = []
+        self._seq = itertools.count()
+
+    # --- Admission ---
+
+    def retry_after(self):
+        waves = math.ceil((self.queued + 1) / max(self.max_in_flight, 1))
+        return max(1, min(600, math.ceil(self.avg_job_seconds * waves)))
+
+    def check(self, client_id):
+        """
+        Raise AdmissionError if admit() would. Cheap enough to run before reading a request body.
+        """
+        if self.queued >= self.max_queued:
+            raise AdmissionError("Too many jobs waiting, try again later", self.retry_after())
+        if self._queued_by_client.get(client_id, 0) >= self.max_queued_per_client:
+            raise AdmissionError("Too many of your jobs are waiting, try again later", self.retry_after())
+
+    def admit(self, client_id):
+        self.check(client_id)
+        ticket = Ticket(next(self._seq), client_id)
+        self.queued += 1
+        self._queued_by_client[client_id] = self._queued_by_client.get(client_id, 0) + 1
+        return ticket
+
+    # --- Running ---
+
+    @asynccontextmanager
+    async def slot(self, ticket, priority=PRIORITY_NORMAL, weight=1):
+        """
+        Hold a running slot for the duration of the block. Releases the ticket on exit.
+        """
+        ticket.priority = priority
+        ticket.weight = max(1, min(weight, self.max_in_flight))
+        ticket.future = asyncio.get_running_loop().create_future()
+        self._waiting.append(ticket)
+        self._waiting.sort(key=lambda t: (t.priority, t.seq))
+        self._dispatch()
+        try:
+            await ticket.future
+        except BaseException:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+            self.release(ticket)
+            raise
+
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def release(self, ticket):
+        """
+        Give back whatever the ticket holds. Safe to call more than once.
+        """
+        if ticket.state == "queued":
+            self._leave_queue(ticket)
+        elif ticket.state == "running":
+            self.in_flight -= ticket.weight
+            self._decrement(self._running_by_client, ticket.client_id)
+            held = time.time() - ticket.started_at
+            self.avg_job_seconds = 0.8 * self.avg_job_seconds + 0.2 * held
+        ticket.state = "released"
+        self._dispatch()
+
+    def _leave_queue(self, ticket):
+        self.queued -= 1
+        self._decrement(self._queued_by_client, ticket.client_id)
+
+    @staticmethod
+    def _decrement(counts, client_id):
+        counts[client_id] -= 1
+        if not counts[client_id]:
+            del counts[client_id]
+
+    def _dispatch(self):
+        for ticket in list(self._waiting):
+            if self._running_by_client.get(ticket.client_id, 0) >= self.max_per_client:
+                continue
+            if self.in_flight and self.in_flight + ticket.weight > self.max_in_flight:
+                # Strict priority across clients: nothing smaller jumps ahead of a blocked job
+                break
+            self._waiting.remove(ticket)
+            self._leave_queue(ticket)
+            ticket.state = "running"
+            ticket.started_at = time.time()
+            self.in_flight += ticket.weight
+            self._running_by_client[ticket.client_id] = self._running_by_client.get(ticket.client_id, 0) + 1
+            ticket.future.set_result(None)
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "waiting": len(self._waiting),
+            "max_in_flight": self.max_in_flight,
+            "max_queued": self.max_queued,
+        }
@@ -0,0 +1,107 @@
+import os
+import shutil
+import asyncio
+
+# Stream copy (-c copy) keeps every helper here free of re-encoding:
+# segment boundaries snap to the next keyframe and concatenation is a remux.
+
+
+class FFmpegError(Exception):
+    pass
+
+
+def ffmpeg_available():
+    return bool(shutil.which("ffmpeg") and shutil.which("ffprobe"))
+
+
+async def _run(*args):
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise FFmpegError(f"{args[0]} failed ({process.returncode}): {stderr.decode(errors='replace')[-500:]}")
+    return stdout.decode()
+
+
+async def probe_duration(source):
+    """
+    Duration in seconds of a local file or URL (ffprobe only reads the container header).
+    """
+    output = await _run(
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        source,
+    )
+    try:
+        return float(output.strip())
+    except ValueError:
+        raise FFmpegError(f"Could not read duration of {source[:80]}")
+
+
+async def split_at_keyframes(source, out_dir, segment_seconds):
+    """
+    Split source into ~segment_seconds pieces at keyframes. Returns the segment paths in order.
+    """
+    pattern = os.path.join(out_dir, "segment_%04d.mp4")
+    await _run(
+        "ffmpeg", "-v", "error", "-y",
+        "-i", source,
+        "-map", "0:v:0", "-map", "0:a?",
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_time", str(segment_seconds),
+        "-reset_timestamps", "1",
+        pattern,
+    )
+    return sorted(
+        os.path.join(out_dir, name)
+        for name in os.listdir(out_dir)
+        if name.startswith("segment_")
+    )
+
+
+async def extract_clip(source, output_path, seconds=None, frames=None):
+    """
+    Copy the start of source (the first seconds, or the first frames of video) into output_path.
+    """
+    if frames:
+        # Video only: audio would run on past the last copied frame
+        limit = ["-map", "0:v:0", "-frames:v", str(frames), "-an"]
+    else:
+        limit = ["-map", "0:v:0", "-map", "0:a?", "-t", str(seconds)]
+    await _run(
+        "ffmpeg", "-v", "error", "-y",
+        "-i", source,
+        *limit,
+        "-c", "copy",
+        "-movflags", "+faststart",
+        output_path,
+    )
+    return output_path
+
+
+async def concat_segments(paths, output_path):
+    """
+    Join segments (in the given order) into one file without re-encoding.
+    """
+    list_path = f"{output_path}.txt"
+    with open(list_path, "w") as f:
+        for path in paths:
+            escaped = path.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    try:
+        await _run(
+            "ffmpeg", "-v", "error", "-y",
+            "-f", "concat", "-safe", "0",
+            "-i", list_path,
+            "-c", "copy",
+            "-movflags", "+faststart",
+            output_path,
+        )
+    finally:
+        os.remove(list_path)
+    return output_path
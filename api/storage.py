@@ -1,46 +1,256 @@
 import os
-import boto3
-from botocore.config import Config
+import json
+import time
+import threading
+from collections import OrderedDict
+
+try:
+    from .sigv4 import SigV4Presigner
+    from .metrics import registry
+except ImportError:
+    from sigv4 import SigV4Presigner
+    from metrics import registry
+
+# Streamed transfers hold at most max_concurrency * multipart_chunksize bytes in memory
+TRANSFER_CHUNK_SIZE = 8 * 1024 * 1024
+TRANSFER_MAX_CONCURRENCY = 4
+
+# Presigned download URLs are reused instead of re-signed on every request. A URL is handed out for
+# at most URL_CACHE_TTL_FRACTION of its lifetime (and URL_CACHE_MAX_TTL seconds), so whoever gets it
+# from the cache still has most of its ExpiresIn left. Upload URLs (single PUTs and UploadParts) are
+# single-use targets of one uploader and are always signed fresh.
+URL_CACHE_MAX_ENTRIES = 10000
+URL_CACHE_TTL_FRACTION = 0.25
+URL_CACHE_MAX_TTL = 900
+
+URL_CACHE_LOOKUPS = registry.counter(
+    "presigned_url_cache_lookups_total", "Presigned URL cache lookups by result", ["result"]
+)
+
+
+class PresignedUrlCache:
+    """
+    Bounded LRU of presigned URLs, each entry kept for a fraction of the URL's lifetime.
+    Thread-safe: the same StorageManager serves the event loop and worker threads.
+    """
+
+    def __init__(self, max_entries=URL_CACHE_MAX_ENTRIES, ttl_fraction=URL_CACHE_TTL_FRACTION, max_ttl=URL_CACHE_MAX_TTL):
+        self.max_entries = max_entries
+        self.ttl_fraction = ttl_fraction
+        self.max_ttl = max_ttl
+        self._entries = OrderedDict()  # key -> (url, expires_at)
+        self._lock = threading.Lock()
+
+    def get_or_sign(self, key, expiration, sign):
+        """
+        The cached URL for key, or sign() (a URL valid for expiration seconds) cached for next time.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                self._entries.move_to_end(key)
+                URL_CACHE_LOOKUPS.labels(result="hit").inc()
+                return entry[0]
+        URL_CACHE_LOOKUPS.labels(result="miss").inc()
+
+        url = sign()
+        if url:
+            with self._lock:
+                self._entries[key] = (url, now + min(expiration * self.ttl_fraction, self.max_ttl))
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return url
+
+    def __len__(self):
+        return len(self._entries)
+
 
 class StorageManager:
+    """
+    Cloudflare R2 access. Presigned URLs are signed locally (see sigv4.py), and download URLs
+    cached, so handing one out never blocks and is safe to call from async code. The boto3
+    client, needed for actual S3 calls, is imported and built on first use, so a cold start
+    that only hands out URLs never pays for boto3.
+    """
+
     def __init__(self):
         self.endpoint_url = os.getenv("R2_ENDPOINT_URL")
         self.access_key_id = os.getenv("R2_ACCESS_KEY_ID")
         self.secret_access_key = os.getenv("R2_SECRET_ACCESS_KEY")
         self.bucket_name = os.getenv("R2_BUCKET_NAME")
         self.public_url = os.getenv("R2_PUBLIC_URL")
-        
-        if not all([self.endpoint_url, self.access_key_id, self.secret_access_key, self.bucket_name]):
+        self._s3_client = None
+        self._transfer_config = None
+        self._client_lock = threading.Lock()
+        self.url_cache = PresignedUrlCache()
+
+        self.configured = all([self.endpoint_url, self.access_key_id, self.secret_access_key, self.bucket_name])
+        if not self.configured:
             print("Warning: Cloudflare R2 credentials missing. Storage features will not work.")
-            self.s3_client = None
+            self.presigner = None
         else:
-            self.s3_client = boto3.client(
-                's3',
-                endpoint_url=self.endpoint_url,
-                aws_access_key_id=self.access_key_id,
-                aws_secret_access_key=self.secret_access_key,
-                config=Config(signature_version='s3v4'),
-                region_name='auto' # Cloudflare R2 uses 'auto'
-            )
+            # Cloudflare R2 uses region 'auto'
+            self.presigner = SigV4Presigner(self.endpoint_url, self.access_key_id, self.secret_access_key)
+
+    @property
+    def s3_client(self):
+        if self._s3_client is None and self.configured:
+            # Jobs reach storage from worker threads; build the client only once
+            with self._client_lock:
+                if self._s3_client is None:
+                    import boto3
+                    from boto3.s3.transfer import TransferConfig
+                    from botocore.config import Config
+                    self._transfer_config = TransferConfig(
+                        multipart_threshold=TRANSFER_CHUNK_SIZE,
+                        multipart_chunksize=TRANSFER_CHUNK_SIZE,
+                        max_concurrency=TRANSFER_MAX_CONCURRENCY,
+                    )
+                    self._s3_client = boto3.client(
+                        's3',
+                        endpoint_url=self.endpoint_url,
+                        aws_access_key_id=self.access_key_id,
+                        aws_secret_access_key=self.secret_access_key,
+                        config=Config(signature_version='s3v4'),
+                        region_name='auto' # Cloudflare R2 uses 'auto'
+                    )
+        return self._s3_client
+
+    def _presign(self, method, object_name, expiration, params=None, cache=True):
+        def sign():
+            return self.presigner.presign(method, self.bucket_name, object_name, expiration, params=params)
+
+        if not cache:
+            return sign()
+        key = (method, object_name, expiration, tuple(sorted(params.items())) if params else None)
+        return self.url_cache.get_or_sign(key, expiration, sign)
 
     def generate_presigned_upload_url(self, object_name, expiration=3600):
-        if not self.s3_client:
+        if not self.configured:
             return None
         try:
-            response = self.s3_client.generate_presigned_url(
-                'put_object',
-                Params={
-                    'Bucket': self.bucket_name,
-                    'Key': object_name,
-                    # 'ContentType': 'video/mp4' # Optional, enforces content type
-                },
-                ExpiresIn=expiration
-            )
-            return response
+            return self._presign('PUT', object_name, expiration, cache=False)
         except Exception as e:
             print(f"Error generating upload URL: {e}")
             return None
 
+    def upload_fileobj(self, fileobj, object_name, content_type=None):
+        """
+        Stream a file-like object to the bucket in chunks (multipart for large files).
+        Blocking; call it from a worker thread inside async code.
+        """
+        if not self.configured:
+            return False
+        extra_args = {"ContentType": content_type} if content_type else None
+        try:
+            self.s3_client.upload_fileobj(
+                fileobj,
+                self.bucket_name,
+                object_name,
+                ExtraArgs=extra_args,
+                Config=self._transfer_config
+            )
+            return True
+        except Exception as e:
+            print(f"Error uploading {object_name}: {e}")
+            return False
+
+    def download_file(self, object_name, local_path):
+        """
+        Download an object to a local file (ranged, parallel GETs for large objects).
+        Blocking; call it from a worker thread inside async code.
+        """
+        if not self.configured:
+            return False
+        try:
+            self.s3_client.download_file(self.bucket_name, object_name, local_path, Config=self._transfer_config)
+            return True
+        except Exception as e:
+            print(f"Error downloading {object_name}: {e}")
+            return False
+
+    def head_object(self, object_name):
+        """
+        Returns {'size', 'etag'} for an existing object, or None.
+        """
+        if not self.configured:
+            return None
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket_name, Key=object_name)
+            return {'size': response['ContentLength'], 'etag': response['ETag']}
+        except Exception:
+            return None
+
+    def get_json(self, object_name):
+        if not self.configured:
+            return None
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=object_name)
+            return json.loads(response['Body'].read())
+        except Exception:
+            return None
+
+    def get_text(self, object_name):
+        if not self.configured:
+            return None
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=object_name)
+            return response['Body'].read().decode('utf-8')
+        except Exception:
+            return None
+
+    def put_json(self, object_name, data):
+        if not self.configured:
+            return False
+        try:
+            self.s3_client.put_object(
+                Bucket=self.bucket_name,
+                Key=object_name,
+                Body=json.dumps(data).encode('utf-8'),
+                ContentType='application/json'
+            )
+            return True
+        except Exception as e:
+            print(f"Error writing {object_name}: {e}")
+            return False
+
+    def list_objects(self, prefix):
+        """
+        All objects under prefix as {'key', 'size', 'last_modified'} dicts.
+        """
+        if not self.configured:
+            return []
+        objects = []
+        try:
+            paginator = self.s3_client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+                for obj in page.get('Contents', []):
+                    objects.append({
+                        'key': obj['Key'],
+                        'size': obj['Size'],
+                        'last_modified': obj['LastModified'].timestamp()
+                    })
+        except Exception as e:
+            print(f"Error listing {prefix}: {e}")
+        return objects
+
+    def delete_objects(self, object_names):
+        if not self.configured or not object_names:
+            return False
+        try:
+            # DeleteObjects accepts at most 1000 keys per call
+            for i in range(0, len(object_names), 1000):
+                self.s3_client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in object_names[i:i + 1000]], 'Quiet': True}
+                )
+            return True
+        except Exception as e:
+            print(f"Error deleting objects: {e}")
+            return False
+
     def generate_presigned_download_url(self, object_name, expiration=3600):
         # If a public URL is configured, returning that is cleaner and faster
         if self.public_url:
@@ -49,18 +259,109 @@ class StorageManager:
             path = object_name.lstrip("/")
             return f"{base}/{path}"
 
-        if not self.s3_client:
+        if not self.configured:
             return None
         try:
-            response = self.s3_client.generate_presigned_url(
-                'get_object',
-                Params={
-                    'Bucket': self.bucket_name,
-                    'Key': object_name
-                },
-                ExpiresIn=expiration
-            )
-            return response
+            return self._presign('GET', object_name, expiration)
         except Exception as e:
             print(f"Error generating download URL: {e}")
             return None
+
+    # --- Multipart uploads (used by the browser uploader) ---
+
+    def create_multipart_upload(self, object_name, content_type=None):
+        if not self.configured:
+            return None
+        params = {'Bucket': self.bucket_name, 'Key': object_name}
+        if content_type:
+            params['ContentType'] = content_type
+        try:
+            response = self.s3_client.create_multipart_upload(**params)
+            return response['UploadId']
+        except Exception as e:
+            print(f"Error creating multipart upload: {e}")
+            return None
+
+    def generate_presigned_part_urls(self, object_name, upload_id, part_numbers, expiration=3600):
+        """
+        Presign an UploadPart URL for each part number. Signing is local, so this is cheap in bulk.
+        """
+        if not self.configured:
+            return None
+        try:
+            return {
+                part_number: self._presign(
+                    'PUT', object_name, expiration, params={'partNumber': part_number, 'uploadId': upload_id},
+                    cache=False,
+                )
+                for part_number in part_numbers
+            }
+        except Exception as e:
+            print(f"Error generating part URLs: {e}")
+            return None
+
+    def list_parts(self, object_name, upload_id):
+        """
+        Parts already stored for an upload, so an interrupted upload can resume.
+        """
+        if not self.configured:
+            return None
+        parts = []
+        marker = 0
+        try:
+            while True:
+                response = self.s3_client.list_parts(
+                    Bucket=self.bucket_name,
+                    Key=object_name,
+                    UploadId=upload_id,
+                    PartNumberMarker=marker
+                )
+                for part in response.get('Parts', []):
+                    parts.append({
+                        'PartNumber': part['PartNumber'],
+                        'ETag': part['ETag'],
+                        'Size': part['Size']
+                    })
+                if not response.get('IsTruncated'):
+                    return parts
+                marker = response['NextPartNumberMarker']
+        except Exception as e:
+            print(f"Error listing parts: {e}")
+            return None
+
+    def complete_multipart_upload(self, object_name, upload_id, parts):
+        """
+        parts: list of {'PartNumber': int, 'ETag': str}
+        """
+        if not self.configured:
+            return False
+        try:
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=object_name,
+                UploadId=upload_id,
+                MultipartUpload={
+                    'Parts': sorted(
+                        ({'PartNumber': p['PartNumber'], 'ETag': p['ETag']} for p in parts),
+                        key=lambda p: p['PartNumber']
+                    )
+                }
+            )
+            return True
+        except Exception as e:
+            print(f"Error completing multipart upload: {e}")
+            return False
+
+    def abort_multipart_upload(self, object_name, upload_id):
+        if not self.configured:
+            return False
+        try:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=object_name,
+                UploadId=upload_id
+            )
+            return True
+        except Exception as e:
+            print(f"Error aborting multipart upload: {e}")
+            return False
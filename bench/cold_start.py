@@ -0,0 +1,242 @@
+"""
+Cold-start benchmark for the API: what a fresh serverless instance pays before answering.
+
+For every endpoint, --runs fresh interpreters each import api.index and serve one request
+to that endpoint straight through ASGI (no server, no network: R2 and RunPod settings
+point nowhere, and only endpoints that never call them are measured). Reports the median
+import time, first-request time and their sum, plus which heavy dependencies the instance
+ended up loading.
+
+    python bench/cold_start.py
+    python bench/cold_start.py --runs 10 --output bench/cold_start.json
+    python bench/cold_start.py --baseline bench/cold_start.json   # exit 1 on regressions
+    python bench/cold_start.py --importtime 15                    # slowest imports of api.index
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, method, path, JSON body)
+ENDPOINTS = [
+    ("metrics", "GET", "/api/metrics", None),
+    ("job_status", "GET", "/api/jobs/0123456789abcdef", None),
+    ("upload_url", "GET", "/api/upload-url?filename=bench.mp4", None),
+    ("download_url", "GET", "/api/download-url?file_key=outputs/bench.mp4", None),
+    ("part_urls", "POST", "/api/uploads/multipart/part-urls",
+     {"key": "uploads/bench.mp4", "upload_id": "bench", "part_numbers": list(range(1, 51))}),
+]
+# Dependencies worth keeping off the cold path; reported when an instance loaded them
+HEAVY_MODULES = ["boto3", "botocore", "httpx", "uvicorn", "aiofiles", "fastapi.staticfiles"]
+
+# Like a Vercel instance with storage configured, minus anything that would touch the network
+CHILD_ENV = {
+    "VERCEL": "1",
+    "JOB_DB_PATH": "",
+    "R2_ENDPOINT_URL": "http://127.0.0.1:9",
+    "R2_BUCKET_NAME": "bench",
+    "R2_ACCESS_KEY_ID": "bench",
+    "R2_SECRET_ACCESS_KEY": "bench",
+    "R2_PUBLIC_URL": "",
+    "RUNPOD_API_KEY": "bench",
+    "PUBLIC_BASE_URL": "",
+}
+# Compared against a baseline (all lower is better)
+REGRESSION_CHECKS = ["import_ms", "request_ms", "total_ms"]
+
+
+# --- Child: one cold start ---
+
+async def asgi_request(app, method, path, body):
+    path, _, query = path.partition("?")
+    payload = json.dumps(body).encode() if body is not None else b""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [
+            (b"host", b"bench"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+    }
+    messages = [{"type": "http.request", "body": payload, "more_body": False}]
+    response = {}
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+
+    await app(scope, receive, send)
+    return response.get("status")
+
+
+def run_child(spec):
+    name, method, path, body = json.loads(spec)
+    sys.path.insert(0, REPO_ROOT)
+
+    started = time.perf_counter()
+    from api.index import app
+    imported = time.perf_counter()
+    status = asyncio.run(asgi_request(app, method, path, body))
+    finished = time.perf_counter()
+
+    print(json.dumps({
+        "endpoint": name,
+        "status": status,
+        "import_ms": (imported - started) * 1000,
+        "request_ms": (finished - imported) * 1000,
+        "total_ms": (finished - started) * 1000,
+        "loaded": [module for module in HEAVY_MODULES if module in sys.modules],
+    }))
+
+
+# --- Parent ---
+
+def cold_start(endpoint):
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", json.dumps(endpoint)],
+        cwd=REPO_ROOT,
+        env={**os.environ, **CHILD_ENV},
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Cold start for {endpoint[0]} failed:\n{process.stderr[-2000:]}")
+    # The API prints its own startup messages; the measurement is the last line
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def measure(endpoint, runs):
+    samples = [cold_start(endpoint) for _ in range(runs)]
+    result = {"endpoint": endpoint[0], "runs": runs, "status": samples[-1]["status"]}
+    for metric in REGRESSION_CHECKS:
+        values = [s[metric] for s in samples]
+        result[metric] = statistics.median(values)
+        result[f"{metric}_max"] = max(values)
+    result["loaded"] = sorted({module for s in samples for module in s["loaded"]})
+    return result
+
+
+def slowest_imports(count):
+    """
+    The count top-level packages with the highest cumulative import time when importing
+    api.index (-X importtime), the API's own modules excluded.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api.index"],
+        cwd=REPO_ROOT,
+        env={**os.environ, **CHILD_ENV},
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in process.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)", line)
+        # A package's cumulative time already covers its submodules
+        if match and "." not in match.group(2) and match.group(2) not in ("api", "site"):
+            rows.append((int(match.group(1)) / 1000, match.group(2)))
+    return sorted(rows, reverse=True)[:count]
+
+
+def print_report(results):
+    header = f"{'endpoint':<14}{'status':>8}{'import ms':>11}{'request ms':>12}{'total ms':>10}{'max ms':>9}  loaded"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['endpoint']:<14}{r['status']:>8}{r['import_ms']:>11.1f}{r['request_ms']:>12.1f}"
+            f"{r['total_ms']:>10.1f}{r['total_ms_max']:>9.1f}  {', '.join(r['loaded']) or '-'}"
+        )
+
+
+def compare_to_baseline(results, baseline, max_regression):
+    """
+    List of human-readable regressions beyond max_regression (relative) vs the baseline.
+    """
+    previous = {r["endpoint"]: r for r in baseline["endpoints"]}
+    regressions = []
+    for r in results:
+        old = previous.get(r["endpoint"])
+        if not old:
+            continue
+        for metric in REGRESSION_CHECKS:
+            before, after = old.get(metric), r.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if change > max_regression:
+                regressions.append(f"{r['endpoint']} {metric}: {before:.1f} -> {after:.1f} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per endpoint")
+    parser.add_argument(
+        "--endpoints", type=lambda v: [e for e in v.split(",") if e.strip()],
+        help=f"comma-separated subset of: {', '.join(e[0] for e in ENDPOINTS)}",
+    )
+    parser.add_argument("--importtime", type=int, metavar="N", help="also list the N slowest top-level imports")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+
+    results_group = parser.add_argument_group("results")
+    results_group.add_argument("--output", help="write results as JSON")
+    results_group.add_argument("--baseline", help="compare against a previous --output file")
+    results_group.add_argument("--max-regression", type=float, default=0.25, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    endpoints = [e for e in ENDPOINTS if not args.endpoints or e[0] in args.endpoints]
+    results = []
+    for endpoint in endpoints:
+        print(f"Measuring {endpoint[0]} ({args.runs} cold starts)...", flush=True)
+        results.append(measure(endpoint, args.runs))
+
+    print()
+    print_report(results)
+
+    if args.importtime:
+        print("\nSlowest top-level imports of api.index:")
+        for cumulative_ms, module in slowest_imports(args.importtime):
+            print(f"  {cumulative_ms:>8.1f} ms  {module}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created_at": time.time(), "endpoints": results}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.max_regression)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.max_regression:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Local stand-in for the RunPod serverless API.
+
+Emulates /run, /status/{id} and /cancel/{id} for any endpoint id, and plays the
+part of updated_handler.py: it downloads the input URL, "upscales" it by copying
+it to the presigned output URL(s), and calls the job's webhook when it finishes.
+Failures can be injected both as FAILED jobs and as HTTP 5xx responses. Each endpoint id
+gets its own pool of --workers (0 = unlimited), reported through /health like RunPod does;
+--endpoint-delay gives one endpoint a different queue delay, e.g. to exercise hedging.
+
+    python bench/fake_runpod.py --port 8001 --failure-rate 0.05 --http-error-rate 0.01
+    python bench/fake_runpod.py --workers 2 --endpoint-delay slow-gpu=30
+    RUNPOD_API_BASE=http://127.0.0.1:8001/v2 python run_server.py
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI()
+
+config = {
+    "queue_delay": 1.0,
+    "processing_time": 2.0,
+    # Each delay is drawn uniformly from [value * (1 - jitter), value * (1 + jitter)]
+    "jitter": 0.0,
+    # Fraction of jobs that end FAILED instead of COMPLETED
+    "failure_rate": 0.0,
+    # Fraction of /run and /status calls answered with a 503
+    "http_error_rate": 0.0,
+    # Concurrent jobs per endpoint id (0 = unlimited)
+    "workers": 0,
+    # endpoint id -> queue delay overriding queue_delay
+    "endpoint_delay": {},
+}
+
+jobs = {}
+tasks = set()
+worker_slots = {}
+
+
+def workers_for(endpoint_id):
+    if endpoint_id not in worker_slots:
+        worker_slots[endpoint_id] = asyncio.Semaphore(config["workers"]) if config["workers"] else None
+    return worker_slots[endpoint_id]
+
+
+async def emulate_handler(client, job_input):
+    """
+    What updated_handler.py does, minus the GPU: fetch the input and upload it as the output.
+    """
+    video = job_input.get("video") or ""
+    if not video.startswith("http"):
+        return {"status": "success", "message": "Inline input accepted (not echoed back)"}
+
+    response = await client.get(video)
+    response.raise_for_status()
+    content = response.content
+
+    multipart = job_input.get("output_multipart")
+    if multipart:
+        part_size = multipart["part_size"]
+        parts = []
+        for n, offset in enumerate(range(0, max(len(content), 1), part_size), start=1):
+            part = await client.put(multipart["part_urls"][n - 1], content=content[offset:offset + part_size])
+            part.raise_for_status()
+            parts.append({"PartNumber": n, "ETag": part.headers["ETag"]})
+        return {"status": "success", "output_parts": parts, "message": "Output uploaded as multipart parts"}
+
+    if job_input.get("output_upload_url"):
+        upload = await client.put(job_input["output_upload_url"], content=content)
+        upload.raise_for_status()
+        return {"status": "success", "message": "Output uploaded to provided URL"}
+
+    return {"status": "success", "message": "No output destination provided"}
+
+
+def jittered(seconds):
+    spread = seconds * config["jitter"]
+    return max(0.0, random.uniform(seconds - spread, seconds + spread))
+
+
+def injected_error():
+    if random.random() < config["http_error_rate"]:
+        return JSONResponse(status_code=503, content={"error": "Injected failure"})
+    return None
+
+
+async def run_job(job):
+    queue_delay = config["endpoint_delay"].get(job["endpoint"], config["queue_delay"])
+    await asyncio.sleep(jittered(queue_delay))
+    slots = workers_for(job["endpoint"])
+    if slots is None:
+        await process_job(job)
+    else:
+        async with slots:
+            await process_job(job)
+
+
+async def process_job(job):
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        if job["status"] == "CANCELLED":
+            return
+        job["status"] = "IN_PROGRESS"
+        job["delayTime"] = int((time.time() - job["submitted_at"]) * 1000)
+        started = time.time()
+
+        try:
+            await asyncio.sleep(jittered(config["processing_time"]))
+            if job["status"] == "CANCELLED":
+                return
+            if random.random() < config["failure_rate"]:
+                raise RuntimeError("Injected handler failure")
+            job["output"] = await emulate_handler(client, job["input"])
+            job["status"] = "COMPLETED"
+        except Exception as e:
+            job["status"] = "FAILED"
+            job["error"] = str(e)
+        job["executionTime"] = int((time.time() - started) * 1000)
+
+        if job.get("webhook"):
+            try:
+                await client.post(job["webhook"], json=public_view(job))
+            except httpx.RequestError as e:
+                print(f"Webhook delivery failed for {job['id']}: {e}")
+
+
+def public_view(job):
+    keys = ["id", "status", "delayTime", "executionTime", "output", "error"]
+    return {key: job[key] for key in keys if key in job}
+
+
+@app.post("/v2/{endpoint_id}/run")
+async def run(endpoint_id: str, request: Request):
+    error = injected_error()
+    if error:
+        return error
+    body = await request.json()
+    job = {
+        "id": f"fake-{uuid.uuid4().hex[:12]}",
+        "endpoint": endpoint_id,
+        "status": "IN_QUEUE",
+        "input": body.get("input", {}),
+        "webhook": body.get("webhook"),
+        "submitted_at": time.time(),
+    }
+    jobs[job["id"]] = job
+    task = asyncio.create_task(run_job(job))
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    return {"id": job["id"], "status": job["status"]}
+
+
+@app.get("/v2/{endpoint_id}/status/{request_id}")
+def status(endpoint_id: str, request_id: str):
+    error = injected_error()
+    if error:
+        return error
+    job = jobs.get(request_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return public_view(job)
+
+
+@app.get("/v2/{endpoint_id}/health")
+def health(endpoint_id: str):
+    counts = {}
+    for job in jobs.values():
+        if job["endpoint"] == endpoint_id:
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+    running = counts.get("IN_PROGRESS", 0)
+    return {
+        "jobs": {
+            "completed": counts.get("COMPLETED", 0),
+            "failed": counts.get("FAILED", 0),
+            "inProgress": running,
+            "inQueue": counts.get("IN_QUEUE", 0),
+            "retried": 0,
+        },
+        "workers": {
+            "idle": max(config["workers"] - running, 0),
+            "running": running,
+        },
+    }
+
+
+@app.post("/v2/{endpoint_id}/cancel/{request_id}")
+def cancel(endpoint_id: str, request_id: str):
+    job = jobs.get(request_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] in ("IN_QUEUE", "IN_PROGRESS"):
+        job["status"] = "CANCELLED"
+    return {"id": request_id, "status": job["status"]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--queue-delay", type=float, default=config["queue_delay"], help="seconds IN_QUEUE")
+    parser.add_argument("--processing-time", type=float, default=config["processing_time"], help="seconds IN_PROGRESS")
+    parser.add_argument("--jitter", type=float, default=config["jitter"], help="relative spread of both delays")
+    parser.add_argument("--failure-rate", type=float, default=config["failure_rate"], help="fraction of jobs that fail")
+    parser.add_argument("--http-error-rate", type=float, default=config["http_error_rate"], help="fraction of 503 responses")
+    parser.add_argument("--workers", type=int, default=config["workers"], help="concurrent jobs per endpoint (0 = unlimited)")
+    parser.add_argument(
+        "--endpoint-delay", action="append", default=[], metavar="ENDPOINT=SECONDS",
+        help="queue delay for one endpoint id (repeatable)",
+    )
+    args = parser.parse_args()
+
+    for name in config:
+        if name != "endpoint_delay":
+            config[name] = getattr(args, name)
+    for item in args.endpoint_delay:
+        endpoint_id, seconds = item.split("=", 1)
+        config["endpoint_delay"][endpoint_id] = float(seconds)
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
@@ -0,0 +1,270 @@
+"""
+Local, in-memory stand-in for the S3 API that StorageManager talks to (Cloudflare R2 in production).
+
+Covers exactly what api/storage.py, presigned URLs and boto3's transfer manager use:
+Put/Get (ranged)/Head/Delete object, DeleteObjects, ListObjectsV2 and the multipart
+calls (create, upload part, list parts, complete, abort). Buckets are created on first
+use, signatures are not checked and only path-style addressing is supported.
+
+    python bench/fake_s3.py --port 9000
+    R2_ENDPOINT_URL=http://127.0.0.1:9000 R2_BUCKET_NAME=bench \\
+    R2_ACCESS_KEY_ID=x R2_SECRET_ACCESS_KEY=x python run_server.py
+"""
+import argparse
+import hashlib
+import re
+import time
+import uuid
+from email.utils import formatdate
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+app = FastAPI()
+
+S3_NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+# bucket -> key -> {"data", "etag", "content_type", "modified"}
+buckets = {}
+# upload_id -> {"bucket", "key", "content_type", "parts": {part_number: {"data", "etag", "modified"}}}
+uploads = {}
+
+
+def iso_time(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(timestamp))
+
+
+def xml_response(root, body, status_code=200):
+    content = f'<?xml version="1.0" encoding="UTF-8"?>\n<{root} xmlns="{S3_NAMESPACE}">{body}</{root}>'
+    return Response(content=content, status_code=status_code, media_type="application/xml")
+
+
+def error_response(status_code, code, message):
+    content = f'<?xml version="1.0" encoding="UTF-8"?>\n<Error><Code>{code}</Code><Message>{escape(message)}</Message></Error>'
+    return Response(content=content, status_code=status_code, media_type="application/xml")
+
+
+def decode_aws_chunked(body):
+    """
+    Strip aws-chunked framing ("<hex size>[;chunk-signature=...]\\r\\n<data>\\r\\n", then
+    trailers) which boto3 uses for streamed uploads with trailing checksums.
+    """
+    data = bytearray()
+    pos = 0
+    while True:
+        line_end = body.index(b"\r\n", pos)
+        size = int(body[pos:line_end].split(b";")[0], 16)
+        if size == 0:
+            return bytes(data)
+        start = line_end + 2
+        data += body[start:start + size]
+        pos = start + size + 2
+
+
+async def read_body(request):
+    body = await request.body()
+    encoding = request.headers.get("content-encoding", "")
+    if "aws-chunked" in encoding or request.headers.get("x-amz-content-sha256", "").startswith("STREAMING-"):
+        body = decode_aws_chunked(body)
+    return body
+
+
+def etag_of(data):
+    return f'"{hashlib.md5(data).hexdigest()}"'
+
+
+def parse_range(header, size):
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+# --- Bucket-level calls ---
+
+@app.put("/{bucket}")
+def create_bucket(bucket: str):
+    buckets.setdefault(bucket, {})
+    return Response(status_code=200)
+
+
+@app.get("/{bucket}")
+def list_objects(bucket: str, request: Request):
+    prefix = request.query_params.get("prefix", "")
+    objects = buckets.get(bucket, {})
+    contents = "".join(
+        f"<Contents><Key>{escape(key)}</Key><Size>{len(obj['data'])}</Size>"
+        f"<ETag>{escape(obj['etag'])}</ETag><LastModified>{iso_time(obj['modified'])}</LastModified>"
+        f"<StorageClass>STANDARD</StorageClass></Contents>"
+        for key, obj in sorted(objects.items())
+        if key.startswith(prefix)
+    )
+    count = contents.count("<Contents>")
+    return xml_response(
+        "ListBucketResult",
+        f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{count}</KeyCount>"
+        f"<MaxKeys>1000</MaxKeys><IsTruncated>false</IsTruncated>{contents}",
+    )
+
+
+@app.post("/{bucket}")
+async def delete_objects(bucket: str, request: Request):
+    if "delete" not in request.query_params:
+        return error_response(400, "NotImplemented", "Only DeleteObjects is supported on a bucket")
+    tree = ElementTree.fromstring(await read_body(request))
+    objects = buckets.get(bucket, {})
+    deleted = []
+    for element in tree.iter():
+        if element.tag.endswith("Key"):
+            objects.pop(element.text, None)
+            deleted.append(f"<Deleted><Key>{escape(element.text)}</Key></Deleted>")
+    return xml_response("DeleteResult", "".join(deleted))
+
+
+# --- Object-level calls ---
+
+@app.put("/{bucket}/{key:path}")
+async def put_object(bucket: str, key: str, request: Request):
+    data = await read_body(request)
+    etag = etag_of(data)
+    upload_id = request.query_params.get("uploadId")
+
+    if upload_id:
+        upload = uploads.get(upload_id)
+        if not upload:
+            return error_response(404, "NoSuchUpload", "The specified upload does not exist")
+        part_number = int(request.query_params["partNumber"])
+        upload["parts"][part_number] = {"data": data, "etag": etag, "modified": time.time()}
+    else:
+        buckets.setdefault(bucket, {})[key] = {
+            "data": data,
+            "etag": etag,
+            "content_type": request.headers.get("content-type", "application/octet-stream"),
+            "modified": time.time(),
+        }
+    return Response(status_code=200, headers={"ETag": etag})
+
+
+@app.post("/{bucket}/{key:path}")
+async def multipart(bucket: str, key: str, request: Request):
+    if "uploads" in request.query_params:
+        upload_id = uuid.uuid4().hex
+        uploads[upload_id] = {
+            "bucket": bucket,
+            "key": key,
+            "content_type": request.headers.get("content-type", "application/octet-stream"),
+            "parts": {},
+        }
+        return xml_response(
+            "InitiateMultipartUploadResult",
+            f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>",
+        )
+
+    upload_id = request.query_params.get("uploadId")
+    upload = uploads.get(upload_id)
+    if not upload:
+        return error_response(404, "NoSuchUpload", "The specified upload does not exist")
+
+    tree = ElementTree.fromstring(await read_body(request))
+    requested = [
+        int(element.text)
+        for element in tree.iter()
+        if element.tag.endswith("PartNumber")
+    ]
+    if not requested or any(n not in upload["parts"] for n in requested):
+        return error_response(400, "InvalidPart", "One or more of the specified parts could not be found")
+
+    parts = [upload["parts"][n] for n in requested]
+    data = b"".join(part["data"] for part in parts)
+    digest = hashlib.md5(b"".join(bytes.fromhex(part["etag"].strip('"')) for part in parts)).hexdigest()
+    etag = f'"{digest}-{len(parts)}"'
+    buckets.setdefault(bucket, {})[key] = {
+        "data": data,
+        "etag": etag,
+        "content_type": upload["content_type"],
+        "modified": time.time(),
+    }
+    del uploads[upload_id]
+    return xml_response(
+        "CompleteMultipartUploadResult",
+        f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key><ETag>{escape(etag)}</ETag>",
+    )
+
+
+@app.get("/{bucket}/{key:path}")
+def get_object(bucket: str, key: str, request: Request):
+    upload_id = request.query_params.get("uploadId")
+    if upload_id:
+        upload = uploads.get(upload_id)
+        if not upload:
+            return error_response(404, "NoSuchUpload", "The specified upload does not exist")
+        parts = "".join(
+            f"<Part><PartNumber>{n}</PartNumber><LastModified>{iso_time(part['modified'])}</LastModified>"
+            f"<ETag>{escape(part['etag'])}</ETag><Size>{len(part['data'])}</Size></Part>"
+            for n, part in sorted(upload["parts"].items())
+        )
+        return xml_response(
+            "ListPartsResult",
+            f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>"
+            f"<MaxParts>1000</MaxParts><IsTruncated>false</IsTruncated>{parts}",
+        )
+
+    obj = buckets.get(bucket, {}).get(key)
+    if not obj:
+        return error_response(404, "NoSuchKey", "The specified key does not exist.")
+
+    headers = {
+        "ETag": obj["etag"],
+        "Last-Modified": formatdate(obj["modified"], usegmt=True),
+        "Accept-Ranges": "bytes",
+    }
+    data = obj["data"]
+    range_header = request.headers.get("range")
+    if range_header:
+        byte_range = parse_range(range_header, len(data))
+        if not byte_range:
+            return error_response(416, "InvalidRange", "The requested range is not satisfiable")
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        return Response(content=data[start:end + 1], status_code=206, headers=headers, media_type=obj["content_type"])
+    return Response(content=data, headers=headers, media_type=obj["content_type"])
+
+
+@app.head("/{bucket}/{key:path}")
+def head_object(bucket: str, key: str):
+    obj = buckets.get(bucket, {}).get(key)
+    if not obj:
+        return Response(status_code=404)
+    return Response(headers={
+        "Content-Length": str(len(obj["data"])),
+        "Content-Type": obj["content_type"],
+        "ETag": obj["etag"],
+        "Last-Modified": formatdate(obj["modified"], usegmt=True),
+        "Accept-Ranges": "bytes",
+    })
+
+
+@app.delete("/{bucket}/{key:path}")
+def delete_object(bucket: str, key: str, request: Request):
+    upload_id = request.query_params.get("uploadId")
+    if upload_id:
+        uploads.pop(upload_id, None)
+    else:
+        buckets.get(bucket, {}).pop(key, None)
+    return Response(status_code=204)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9000)
+    args = parser.parse_args()
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
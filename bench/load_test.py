@@ -0,0 +1,408 @@
+"""
+Load test for POST /api/upscale against local stand-ins for R2 and RunPod.
+
+Starts bench/fake_s3.py, bench/fake_runpod.py and the API (each in its own process),
+then for every file size x concurrency combination uploads --requests files and follows
+each job to the end. Reports throughput, p50/p99 latency (until the 202 and until the job
+finished) and the API's peak RSS, sampled from /proc (Linux).
+
+    python bench/load_test.py --sizes 1,16,64 --concurrency 1,8,32 --requests 32
+    python bench/load_test.py --output bench/baseline.json
+    python bench/load_test.py --baseline bench/baseline.json   # exit 1 on regressions
+
+Every upload carries a unique prefix so the result cache never short-circuits a job.
+All traffic comes from one address, i.e. one client for the API's scheduler, so the per-client
+caps default to the global ones; uploads turned away with 429 are reported on their own.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(REPO_ROOT, "bench")
+
+JOB_POLL_INTERVAL = 0.25
+RSS_SAMPLE_INTERVAL = 0.05
+# Compared against a baseline: lower is better for latency/RSS, higher for throughput
+REGRESSION_CHECKS = {
+    "accept_p50": "lower",
+    "accept_p99": "lower",
+    "total_p99": "lower",
+    "throughput": "higher",
+    "peak_rss_mb": "lower",
+}
+
+
+# --- Processes ---
+
+def start_process(args, env=None):
+    return subprocess.Popen(
+        [sys.executable, *args],
+        cwd=REPO_ROOT,
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_until_up(url, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process for {url} exited with {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+class Stack:
+    """
+    fake_s3 + fake_runpod + the API, torn down on exit.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.processes = []
+        self.api_url = f"http://127.0.0.1:{args.api_port}"
+        self.api_pid = None
+
+    def __enter__(self):
+        args = self.args
+        s3_url = f"http://127.0.0.1:{args.s3_port}"
+        runpod_url = f"http://127.0.0.1:{args.runpod_port}"
+
+        s3 = start_process([os.path.join(BENCH_DIR, "fake_s3.py"), "--port", str(args.s3_port)])
+        self.processes.append(s3)
+        runpod = start_process([
+            os.path.join(BENCH_DIR, "fake_runpod.py"),
+            "--port", str(args.runpod_port),
+            "--queue-delay", str(args.queue_delay),
+            "--processing-time", str(args.processing_time),
+            "--jitter", str(args.jitter),
+            "--failure-rate", str(args.failure_rate),
+            "--http-error-rate", str(args.http_error_rate),
+        ])
+        self.processes.append(runpod)
+
+        api_env = {
+            "R2_ENDPOINT_URL": s3_url,
+            "R2_BUCKET_NAME": "bench",
+            "R2_ACCESS_KEY_ID": "bench",
+            "R2_SECRET_ACCESS_KEY": "bench",
+            "R2_PUBLIC_URL": "",
+            "RUNPOD_API_BASE": f"{runpod_url}/v2",
+            "RUNPOD_API_KEY": "bench",
+            "PUBLIC_BASE_URL": self.api_url if args.webhooks else "",
+            # The API only signs webhook URLs (and so only uses webhooks) with a secret
+            "RUNPOD_WEBHOOK_SECRET": "bench" if args.webhooks else "",
+            "SEGMENT_LONG_VIDEOS": "false",
+            "MAX_INFLIGHT_JOBS": str(args.max_inflight),
+            "MAX_INFLIGHT_JOBS_PER_CLIENT": str(args.max_inflight_per_client or args.max_inflight),
+            "MAX_QUEUED_JOBS": str(args.max_queued),
+            "MAX_QUEUED_JOBS_PER_CLIENT": str(args.max_queued_per_client or args.max_queued),
+        }
+        api = start_process(
+            ["-m", "uvicorn", "api.index:app", "--port", str(args.api_port), "--log-level", "warning"],
+            env=api_env,
+        )
+        self.processes.append(api)
+        self.api_pid = api.pid
+
+        try:
+            wait_until_up(s3_url, s3)
+            wait_until_up(f"{runpod_url}/docs", runpod)
+            wait_until_up(f"{self.api_url}/api/metrics", api)
+            httpx.put(f"{s3_url}/bench")
+        except Exception:
+            self.__exit__()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+# --- Measurements ---
+
+def read_rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+async def sample_peak_rss(pid, peak, stop):
+    while not stop.is_set():
+        rss = read_rss_mb(pid)
+        if rss is not None:
+            peak["mb"] = max(peak["mb"] or 0, rss)
+        try:
+            await asyncio.wait_for(stop.wait(), RSS_SAMPLE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Nearest-rank
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+class UniqueUpload:
+    """
+    Reads a unique 32-byte prefix followed by the shared payload file, so every request
+    has distinct content without keeping a copy of the payload per request in memory.
+    """
+
+    def __init__(self, path):
+        self.prefix = uuid.uuid4().hex.encode()
+        self.file = open(path, "rb")
+
+    def read(self, size=-1):
+        if self.prefix:
+            head, self.prefix = self.prefix, b""
+            return head + self.file.read(max(size - len(head), 0) if size >= 0 else -1)
+        return self.file.read(size)
+
+    def close(self):
+        self.file.close()
+
+
+async def run_request(client, api_url, payload_path, args):
+    result = {"ok": False, "rejected": False, "accept": None, "total": None}
+    upload = UniqueUpload(payload_path)
+    started = time.perf_counter()
+    try:
+        response = await client.post(
+            f"{api_url}/api/upscale",
+            params={"target_resolution": args.target_resolution},
+            files={"file": ("bench.mp4", upload, "video/mp4")},
+        )
+        result["accept"] = time.perf_counter() - started
+        if response.status_code == 429:
+            # Admission control at work, not an error
+            result["rejected"] = True
+            return result
+        if response.status_code != 202:
+            result["error"] = f"HTTP {response.status_code}"
+            return result
+
+        if not args.wait:
+            result["ok"] = True
+            return result
+
+        status_url = f"{api_url}{response.json()['status_url']}"
+        while True:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            job = (await client.get(status_url)).json()
+            if job["status"] in ("COMPLETED", "FAILED", "CANCELLED"):
+                break
+        result["total"] = time.perf_counter() - started
+        result["ok"] = job["status"] == "COMPLETED"
+        if not result["ok"]:
+            result["error"] = job.get("error") or job["status"]
+    except httpx.HTTPError as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        upload.close()
+    return result
+
+
+async def run_scenario(api_url, api_pid, payload_path, size_mb, concurrency, args):
+    semaphore = asyncio.Semaphore(concurrency)
+    peak = {"mb": None}
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_peak_rss(api_pid, peak, stop)) if api_pid else None
+
+    async def one(client):
+        async with semaphore:
+            return await run_request(client, api_url, payload_path, args)
+
+    limits = httpx.Limits(max_connections=concurrency * 2)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one(client) for _ in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    stop.set()
+    if sampler:
+        await sampler
+
+    ok = [r for r in results if r["ok"]]
+    accept = [r["accept"] for r in results if r["accept"] is not None and not r["rejected"]]
+    total = [r["total"] for r in results if r["total"] is not None]
+    errors = {}
+    for r in results:
+        if r.get("error"):
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+
+    return {
+        "size_mb": size_mb,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "succeeded": len(ok),
+        "rejected": sum(1 for r in results if r["rejected"]),
+        "elapsed": elapsed,
+        "throughput": len(ok) / elapsed if elapsed else 0.0,
+        "upload_mb_per_s": size_mb * len(accept) / elapsed if elapsed else 0.0,
+        "accept_p50": percentile(accept, 50),
+        "accept_p99": percentile(accept, 99),
+        "total_p50": percentile(total, 50),
+        "total_p99": percentile(total, 99),
+        "peak_rss_mb": peak["mb"],
+        "errors": errors,
+    }
+
+
+# --- Reporting ---
+
+def scenario_name(scenario):
+    return f"{scenario['size_mb']:g}MB x{scenario['concurrency']}"
+
+
+def print_report(scenarios):
+    def fmt(value, spec=".3f"):
+        return "-" if value is None else format(value, spec)
+
+    header = f"{'scenario':<14}{'ok':>8}{'429':>6}{'jobs/s':>9}{'MB/s':>9}{'202 p50':>10}{'202 p99':>10}{'done p50':>10}{'done p99':>10}{'RSS MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for s in scenarios:
+        print(
+            f"{scenario_name(s):<14}{s['succeeded']:>4}/{s['requests']:<3}{s.get('rejected', 0):>6}{s['throughput']:>9.2f}"
+            f"{s['upload_mb_per_s']:>9.1f}{fmt(s['accept_p50']):>10}{fmt(s['accept_p99']):>10}"
+            f"{fmt(s['total_p50']):>10}{fmt(s['total_p99']):>10}{fmt(s['peak_rss_mb'], '.0f'):>9}"
+        )
+        for error, count in s["errors"].items():
+            print(f"    {count} x {error}")
+
+
+def compare_to_baseline(scenarios, baseline, max_regression):
+    """
+    List of human-readable regressions beyond max_regression (relative) vs the baseline.
+    """
+    previous = {scenario_name(s): s for s in baseline["scenarios"]}
+    regressions = []
+    for s in scenarios:
+        old = previous.get(scenario_name(s))
+        if not old:
+            continue
+        for metric, better in REGRESSION_CHECKS.items():
+            before, after = old.get(metric), s.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if (better == "lower" and change > max_regression) or (better == "higher" and -change > max_regression):
+                regressions.append(f"{scenario_name(s)} {metric}: {before:.3f} -> {after:.3f} ({change:+.0%})")
+    return regressions
+
+
+async def run_all(args, api_url, api_pid):
+    scenarios = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size_mb in args.sizes:
+            payload_path = os.path.join(tmp, f"payload_{size_mb:g}MB.bin")
+            with open(payload_path, "wb") as f:
+                remaining = int(size_mb * 1024 * 1024)
+                while remaining > 0:
+                    chunk = os.urandom(min(remaining, 4 * 1024 * 1024))
+                    f.write(chunk)
+                    remaining -= len(chunk)
+
+            for concurrency in args.concurrency:
+                print(f"Running {size_mb:g}MB x{concurrency} ({args.requests} requests)...", flush=True)
+                scenarios.append(await run_scenario(api_url, api_pid, payload_path, size_mb, concurrency, args))
+    return scenarios
+
+
+def parse_list(value, cast):
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,16", type=lambda v: parse_list(v, float), help="file sizes in MB")
+    parser.add_argument("--concurrency", default="1,8", type=lambda v: parse_list(v, int), help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=16, help="requests per scenario")
+    parser.add_argument("--target-resolution", default="1920x1080")
+    parser.add_argument("--no-wait", dest="wait", action="store_false", help="stop timing at the 202")
+    parser.add_argument("--timeout", type=float, default=300.0, help="per-request HTTP timeout")
+    parser.add_argument("--webhooks", action="store_true", help="let fake RunPod call the API's webhook")
+
+    fake = parser.add_argument_group("fake RunPod")
+    fake.add_argument("--queue-delay", type=float, default=0.5)
+    fake.add_argument("--processing-time", type=float, default=1.0)
+    fake.add_argument("--jitter", type=float, default=0.2)
+    fake.add_argument("--failure-rate", type=float, default=0.0)
+    fake.add_argument("--http-error-rate", type=float, default=0.0)
+
+    target = parser.add_argument_group("processes")
+    target.add_argument("--api-url", help="benchmark an already running API instead of starting the stack")
+    target.add_argument("--api-pid", type=int, help="PID of --api-url's process, for RSS sampling")
+    target.add_argument("--api-port", type=int, default=8100)
+    target.add_argument("--s3-port", type=int, default=9100)
+    target.add_argument("--runpod-port", type=int, default=8101)
+
+    caps = parser.add_argument_group("API scheduler (per-client caps default to the global ones)")
+    caps.add_argument("--max-inflight", type=int, default=10, help="jobs running at RunPod at once")
+    caps.add_argument("--max-inflight-per-client", type=int)
+    caps.add_argument("--max-queued", type=int, default=1000, help="admitted jobs waiting for a slot")
+    caps.add_argument("--max-queued-per-client", type=int)
+
+    results = parser.add_argument_group("results")
+    results.add_argument("--output", help="write results as JSON")
+    results.add_argument("--baseline", help="compare against a previous --output file")
+    results.add_argument("--max-regression", type=float, default=0.25, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    if args.api_url:
+        scenarios = asyncio.run(run_all(args, args.api_url.rstrip("/"), args.api_pid))
+    else:
+        with Stack(args) as stack:
+            scenarios = asyncio.run(run_all(args, stack.api_url, stack.api_pid))
+
+    print()
+    print_report(scenarios)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created_at": time.time(), "scenarios": scenarios}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(scenarios, json.load(f), args.max_regression)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.max_regression:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
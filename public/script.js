@@ -11,10 +11,19 @@ const resetBtn = document.getElementById('reset-btn');
 const errorState = document.getElementById('error-state');
 const errorText = document.getElementById('error-text');
 const retryBtn = document.getElementById('retry-btn');
+const resultTitle = document.getElementById('result-title');
+const resultActions = document.getElementById('result-actions');
+const previewToggle = document.getElementById('preview-toggle');
+const previewActions = document.getElementById('preview-actions');
+const confirmBtn = document.getElementById('confirm-btn');
+const cancelBtn = document.getElementById('cancel-btn');
 
 const selectedFileInfo = document.getElementById('selected-file-info');
 const sendBtn = document.getElementById('send-btn');
 let selectedFile = null;
+// hls.js player for the live preview, while one is showing
+let previewPlayer = null;
+let previewing = false;
 
 // Drag and Drop Events
 ['dragenter', 'dragover', 'dragleave', 'drop'].forEach(eventName => {
@@ -130,20 +139,40 @@ async function uploadFile(file) {
     const sliderVal = parseInt(qualitySlider.value);
     const resolution = resolutions[sliderVal];
     addLog(`Selected Target Resolution: ${resolution} (${resolutionLabels[sliderVal]})`);
-
-    // Prepare Data
-    const formData = new FormData();
-    formData.append('file', file);
-    formData.append('target_resolution', resolution);
+    // Upscale the first seconds first; the full job waits until the user approves them
+    const preview = previewToggle.checked;
 
     try {
-        const apiUrl = '/api/upscale';
-        addLog(`Sending POST request to ${apiUrl}...`);
-
-        const response = await fetch(apiUrl, {
-            method: 'POST',
-            body: formData
-        });
+        const uploadedKey = await uploadMultipart(file);
+
+        let response;
+        if (uploadedKey) {
+            addLog(`Submitting uploaded file ${uploadedKey}...`);
+            response = await submitWhenAdmitted(() => fetch('/api/jobs', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    key: uploadedKey,
+                    filename: file.name,
+                    target_resolution: resolution,
+                    preview,
+                    confirm: preview
+                })
+            }));
+        } else {
+            // Prepare Data
+            const formData = new FormData();
+            formData.append('file', file);
+            formData.append('target_resolution', resolution);
+
+            const apiUrl = '/api/upscale';
+            addLog(`Sending POST request to ${apiUrl}...`);
+
+            response = await submitWhenAdmitted(() => fetch(apiUrl, {
+                method: 'POST',
+                body: formData
+            }));
+        }
 
         addLog(`Response received. Status: ${response.status} ${response.statusText}`);
 
@@ -165,15 +194,26 @@ async function uploadFile(file) {
             throw new Error(`خطأ في السيرفر (${response.status}): ${snippet}...`);
         }
 
+        addLog(`Job created: ${data.job_id}`);
+        if (data.preview) {
+            const approved = await reviewPreview(data);
+            if (!approved) {
+                addLog('Full job cancelled after the preview');
+                resetUI();
+                return;
+            }
+        }
+        const job = await waitForJob(data);
+
         addLog("Processing response data...");
-        if (data.url) {
-            addLog(`Success! Video URL URL: ${data.url}`);
-            showResult(data.url);
-        } else if (data.output) {
-            if (typeof data.output === 'string' && data.output.startsWith('http')) {
-                showResult(data.output);
+        if (job.url) {
+            addLog(`Success! Video URL URL: ${job.url}`);
+            showResult(job.url);
+        } else if (job.output) {
+            if (typeof job.output === 'string' && job.output.startsWith('http')) {
+                showResult(job.output);
             } else {
-                showResultUrlOrRaw(data.output);
+                showResultUrlOrRaw(job.output);
             }
         } else {
             addLog("Error: Invalid response structure.");
@@ -191,6 +231,270 @@ async function uploadFile(file) {
     }
 }
 
+const statusText = document.getElementById('status-text');
+
+// Direct-to-R2 multipart upload settings
+const PART_CONCURRENCY = 4;
+const PART_MAX_RETRIES = 5;
+const PART_URL_BATCH = 50;
+
+async function postJson(url, body) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    });
+    const data = await response.json().catch(() => ({}));
+    if (!response.ok) {
+        throw new Error(data.detail || `${url} failed (${response.status})`);
+    }
+    return data;
+}
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+// The server answers 429 + Retry-After while its job queue is full
+const BUSY_MAX_RETRIES = 10;
+
+async function submitWhenAdmitted(send) {
+    let response = await send();
+    for (let attempt = 1; response.status === 429 && attempt <= BUSY_MAX_RETRIES; attempt++) {
+        const waitSeconds = parseInt(response.headers.get('Retry-After'), 10) || 10;
+        addLog(`Server busy, retrying in ${waitSeconds}s (${attempt}/${BUSY_MAX_RETRIES})`);
+        statusText.textContent = 'السيرفر مشغول، في انتظار دورك...';
+        await sleep(waitSeconds * 1000);
+        response = await send();
+    }
+    return response;
+}
+
+// Uploads the file straight to R2 in parallel parts and returns its object key
+// (or null when direct uploads are not available).
+// Progress is kept in localStorage so a reload or dropped connection resumes
+// from the parts R2 already has instead of starting over.
+async function uploadMultipart(file) {
+    const resumeId = `upload:${file.name}:${file.size}:${file.lastModified}`;
+    const completed = new Map();
+    let session = JSON.parse(localStorage.getItem(resumeId) || 'null');
+
+    if (session) {
+        const params = new URLSearchParams({ key: session.key, upload_id: session.upload_id });
+        const response = await fetch(`/api/uploads/multipart/parts?${params}`);
+        if (response.ok) {
+            const { parts } = await response.json();
+            parts.forEach(p => completed.set(p.part_number, p.etag));
+            addLog(`Resuming upload: ${completed.size}/${session.part_count} parts already stored`);
+        } else {
+            session = null;
+        }
+    }
+
+    if (!session) {
+        try {
+            session = await postJson('/api/uploads/multipart', {
+                filename: file.name,
+                size: file.size,
+                content_type: file.type
+            });
+        } catch (error) {
+            // Storage not configured: the caller falls back to posting through the API
+            addLog(`Direct upload unavailable (${error.message}), sending through the server...`);
+            return null;
+        }
+        localStorage.setItem(resumeId, JSON.stringify(session));
+        addLog(`Multipart upload started: ${session.part_count} parts of ${(session.part_size / 1024 / 1024).toFixed(0)} MB`);
+    }
+
+    const pending = [];
+    for (let n = 1; n <= session.part_count; n++) {
+        if (!completed.has(n)) pending.push(n);
+    }
+
+    const partUrls = new Map();
+    const fetchPartUrls = async (partNumber) => {
+        const batch = pending.filter(n => n >= partNumber && !partUrls.has(n)).slice(0, PART_URL_BATCH);
+        if (!batch.includes(partNumber)) batch.unshift(partNumber);
+        const { urls } = await postJson('/api/uploads/multipart/part-urls', {
+            key: session.key,
+            upload_id: session.upload_id,
+            part_numbers: batch
+        });
+        Object.entries(urls).forEach(([n, url]) => partUrls.set(Number(n), url));
+    };
+
+    let uploadedBytes = [...completed.keys()].reduce(
+        (sum, n) => sum + Math.min(session.part_size, file.size - (n - 1) * session.part_size), 0);
+    const reportProgress = () => {
+        const percent = Math.floor(uploadedBytes / file.size * 100);
+        statusText.textContent = `جاري رفع الفيديو... ${percent}%`;
+    };
+    reportProgress();
+
+    const uploadPart = async (partNumber) => {
+        const start = (partNumber - 1) * session.part_size;
+        const blob = file.slice(start, Math.min(start + session.part_size, file.size));
+
+        for (let attempt = 1; ; attempt++) {
+            try {
+                if (!partUrls.has(partNumber)) await fetchPartUrls(partNumber);
+                const response = await fetch(partUrls.get(partNumber), { method: 'PUT', body: blob });
+                if (response.status === 403) {
+                    // Presigned URL probably expired; get a fresh one
+                    partUrls.delete(partNumber);
+                }
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+
+                const etag = response.headers.get('ETag');
+                if (!etag) throw new Error('ETag header not exposed (check the bucket CORS policy)');
+                completed.set(partNumber, etag);
+                uploadedBytes += blob.size;
+                reportProgress();
+                return;
+            } catch (error) {
+                if (attempt >= PART_MAX_RETRIES) {
+                    throw new Error(`Part ${partNumber} failed after ${attempt} attempts: ${error.message}`);
+                }
+                const delay = Math.min(30000, 1000 * 2 ** (attempt - 1));
+                addLog(`Part ${partNumber} failed (${error.message}), retrying in ${delay / 1000}s...`);
+                await sleep(delay);
+            }
+        }
+    };
+
+    const queue = [...pending];
+    const worker = async () => {
+        while (queue.length > 0) {
+            await uploadPart(queue.shift());
+        }
+    };
+    await Promise.all(Array.from({ length: Math.min(PART_CONCURRENCY, queue.length) }, worker));
+
+    await postJson('/api/uploads/multipart/complete', {
+        key: session.key,
+        upload_id: session.upload_id,
+        parts: [...completed.entries()].map(([part_number, etag]) => ({ part_number, etag }))
+    });
+    localStorage.removeItem(resumeId);
+    addLog(`Upload complete: ${session.key}`);
+    return session.key;
+}
+
+const statusMessages = {
+    AWAITING_CONFIRMATION: 'في انتظار موافقتك على المعاينة...',
+    QUEUED: 'تم استلام الفيديو، جاري الإرسال للمعالجة...',
+    IN_QUEUE: 'الفيديو في قائمة الانتظار...',
+    IN_PROGRESS: 'جاري تحسين الفيديو...'
+};
+
+// Follow a job until it finishes. Uses the SSE stream and falls back to polling.
+function waitForJob(submitted, livePreview = true) {
+    return new Promise((resolve, reject) => {
+        let lastStatus = null;
+
+        const handleUpdate = (job) => {
+            if (job.status !== lastStatus) {
+                lastStatus = job.status;
+                addLog(`Job status: ${job.status}`);
+                if (statusMessages[job.status]) {
+                    statusText.textContent = statusMessages[job.status];
+                }
+            }
+            if (livePreview && job.playlist_url && !previewing && job.status === 'IN_PROGRESS') {
+                // The first upscaled segments are ready: start playing while the rest is processed
+                addLog(`Preview available: ${job.playlist_url}`);
+                showPreview(job.playlist_url);
+            }
+            if (job.segments_total && job.status === 'IN_PROGRESS') {
+                // Long videos are upscaled as parallel segments
+                statusText.textContent = `جاري تحسين الفيديو... (${job.segments_done}/${job.segments_total} أجزاء)`;
+            }
+            if (job.status === 'COMPLETED') {
+                resolve(job);
+                return true;
+            }
+            if (job.status === 'FAILED' || job.status === 'CANCELLED') {
+                reject(new Error(job.error || 'فشلت المعالجة'));
+                return true;
+            }
+            return false;
+        };
+
+        const poll = async () => {
+            try {
+                const response = await fetch(submitted.status_url);
+                if (!response.ok) {
+                    throw new Error(`Status request failed (${response.status})`);
+                }
+                if (!handleUpdate(await response.json())) {
+                    setTimeout(poll, 3000);
+                }
+            } catch (error) {
+                reject(error);
+            }
+        };
+
+        if (!window.EventSource) {
+            poll();
+            return;
+        }
+
+        const source = new EventSource(submitted.events_url);
+        source.onmessage = (event) => {
+            if (handleUpdate(JSON.parse(event.data))) {
+                source.close();
+            }
+        };
+        source.onerror = () => {
+            source.close();
+            addLog('Event stream interrupted, falling back to polling...');
+            poll();
+        };
+    });
+}
+
+// Wait for the preview job, show its result and ask whether the full job should run.
+// Resolves to false if the user cancelled it. Without a pending confirmation the full job
+// is already running, so the preview just plays while it does.
+async function reviewPreview(submitted) {
+    addLog(`Preview job created: ${submitted.preview.job_id}`);
+    statusText.textContent = 'جاري تجهيز المعاينة...';
+    let previewJob;
+    try {
+        previewJob = await waitForJob(submitted.preview, false);
+    } catch (error) {
+        addLog(`Preview failed: ${error.message}`);
+        if (submitted.cancel_url) {
+            // The full run would most likely fail the same way
+            await postJson(submitted.cancel_url, {}).catch(() => {});
+            throw error;
+        }
+        return true;
+    }
+
+    addLog(`Preview ready: ${previewJob.url}`);
+    videoOutput.src = previewJob.url;
+    resultTitle.textContent = 'معاينة: هل الجودة مناسبة؟';
+    resultActions.classList.add('hidden');
+    resultState.classList.remove('hidden');
+    if (!submitted.confirm_url) {
+        return true;
+    }
+
+    loadingState.classList.add('hidden');
+    previewActions.classList.remove('hidden');
+    const approved = await new Promise(resolve => {
+        confirmBtn.onclick = () => resolve(true);
+        cancelBtn.onclick = () => resolve(false);
+    });
+    previewActions.classList.add('hidden');
+    await postJson(approved ? submitted.confirm_url : submitted.cancel_url, {});
+    if (approved) {
+        resultTitle.textContent = 'معاينة أثناء معالجة الفيديو كاملاً...';
+        loadingState.classList.remove('hidden');
+    }
+    return approved;
+}
+
 function showResultUrlOrRaw(output) {
     if (typeof output === 'object') {
         showError("مخرجات معقدة: " + JSON.stringify(output));
@@ -199,14 +503,47 @@ function showResultUrlOrRaw(output) {
     }
 }
 
+// Play the job's HLS preview above the progress text. Native HLS (Safari) or hls.js (MSE).
+function showPreview(playlistUrl) {
+    if (window.Hls && Hls.isSupported()) {
+        // An EVENT playlist would otherwise start at the live edge; play from the beginning
+        previewPlayer = new Hls({ startPosition: 0 });
+        previewPlayer.loadSource(playlistUrl);
+        previewPlayer.attachMedia(videoOutput);
+    } else if (videoOutput.canPlayType('application/vnd.apple.mpegurl')) {
+        videoOutput.src = playlistUrl;
+    } else {
+        addLog('HLS playback not supported in this browser, waiting for the full video...');
+        return;
+    }
+    previewing = true;
+    resultTitle.textContent = 'معاينة مباشرة أثناء المعالجة...';
+    resultActions.classList.add('hidden');
+    resultState.classList.remove('hidden');
+}
+
+function stopPreview() {
+    if (previewPlayer) {
+        previewPlayer.destroy();
+        previewPlayer = null;
+    }
+    previewing = false;
+}
+
 function showResult(url) {
     loadingState.classList.add('hidden');
     resultState.classList.remove('hidden');
-    videoOutput.src = url;
+    resultActions.classList.remove('hidden');
+    resultTitle.textContent = 'تمت المعالجة بنجاح!';
+    // A running preview keeps playing (its playlist is complete now); the download is the full MP4
+    if (!previewing) {
+        videoOutput.src = url;
+    }
     downloadBtn.href = url;
 }
 
 function showError(msg) {
+    stopPreview();
     loadingState.classList.add('hidden');
     uploadContent.classList.add('hidden');
     resultState.classList.add('hidden');
@@ -222,7 +559,10 @@ function resetUI() {
     selectedFileInfo.classList.add('hidden'); // Hide selected file info
     fileInput.value = ''; // Reset input
     selectedFile = null;
+    stopPreview();
     videoOutput.src = '';
+    resultActions.classList.remove('hidden');
+    previewActions.classList.add('hidden');
     logsContentDiv.innerHTML = '';
     // logsContentDiv.style.display = 'none'; // Keep logs open if they were open? Or close? User preference.
 }
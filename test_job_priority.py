@@ -0,0 +1,32 @@
+"""
+Priority classes and segmenting are both decided from one probe of the input.
+"""
+import asyncio
+
+import api.index as index
+
+# 1080p and too big to count as a small file: only the duration can make it high priority
+JOB_INPUT = {"video": "https://example.com/clip.mp4", "target_height": 1080}
+INPUT_SIZE = 200 * 1024 * 1024
+
+
+def plan(monkeypatch, duration):
+    async def probe_duration(source):
+        return duration
+
+    monkeypatch.setattr(index, "ffmpeg_available", lambda: True)
+    monkeypatch.setattr(index, "probe_duration", probe_duration)
+    monkeypatch.setattr(index, "SEGMENTING_ENABLED", True)
+    return asyncio.run(index.plan_job("test", JOB_INPUT, INPUT_SIZE))
+
+
+def test_short_clip_runs_first(monkeypatch):
+    assert plan(monkeypatch, 30.0) == (index.PRIORITY_HIGH, None)
+
+
+def test_medium_clip_is_neither_prioritized_nor_segmented(monkeypatch):
+    assert plan(monkeypatch, 120.0) == (index.PRIORITY_NORMAL, None)
+
+
+def test_long_clip_is_segmented(monkeypatch):
+    assert plan(monkeypatch, 900.0) == (index.PRIORITY_NORMAL, 900.0)
@@ -0,0 +1,44 @@
+"""
+Jobs that only exist in the JobStore (pruned, or from before a restart) are served by the API.
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+import api.index as index
+from api.job_store import JobStore
+from api.jobs import JobManager
+
+
+def test_get_job_after_restart(tmp_path, monkeypatch):
+    path = str(tmp_path / "jobs.sqlite3")
+    before = JobManager(store=JobStore(path))
+    job = before.create("clip.mp4", 1920, 1080, quality="balanced")
+    before.update(job.id, status="COMPLETED", url="https://example.com/clip.mp4", result_type="r2_url")
+    before.store.close()
+
+    # A fresh process: nothing in memory, and sync routes reach the store from the threadpool
+    after = JobManager(store=JobStore(path))
+    monkeypatch.setattr(index, "job_manager", after)
+    client = TestClient(index.app)
+    try:
+        response = client.get(f"/api/jobs/{job.id}")
+        assert response.status_code == 200
+        assert response.json()["status"] == "COMPLETED"
+        assert response.json()["url"] == "https://example.com/clip.mp4"
+
+        assert client.get("/api/jobs/0123456789abcdef").status_code == 404
+        assert client.get("/api/jobs/0123456789abcdef/playlist.m3u8").status_code == 404
+    finally:
+        after.store.close()
+
+
+def test_one_process_owns_a_store(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    owner = JobStore(path)
+    try:
+        # Another API worker must not resume the owner's jobs as its own
+        with pytest.raises(RuntimeError):
+            JobStore(path)
+    finally:
+        owner.close()
+    JobStore(path).close()
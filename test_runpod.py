@@ -1,75 +1,297 @@
-import requests
-import base64
-import time
+"""
+Bulk upscale straight against RunPod: for backfills and end-to-end performance checks.
+
+Inputs (files, directories or glob patterns) are streamed to R2 a few at a time, submitted
+to the RunPod endpoint with a presigned input URL and presigned multipart part URLs for the
+output (as the API does), and followed from a single event loop by one shared status poller.
+Finished videos are downloaded to --output-dir, then a throughput and latency summary is printed.
+
+    python test_runpod.py videos/
+    python test_runpod.py "backfill/**/*.mp4" --resolution 3840x2160 --max-jobs 16
+    python test_runpod.py clip.mp4 --no-download --json results.json
+    python test_runpod.py clip.mp4 --cleanup     # delete the run's R2 objects afterwards
+
+Needs RUNPOD_API_KEY and the R2_* settings (see .env).
+"""
+import argparse
+import asyncio
+import glob
+import json
+import math
 import os
+import sys
+import time
+import uuid
 from dotenv import load_dotenv
 
+from api.storage import StorageManager
+from api.runpod_client import RunPodClient, RunPodError, StatusPoller
+
 load_dotenv()
 
 # Configuration
-VIDEO_PATH = r"c:\Users\Doctor Laptop\Desktop\مم\03.mp4"
+VIDEO_PATH = os.getenv("TEST_VIDEO_PATH", "")
 RUNPOD_API_KEY = os.getenv("RUNPOD_API_KEY")
-RUNPOD_ENDPOINT_ID = "hgn3kb2km6tnxi"
-RUNPOD_URL = f"https://api.runpod.ai/v2/{RUNPOD_ENDPOINT_ID}/run"
-RUNPOD_STATUS_URL = f"https://api.runpod.ai/v2/{RUNPOD_ENDPOINT_ID}/status"
+RUNPOD_ENDPOINT_ID = os.getenv("RUNPOD_ENDPOINT_ID", "hgn3kb2km6tnxi")
+RUNPOD_API_BASE = os.getenv("RUNPOD_API_BASE", "https://api.runpod.ai/v2")
 
-HEADERS = {
-    "Authorization": f"Bearer {RUNPOD_API_KEY}",
-    "Content-Type": "application/json"
-}
+VIDEO_EXTENSIONS = {".mp4", ".mov", ".mkv", ".avi", ".webm", ".m4v"}
+# Input/output URLs must stay valid while a job waits in the RunPod queue
+URL_EXPIRATION = 6 * 3600
+BULK_PREFIX = "bulk"
+# Outputs go to R2 as multipart uploads, sized like the API's (64 MB parts, up to 12.5 GB)
+OUTPUT_PART_SIZE = 64 * 1024 * 1024
+OUTPUT_MAX_PARTS = 200
 
-def test_runpod():
-    if not os.path.exists(VIDEO_PATH):
-        print(f"Error: Video file not found at {VIDEO_PATH}")
-        return
-
-    print(f"Reading video file: {VIDEO_PATH}")
-    with open(VIDEO_PATH, "rb") as f:
-        video_bytes = f.read()
-    
-    video_base64 = base64.b64encode(video_bytes).decode('utf-8')
-    print(f"Video encoded. Size: {len(video_base64) / 1024 / 1024:.2f} MB")
-
-    payload = {
-        "input": {
-            "video": video_base64
-        }
-    }
-
-    print("Sending request to RunPod...")
-    try:
-        response = requests.post(RUNPOD_URL, headers=HEADERS, json=payload, timeout=600)
-        print(f"Response Status Code: {response.status_code}")
-        print(f"Response Body: {response.text}")
-
-        if response.status_code != 200:
-            print("Request Failed!")
-            return
-
-        data = response.json()
-        request_id = data.get("id")
-        print(f"Request ID: {request_id}")
-
-        # Polling
-        while True:
-            time.sleep(2)
-            status_resp = requests.get(f"{RUNPOD_STATUS_URL}/{request_id}", headers=HEADERS)
-            status_data = status_resp.json()
+
+def collect_inputs(patterns):
+    """
+    Video files named by patterns: files, directories (searched recursively) or globs.
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, "**", "*"), recursive=True)
+        else:
+            matches = glob.glob(pattern, recursive=True) or [pattern]
+        for path in sorted(matches):
+            if os.path.isfile(path) and os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS:
+                paths.append(os.path.abspath(path))
+    # A file matched by two patterns runs once
+    return list(dict.fromkeys(paths))
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Nearest-rank
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+class BulkRun:
+    """
+    One bulk submission: io_slots bounds concurrent R2 transfers, job_slots the jobs at RunPod.
+    """
+
+    def __init__(self, args, storage, runpod_client):
+        self.args = args
+        self.storage = storage
+        self.runpod_client = runpod_client
+        self.poller = StatusPoller(runpod_client, min_interval=args.poll_interval)
+        self.io_slots = asyncio.Semaphore(args.io_concurrency)
+        self.job_slots = asyncio.Semaphore(args.max_jobs)
+        self.run_id = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        width, height = args.resolution.lower().split("x")
+        self.target = (int(width), int(height))
+
+    async def process(self, index, path):
+        name = os.path.basename(path)
+        tag = f"[{index + 1}] {name}"
+        result = {"file": path, "ok": False, "size": os.path.getsize(path)}
+        started = time.perf_counter()
+        try:
+            input_key = f"{BULK_PREFIX}/{self.run_id}/inputs/{index:05d}_{name}"
+            output_key = f"{BULK_PREFIX}/{self.run_id}/outputs/{index:05d}_{name}"
+
+            async with self.io_slots:
+                stage_start = time.perf_counter()
+                with open(path, "rb") as f:
+                    uploaded = await asyncio.to_thread(self.storage.upload_fileobj, f, input_key, "video/mp4")
+                if not uploaded:
+                    raise RuntimeError("upload to R2 failed")
+                result["upload"] = time.perf_counter() - stage_start
+            print(f"{tag}: uploaded ({result['size'] / 1024 / 1024:.1f} MB in {result['upload']:.1f}s)")
+
+            async with self.job_slots:
+                await self.run_job(tag, input_key, output_key, result)
+            result["output_key"] = output_key
+
+            if self.args.download:
+                local_path = os.path.join(self.args.output_dir, f"upscaled_{index:05d}_{name}")
+                async with self.io_slots:
+                    stage_start = time.perf_counter()
+                    if not await asyncio.to_thread(self.storage.download_file, output_key, local_path):
+                        raise RuntimeError("download from R2 failed")
+                    result["download"] = time.perf_counter() - stage_start
+                result["output"] = local_path
+
+            result["ok"] = True
+            print(f"{tag}: done in {time.perf_counter() - started:.1f}s")
+        except (RunPodError, RuntimeError, OSError) as e:
+            result["error"] = str(e)
+            print(f"{tag}: FAILED ({e})")
+        result["total"] = time.perf_counter() - started
+        return result
+
+    async def run_job(self, tag, input_key, output_key, result):
+        """
+        Run one job at RunPod and assemble its output at output_key from the parts the
+        handler uploaded; raises RuntimeError (or RunPodError) unless that succeeded.
+        """
+        upload_id = await asyncio.to_thread(self.storage.create_multipart_upload, output_key, "video/mp4")
+        if not upload_id:
+            raise RuntimeError("could not start the output multipart upload")
+        completed = False
+        try:
+            status_data = await self.submit_and_wait(tag, input_key, output_key, upload_id, result)
+            output = status_data.get("output")
             status = status_data.get("status")
-            print(f"Status: {status}")
-
-            if status == "COMPLETED":
-                print("Processing Complete!")
-                output = status_data.get("output")
-                print("Output received (truncated):", str(output)[:200])
-                break
-            elif status == "FAILED":
-                print("Processing Failed!")
-                print("Error:", status_data.get("error"))
-                break
-    
-    except Exception as e:
-        print(f"Exception occurred: {e}")
+            # The handler reports its own failures as a COMPLETED job with an error status
+            if status == "COMPLETED" and isinstance(output, dict) and output.get("status") == "error":
+                status, status_data = "FAILED", {"error": output.get("message")}
+            if status != "COMPLETED":
+                error = status_data.get("error") or (output.get("error") if isinstance(output, dict) else output)
+                raise RuntimeError(f"{status}: {error}")
+
+            parts = output.get("output_parts") if isinstance(output, dict) else None
+            if not parts:
+                raise RuntimeError("handler reported no output parts")
+            if not await asyncio.to_thread(self.storage.complete_multipart_upload, output_key, upload_id, parts):
+                raise RuntimeError("could not assemble the output in R2")
+            completed = True
+        finally:
+            if not completed:
+                await asyncio.to_thread(self.storage.abort_multipart_upload, output_key, upload_id)
+
+    async def submit_and_wait(self, tag, input_key, output_key, upload_id, result):
+        # The output size is unknown up front, so presign enough parts for the largest output
+        part_numbers = range(1, OUTPUT_MAX_PARTS + 1)
+        part_urls = await asyncio.to_thread(
+            self.storage.generate_presigned_part_urls, output_key, upload_id, part_numbers, expiration=URL_EXPIRATION
+        )
+        if not part_urls:
+            raise RuntimeError("could not presign the output part URLs")
+        payload = {"input": {
+            "video": self.storage.generate_presigned_download_url(input_key, expiration=URL_EXPIRATION),
+            "output_multipart": {
+                "part_size": OUTPUT_PART_SIZE,
+                "part_urls": [part_urls[n] for n in part_numbers],
+            },
+            "target_width": self.target[0],
+            "target_height": self.target[1],
+            "quality": self.args.quality,
+        }}
+        submitted = time.perf_counter()
+        response = await self.runpod_client.submit(payload)
+        request_id = response.get("id")
+        if not request_id:
+            raise RuntimeError(f"RunPod did not return a job id: {response}")
+        print(f"{tag}: submitted as {request_id}")
+
+        def on_status(status, status_data):
+            if status == "IN_PROGRESS" and "queue" not in result:
+                result["queue"] = time.perf_counter() - submitted
+
+        try:
+            status_data = await asyncio.wait_for(
+                self.poller.wait(request_id, on_status=on_status), self.args.timeout
+            )
+        except asyncio.TimeoutError:
+            await self.runpod_client.cancel(request_id)
+            raise RuntimeError(f"timed out after {self.args.timeout:.0f}s (cancelled)")
+        result["runpod"] = time.perf_counter() - submitted
+        return status_data
+
+    async def run(self, paths):
+        try:
+            return await asyncio.gather(*(self.process(i, path) for i, path in enumerate(paths)))
+        finally:
+            await self.poller.stop()
+            await self.runpod_client.close()
+
+
+def print_summary(results, elapsed):
+    ok = [r for r in results if r["ok"]]
+    input_mb = sum(r["size"] for r in ok) / 1024 / 1024
+    print()
+    print(f"{len(ok)}/{len(results)} videos upscaled in {elapsed:.1f}s")
+    if elapsed:
+        print(f"Throughput: {len(ok) / elapsed * 60:.2f} videos/min, {input_mb / elapsed:.2f} input MB/s")
+
+    header = f"{'stage':<10}{'p50 s':>9}{'p90 s':>9}{'max s':>9}"
+    print()
+    print(header)
+    print("-" * len(header))
+    for stage in ("upload", "queue", "runpod", "download", "total"):
+        values = [r[stage] for r in ok if r.get(stage) is not None]
+        if values:
+            print(f"{stage:<10}{percentile(values, 50):>9.1f}{percentile(values, 90):>9.1f}{max(values):>9.1f}")
+
+    failed = [r for r in results if not r["ok"]]
+    if failed:
+        print(f"\n{len(failed)} failed:")
+        for r in failed:
+            print(f"  {r['file']}: {r['error']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="video files, directories or glob patterns")
+    parser.add_argument("--resolution", default="1920x1080", help="target resolution, WIDTHxHEIGHT")
+    parser.add_argument("--quality", default="balanced")
+    parser.add_argument("--max-jobs", type=int, default=8, help="jobs at RunPod at once")
+    parser.add_argument("--io-concurrency", type=int, default=4, help="concurrent R2 uploads/downloads")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="shortest status poll interval")
+    parser.add_argument("--timeout", type=float, default=3600.0, help="per-job limit once submitted")
+    parser.add_argument("--output-dir", default="upscaled")
+    parser.add_argument("--no-download", dest="download", action="store_false", help="leave results in R2")
+    parser.add_argument(
+        "--cleanup", action="store_true", help=f"delete the run's inputs and outputs ({BULK_PREFIX}/<run id>/) from R2"
+    )
+    parser.add_argument("--json", help="also write per-video results as JSON")
+    parser.add_argument("--endpoint-id", default=RUNPOD_ENDPOINT_ID)
+    return parser.parse_args(argv)
+
+
+def run_bulk(args):
+    """
+    Upscale every input of args; returns the per-video results.
+    """
+    if not RUNPOD_API_KEY:
+        sys.exit("RUNPOD_API_KEY is not set")
+    storage = StorageManager()
+    if not storage.configured:
+        sys.exit("R2 is not configured; bulk runs stream inputs and outputs through R2")
+
+    paths = collect_inputs(args.inputs)
+    if not paths:
+        sys.exit(f"No video files found in: {', '.join(args.inputs)}")
+    if args.download:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    print(f"Upscaling {len(paths)} videos to {args.resolution} "
+          f"({args.max_jobs} jobs at a time, {args.io_concurrency} transfers at a time)")
+    bulk = BulkRun(args, storage, RunPodClient(RUNPOD_API_KEY, args.endpoint_id, base_url=RUNPOD_API_BASE))
+    started = time.perf_counter()
+    results = asyncio.run(bulk.run(paths))
+    print_summary(results, time.perf_counter() - started)
+
+    if args.cleanup:
+        prefix = f"{BULK_PREFIX}/{bulk.run_id}/"
+        keys = [obj["key"] for obj in storage.list_objects(prefix)]
+        if keys and storage.delete_objects(keys):
+            print(f"\nRemoved {len(keys)} objects under {prefix}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+    return results
+
+
+def test_runpod():
+    """
+    End-to-end smoke run on TEST_VIDEO_PATH; skipped when it is not set.
+    """
+    import pytest
+
+    if not VIDEO_PATH or not os.path.exists(VIDEO_PATH):
+        pytest.skip(f"video file not found at {VIDEO_PATH!r} (set TEST_VIDEO_PATH)")
+    results = run_bulk(parse_args([VIDEO_PATH, "--no-download", "--cleanup"]))
+    assert all(r["ok"] for r in results)
+
 
 if __name__ == "__main__":
-    test_runpod()
+    results = run_bulk(parse_args())
+    sys.exit(0 if all(r["ok"] for r in results) else 1)
@@ -1,10 +1,17 @@
 import os
 import base64
 import time
+import asyncio
 import requests
+import math
 import uuid
+import shutil
+import hashlib
+import subprocess
 import logging
 import runpod
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from src.model_loader import load_model
 from src.inference import process_video
 
@@ -16,9 +23,33 @@ logger = logging.getLogger(__name__)
 MODEL_PATH = os.environ.get("MODEL_PATH", "/workspace/model_weights")
 DEVICE = "cuda"
 USE_FP8 = os.environ.get("USE_FP8", "true").lower() == "true"
+DOWNLOAD_BUFFER_SIZE = 4 * 1024 * 1024
+BASE64_CHUNK_BYTES = 3 * 1024 * 1024  # multiple of 3
+BASE64_CHUNK_CHARS = 4 * 1024 * 1024  # multiple of 4
+# Results above this size would exceed RunPod's job payload limit when returned as Base64
+MAX_INLINE_OUTPUT_BYTES = int(os.environ.get("MAX_INLINE_OUTPUT_MB", "10")) * 1024 * 1024
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_PART_RETRIES = int(os.environ.get("UPLOAD_PART_RETRIES", "4"))
+# Concurrency: GPU_SLOTS inferences at once (default: free VRAM after loading the model / VRAM_PER_JOB_GB),
+# plus PIPELINE_EXTRA_JOBS more jobs per worker downloading or uploading around them
+VRAM_PER_JOB_GB = float(os.environ.get("VRAM_PER_JOB_GB", "8"))
+PIPELINE_EXTRA_JOBS = int(os.environ.get("PIPELINE_EXTRA_JOBS", "2"))
+# Streaming mode: keep job files in RAM (/dev/shm) instead of on disk, and upload multipart
+# output parts while process_video is still encoding. /dev/shm is used only with enough free space.
+STREAM_IO = os.environ.get("STREAM_IO", "false").lower() == "true"
+SHM_DIR = "/dev/shm"
+SHM_MIN_FREE_BYTES = int(os.environ.get("SHM_MIN_FREE_MB", "4096")) * 1024 * 1024
+STREAM_POLL_INTERVAL = float(os.environ.get("STREAM_POLL_INTERVAL", "0.5"))
+# HLS preview (job input output_hls): the video is upscaled chunk by chunk and each chunk is
+# published as an fMP4 segment, so playback can start long before the full MP4 exists
+HLS_FMP4_FLAGS = "frag_keyframe+empty_moov+default_base_moof"
 
 # Global Model Cache
 model = None
+gpu_slots = 1
+_gpu_semaphore = None
+# Jobs whose files are in SHM_DIR (see work_dir_root)
+shm_jobs = 0
 
 def init_model():
     global model
@@ -31,20 +62,115 @@ def init_model():
             logger.error(f"Failed to init model: {e}")
             raise e
 
+def detect_gpu_slots():
+    """
+    How many inferences fit on the GPU next to the (already loaded) shared model.
+    """
+    if os.environ.get("GPU_SLOTS"):
+        return max(1, int(os.environ["GPU_SLOTS"]))
+    try:
+        import torch
+    except ImportError:
+        return 1
+    if not torch.cuda.is_available():
+        return 1
+    free_bytes, _ = torch.cuda.mem_get_info()
+    return max(1, int(free_bytes // (VRAM_PER_JOB_GB * 1024 ** 3)))
+
+
+def gpu_semaphore():
+    # Created on first use so it belongs to the event loop RunPod runs the handler on
+    global _gpu_semaphore
+    if _gpu_semaphore is None:
+        _gpu_semaphore = asyncio.Semaphore(gpu_slots)
+    return _gpu_semaphore
+
+
+def concurrency_modifier(current_concurrency):
+    """
+    Jobs this worker takes at once: one per GPU slot, plus a few whose download or upload
+    overlaps the running inferences.
+    """
+    return gpu_slots + PIPELINE_EXTRA_JOBS
+
+
 def download_file(url, local_path):
+    """
+    Streams url to local_path, reading each chunk into one reused destination buffer.
+    """
+    buffer = bytearray(DOWNLOAD_BUFFER_SIZE)
+    view = memoryview(buffer)
     with requests.get(url, stream=True) as r:
         r.raise_for_status()
+        r.raw.decode_content = True
         with open(local_path, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                f.write(chunk)
+            while True:
+                n = r.raw.readinto(buffer)
+                if not n:
+                    break
+                f.write(view[:n])
+
+def work_dir_root():
+    """
+    Where per-job files live: tmpfs in streaming mode (no disk writes), /tmp otherwise.
+    Each job in tmpfs is budgeted SHM_MIN_FREE_BYTES: a job only gets tmpfs if there is room
+    for that much per job already there, as theirs are still growing. Pair with release_work_dir.
+    """
+    global shm_jobs
+    if STREAM_IO and os.path.isdir(SHM_DIR):
+        try:
+            if shutil.disk_usage(SHM_DIR).free >= SHM_MIN_FREE_BYTES * (shm_jobs + 1):
+                shm_jobs += 1
+                return SHM_DIR
+        except OSError:
+            pass
+        logger.warning(f"{SHM_DIR} is too small for another streaming job ({shm_jobs} running), using /tmp")
+    return "/tmp"
+
+def release_work_dir(root):
+    global shm_jobs
+    if root == SHM_DIR:
+        shm_jobs -= 1
 
 def decode_base64(b64_string, local_path):
+    """
+    Decodes in fixed-size slices so only one slice of binary data is held at a time.
+    """
+    carry = ""
     with open(local_path, "wb") as f:
-        f.write(base64.b64decode(b64_string))
+        for start in range(0, len(b64_string), BASE64_CHUNK_CHARS):
+            # Drop whitespace/newlines (b64decode ignores them too) and keep 4-char alignment
+            chunk = carry + "".join(b64_string[start:start + BASE64_CHUNK_CHARS].split())
+            usable = len(chunk) - len(chunk) % 4
+            f.write(base64.b64decode(chunk[:usable]))
+            carry = chunk[usable:]
+        if carry:
+            f.write(base64.b64decode(carry))
 
 def encode_file_to_base64(path):
+    """
+    Encodes the file chunk by chunk into a buffer sized for the result, instead of
+    reading the whole file and then building the encoded copy from it.
+    """
+    file_size = os.path.getsize(path)
+    if file_size > MAX_INLINE_OUTPUT_BYTES:
+        raise ValueError(
+            f"Output is {file_size / 1024 / 1024:.1f} MB, too large to return inline "
+            f"(limit {MAX_INLINE_OUTPUT_BYTES / 1024 / 1024:.0f} MB). Provide output_upload_url or output_multipart."
+        )
+
+    encoded = bytearray(4 * math.ceil(file_size / 3))
+    position = 0
     with open(path, "rb") as f:
-        return base64.b64encode(f.read()).decode('utf-8')
+        while True:
+            # A multiple of 3 bytes encodes without padding, so the chunks concatenate cleanly
+            chunk = f.read(BASE64_CHUNK_BYTES)
+            if not chunk:
+                break
+            piece = base64.b64encode(chunk)
+            encoded[position:position + len(piece)] = piece
+            position += len(piece)
+    return encoded.decode('ascii')
 
 def upload_file_to_presigned_url(local_path, upload_url):
     """
@@ -61,14 +187,383 @@ def upload_file_to_presigned_url(local_path, upload_url):
         logger.error(f"Failed to upload to presigned URL: {e}")
         raise e
 
-def handler(event):
-    global model
+def _read_part(local_path, offset, length):
+    with open(local_path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+def _put(session, url, data, label, headers=None):
+    """
+    PUT data to a presigned URL, retrying with exponential backoff.
+    """
+    for attempt in range(1, UPLOAD_PART_RETRIES + 1):
+        try:
+            response = session.put(url, data=data, headers=headers)
+            response.raise_for_status()
+            return response
+        except Exception as e:
+            if attempt == UPLOAD_PART_RETRIES:
+                raise
+            delay = 2 ** attempt
+            logger.warning(f"{label} upload failed ({e}), retry {attempt} in {delay}s")
+            time.sleep(delay)
+
+def _put_part(session, part_number, url, data):
+    """
+    PUT one part. Returns its {PartNumber, ETag}.
+    """
+    response = _put(session, url, data, f"Part {part_number}")
+    return {"PartNumber": part_number, "ETag": response.headers["ETag"]}
+
+def _upload_part(session, local_path, part_number, url, offset, length):
+    """
+    PUT one part of the file. Returns its {PartNumber, ETag}.
+    """
+    return _put_part(session, part_number, url, _read_part(local_path, offset, length))
+
+def _upload_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=UPLOAD_CONCURRENCY)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def upload_file_multipart(local_path, part_urls, part_size):
+    """
+    Uploads the file at local_path as parallel multipart parts using presigned part URLs.
+    The caller (API) completes the multipart upload with the returned parts.
+    """
+    file_size = os.path.getsize(local_path)
+    part_count = max(1, math.ceil(file_size / part_size))
+    if part_count > len(part_urls):
+        raise ValueError(f"Output needs {part_count} parts but only {len(part_urls)} part URLs were provided")
+
+    logger.info(f"Uploading output in {part_count} parts ({UPLOAD_CONCURRENCY} concurrent)...")
+    with _upload_session() as session:
+        with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as pool:
+            futures = [
+                pool.submit(
+                    _upload_part,
+                    session,
+                    local_path,
+                    n + 1,
+                    part_urls[n],
+                    n * part_size,
+                    min(part_size, file_size - n * part_size)
+                )
+                for n in range(part_count)
+            ]
+            parts = [future.result() for future in futures]
+
+    logger.info("Multipart upload successful.")
+    return parts
+
+def _part_digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+class StreamingMultipartUpload:
+    """
+    Uploads multipart parts of a file while another thread is still writing it.
+
+    A part is sent once the file has grown past its end. Writers such as the mp4 muxer
+    go back and patch earlier bytes when they finish (mdat size, or a faststart rewrite),
+    so finish() re-hashes every part sent early and uploads again only those that changed.
+    """
+
+    def __init__(self, local_path, part_urls, part_size):
+        self.local_path = local_path
+        self.part_urls = part_urls
+        self.part_size = part_size
+        self.session = _upload_session()
+        self.pool = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY)
+        # part_number -> future of (part, digest of the bytes sent)
+        self.sent = {}
+
+    def _send(self, part_number, length, previous=None):
+        """
+        Read and PUT one part. Reading happens here in the worker, so at most UPLOAD_CONCURRENCY
+        parts are in memory however far encoding runs ahead of the upload.
+        previous is the (part, digest) of an earlier upload of it; unchanged bytes are not sent again.
+        """
+        data = _read_part(self.local_path, (part_number - 1) * self.part_size, length)
+        digest = _part_digest(data)
+        if previous and previous[1] == digest:
+            return previous
+        return _put_part(self.session, part_number, self.part_urls[part_number - 1], data), digest
+
+    def _submit(self, part_number, length, previous=None):
+        self.sent[part_number] = self.pool.submit(self._send, part_number, length, previous)
+
+    def poll(self):
+        """
+        Queue every part that is complete in the file so far. Cheap; call it periodically.
+        """
+        try:
+            size = os.path.getsize(self.local_path)
+        except FileNotFoundError:
+            return
+        part_number = len(self.sent) + 1
+        # The last URL is kept for the end, and a part counts as written only once bytes follow it
+        while part_number < len(self.part_urls) and part_number * self.part_size < size:
+            self._submit(part_number, self.part_size)
+            part_number += 1
+
+    async def follow(self, writer):
+        """
+        Await writer (the coroutine producing the file), uploading parts as they appear.
+        """
+        task = asyncio.ensure_future(writer)
+        while not task.done():
+            await asyncio.wait({task}, timeout=STREAM_POLL_INTERVAL)
+            self.poll()
+        return task.result()
+
+    def finish(self):
+        """
+        Upload the rest of the now complete file, re-sending early parts whose bytes changed.
+        """
+        file_size = os.path.getsize(self.local_path)
+        part_count = max(1, math.ceil(file_size / self.part_size))
+        if part_count > len(self.part_urls):
+            raise ValueError(f"Output needs {part_count} parts but only {len(self.part_urls)} part URLs were provided")
+
+        early = {n: future.result() for n, future in self.sent.items()}
+        self.sent = {}
+        for n in range(1, part_count + 1):
+            self._submit(n, min(self.part_size, file_size - (n - 1) * self.part_size), early.get(n))
+        results = {n: future.result() for n, future in self.sent.items()}
+        resent = sum(1 for n, result in results.items() if result is not early.get(n))
+
+        logger.info(
+            f"Streamed upload finished: {part_count} parts, "
+            f"{part_count - resent} sent while encoding, {resent} at the end"
+        )
+        return [results[n][0] for n in sorted(results)]
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.session.close()
+
+def run_ffmpeg(*args):
+    result = subprocess.run(args, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{args[0]} failed ({result.returncode}): {result.stderr.decode(errors='replace')[-500:]}")
+    return result.stdout.decode()
+
+def ffmpeg_available():
+    return bool(shutil.which("ffmpeg") and shutil.which("ffprobe"))
+
+def probe_duration(path):
+    output = run_ffmpeg(
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        path
+    )
+    return float(output.strip())
+
+def split_into_chunks(input_path, out_dir, chunk_seconds):
+    """
+    Split at keyframes without re-encoding. Returns the chunk paths in order.
+    """
+    run_ffmpeg(
+        "ffmpeg", "-v", "error", "-y",
+        "-i", input_path,
+        "-map", "0:v:0", "-map", "0:a?",
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_time", str(chunk_seconds),
+        "-reset_timestamps", "1",
+        os.path.join(out_dir, "chunk_%04d.mp4")
+    )
+    return sorted(
+        os.path.join(out_dir, name)
+        for name in os.listdir(out_dir)
+        if name.startswith("chunk_")
+    )
+
+def concat_chunks(paths, output_path):
+    list_path = f"{output_path}.txt"
+    with open(list_path, "w") as f:
+        for path in paths:
+            escaped = path.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    try:
+        run_ffmpeg(
+            "ffmpeg", "-v", "error", "-y",
+            "-f", "concat", "-safe", "0",
+            "-i", list_path,
+            "-c", "copy",
+            "-movflags", "+faststart",
+            output_path
+        )
+    finally:
+        os.remove(list_path)
+
+def split_fmp4(data):
+    """
+    Split a fragmented MP4 into its init segment (ftyp + moov) and media segment (moof/mdat pairs).
+    """
+    init = bytearray()
+    media = bytearray()
+    offset = 0
+    while offset + 8 <= len(data):
+        size = int.from_bytes(data[offset:offset + 4], "big")
+        box_type = data[offset + 4:offset + 8]
+        if size == 1:
+            size = int.from_bytes(data[offset + 8:offset + 16], "big")
+        elif size == 0:
+            size = len(data) - offset
+        box = data[offset:offset + size]
+        if box_type in (b"ftyp", b"moov"):
+            init += box
+        elif box_type != b"mfra":
+            # The random access index at the end only makes sense for the whole file
+            media += box
+        offset += size
+    return bytes(init), bytes(media)
+
+class HlsPublisher:
+    """
+    Publishes upscaled chunks as HLS fMP4 segments and rewrites an EVENT playlist after each one.
+
+    Chunk i goes to init_urls[i] / segment_urls[i], named init_NNNN.mp4 / seg_NNNN.m4s in the
+    playlist (the names the API presigned them under). Chunks are encoded independently, so each
+    has its own init segment and timestamps restarting at zero, hence a discontinuity per chunk.
+    Progress ({"hls_segments": n}) is reported to RunPod so the API knows when playback can start.
+    publish() is blocking; call it from a worker thread, one chunk at a time and in order.
+    """
+
+    def __init__(self, event, output_hls, target_duration, chunk_count):
+        self.event = event
+        self.init_urls = output_hls["init_urls"]
+        self.segment_urls = output_hls["segment_urls"]
+        self.playlist_url = output_hls["playlist_url"]
+        self.target_duration = target_duration
+        self.chunk_count = chunk_count
+        self.durations = []
+        self.session = requests.Session()
+
+    def playlist(self):
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:7",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-INDEPENDENT-SEGMENTS",
+        ]
+        for index, duration in enumerate(self.durations):
+            if index:
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines.append(f'#EXT-X-MAP:URI="init_{index:04d}.mp4"')
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(f"seg_{index:04d}.m4s")
+        if len(self.durations) == self.chunk_count:
+            lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def publish(self, index, chunk_path):
+        fmp4_path = f"{chunk_path}.fmp4"
+        run_ffmpeg(
+            "ffmpeg", "-v", "error", "-y",
+            "-i", chunk_path,
+            "-c", "copy",
+            "-f", "mp4",
+            "-movflags", HLS_FMP4_FLAGS,
+            fmp4_path
+        )
+        with open(fmp4_path, "rb") as f:
+            init, media = split_fmp4(f.read())
+        os.remove(fmp4_path)
+
+        _put(self.session, self.init_urls[index], init, f"HLS init {index}", {"Content-Type": "video/mp4"})
+        _put(self.session, self.segment_urls[index], media, f"HLS segment {index}", {"Content-Type": "video/iso.segment"})
+        self.durations.append(probe_duration(chunk_path))
+        _put(
+            self.session, self.playlist_url, self.playlist().encode(), "HLS playlist",
+            {"Content-Type": "application/vnd.apple.mpegurl"}
+        )
+        runpod.serverless.progress_update(self.event, {"hls_segments": len(self.durations)})
+
+    def close(self):
+        self.session.close()
+
+async def process_in_chunks(event, input_path, output_path, work_dir, output_hls, process_kwargs, timings):
+    """
+    Upscale the input chunk by chunk, publishing each upscaled chunk as an HLS segment while the
+    next one runs, then join the chunks into output_path. Each chunk takes a GPU slot of its own.
+    A failing preview only stops the preview; the MP4 output is what the job is judged on.
+    Returns the number of published segments, or None if the input could not be chunked: nothing
+    has been upscaled yet then, and the caller processes the whole file instead.
+    """
+    chunk_dir = os.path.join(work_dir, "chunks")
+    try:
+        duration = await asyncio.to_thread(probe_duration, input_path)
+        chunk_seconds = max(output_hls["segment_seconds"], duration / len(output_hls["segment_urls"]))
+        os.makedirs(chunk_dir, exist_ok=True)
+        chunks = await asyncio.to_thread(split_into_chunks, input_path, chunk_dir, chunk_seconds)
+        if len(chunks) > len(output_hls["segment_urls"]):
+            raise ValueError(f"Input split into {len(chunks)} chunks but only {len(output_hls['segment_urls'])} segment URLs were provided")
+
+        # Keyframe snapping can stretch a chunk; the playlist must not promise less than the longest
+        longest = max(await asyncio.gather(*(asyncio.to_thread(probe_duration, chunk) for chunk in chunks)))
+    except Exception as e:
+        logger.warning(f"Cannot chunk the input, skipping the HLS preview: {e}")
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+        return None
+    publisher = HlsPublisher(event, output_hls, math.ceil(longest) + 1, len(chunks))
+    publishing = None
+
+    async def publish_after(previous, index, chunk_path):
+        if previous and not await previous:
+            return False
+        try:
+            await asyncio.to_thread(publisher.publish, index, chunk_path)
+            return True
+        except Exception as e:
+            logger.warning(f"HLS preview stopped at segment {index}: {e}")
+            return False
+
+    timings["gpu_wait"] = timings["inference"] = 0.0
+    outputs = []
+    try:
+        for index, chunk in enumerate(chunks):
+            chunk_output = os.path.join(chunk_dir, f"upscaled_{index:04d}.mp4")
+            stage_start = time.perf_counter()
+            async with gpu_semaphore():
+                timings["gpu_wait"] += time.perf_counter() - stage_start
+                stage_start = time.perf_counter()
+                await asyncio.to_thread(process_video, model, chunk, chunk_output, **process_kwargs)
+            timings["inference"] += time.perf_counter() - stage_start
+            outputs.append(chunk_output)
+            publishing = asyncio.create_task(publish_after(publishing, index, chunk_output))
+
+        stage_start = time.perf_counter()
+        await asyncio.to_thread(concat_chunks, outputs, output_path)
+        timings["concat"] = time.perf_counter() - stage_start
+    finally:
+        if publishing:
+            await publishing
+        publisher.close()
+    return len(publisher.durations)
+
+async def handler(event):
+    """
+    Runs concurrently with other jobs on this worker (see concurrency_modifier).
+    Download and upload run in threads and overlap other jobs' inference; inference itself
+    waits for a GPU slot and shares the global model.
+    """
     
     # 1. Parse Input
     job_input = event.get("input", {})
     video_source = job_input.get("video")
     # New: Accept a presigned URL to upload the result to
     output_upload_url = job_input.get("output_upload_url")
+    # Preferred: presigned part URLs for a parallel multipart upload ({"part_urls": [...], "part_size": N})
+    output_multipart = job_input.get("output_multipart")
+    # Optional presigned HLS targets for a progressive preview (see process_in_chunks)
+    output_hls = job_input.get("output_hls")
     
     target_width = job_input.get("target_width", 1920)
     target_height = job_input.get("target_height", 1080)
@@ -78,30 +573,60 @@ def handler(event):
         return {"error": "No video provided"}
         
     job_id = event.get("id", str(uuid.uuid4()))
-    temp_dir = f"/tmp/{job_id}"
-    os.makedirs(temp_dir, exist_ok=True)
+    work_root = work_dir_root()
+    temp_dir = os.path.join(work_root, job_id)
+    try:
+        os.makedirs(temp_dir, exist_ok=True)
+    except OSError:
+        release_work_dir(work_root)
+        raise
     
     input_path = os.path.join(temp_dir, "input.mp4")
     output_path = os.path.join(temp_dir, "output.mp4")
+    if output_hls and not ffmpeg_available():
+        logger.warning("ffmpeg not found, skipping the HLS preview")
+        output_hls = None
+    streamed_upload = None
     
     start_time = time.time()
+    # Per-stage wall time in seconds, reported back in metadata["timings"]
+    timings = {}
     
     try:
         # 2. Get Video
+        stage_start = time.perf_counter()
         if video_source.startswith("http"):
-            download_file(video_source, input_path)
+            await asyncio.to_thread(download_file, video_source, input_path)
+            timings["download"] = time.perf_counter() - stage_start
         else:
             # Assume base64
-            decode_base64(video_source, input_path)
+            await asyncio.to_thread(decode_base64, video_source, input_path)
+            timings["decode"] = time.perf_counter() - stage_start
             
         # 3. Process
-        process_video(
-            model,
-            input_path,
-            output_path,
-            target_resolution=(target_width, target_height),
-            quality_mode=quality
-        )
+        process_kwargs = {"target_resolution": (target_width, target_height), "quality_mode": quality}
+        hls_segments = None
+        if output_hls:
+            hls_segments = await process_in_chunks(
+                event, input_path, output_path, temp_dir, output_hls, process_kwargs, timings
+            )
+        if hls_segments is None:
+            # Streaming mode: multipart parts go out while the output is still being encoded.
+            # Only a whole-file output grows in place; a chunked one appears at once from the concat.
+            if STREAM_IO and output_multipart:
+                streamed_upload = StreamingMultipartUpload(
+                    output_path, output_multipart["part_urls"], output_multipart["part_size"]
+                )
+            stage_start = time.perf_counter()
+            async with gpu_semaphore():
+                timings["gpu_wait"] = time.perf_counter() - stage_start
+                stage_start = time.perf_counter()
+                inference = asyncio.to_thread(process_video, model, input_path, output_path, **process_kwargs)
+                if streamed_upload:
+                    await streamed_upload.follow(inference)
+                else:
+                    await inference
+            timings["inference"] = time.perf_counter() - stage_start
         
         processing_time = time.time() - start_time
         
@@ -111,19 +636,32 @@ def handler(event):
             "processing_time": processing_time,
             "metadata": {
                 "output_resolution": f"{target_width}x{target_height}",
-                "quality_mode": quality
+                "quality_mode": quality,
+                "output_size": os.path.getsize(output_path),
+                "hls_segments": hls_segments,
+                "timings": timings
             }
         }
 
         # Optimization: If Upload URL is provided, upload there and don't return Base64
-        if output_upload_url:
-            upload_file_to_presigned_url(output_path, output_upload_url)
+        stage_start = time.perf_counter()
+        if streamed_upload:
+            result["output_parts"] = await asyncio.to_thread(streamed_upload.finish)
+            result["message"] = "Output uploaded as multipart parts"
+        elif output_multipart:
+            result["output_parts"] = await asyncio.to_thread(
+                upload_file_multipart, output_path, output_multipart["part_urls"], output_multipart["part_size"]
+            )
+            result["message"] = "Output uploaded as multipart parts"
+        elif output_upload_url:
+            await asyncio.to_thread(upload_file_to_presigned_url, output_path, output_upload_url)
             result["message"] = "Output uploaded to provided URL"
         else:
             # Fallback for backward compatibility (small files)
             logger.warning("No output_upload_url provided. Returning Base64 (Might fail for large files).")
-            output_b64 = encode_file_to_base64(output_path)
+            output_b64 = await asyncio.to_thread(encode_file_to_base64, output_path)
             result["output_video"] = output_b64
+        timings["upload" if (output_multipart or output_upload_url) else "encode"] = time.perf_counter() - stage_start
         
         return result
 
@@ -133,11 +671,15 @@ def handler(event):
         
     finally:
         # Cleanup
+        if streamed_upload:
+            await asyncio.to_thread(streamed_upload.close)
         if os.path.exists(temp_dir):
-            import shutil
             shutil.rmtree(temp_dir)
+        release_work_dir(work_root)
 
 if __name__ == "__main__":
     # Cold start
     init_model()
-    runpod.serverless.start({"handler": handler})
+    gpu_slots = detect_gpu_slots()
+    logger.info(f"GPU slots: {gpu_slots}, concurrent jobs per worker: {concurrency_modifier(0)}")
+    runpod.serverless.start({"handler": handler, "concurrency_modifier": concurrency_modifier})